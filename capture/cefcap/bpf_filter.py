@@ -0,0 +1,354 @@
+# config から Linux のソケットフィルタ (classic BPF) を組み立て、キャプチャのソケットに付ける機能
+#
+# ICN_DISPLAY_FILTER は Wireshark の表示フィルタで、すべてのパケットをユーザー空間に
+# コピーしてから判定します。ここで作るフィルタはカーネル内で実行されるため、条件に
+# 合わないフレームはコピーされず、キャプチャの CPU 使用量はその分だけ減ります。
+#
+#   - CCNX_UDP_PORTS の UDP と CCNX_TCP_PORTS の TCP (送信元・宛先のどちらか) だけを通す
+#   - CAPTURE_BPF_PREFIXES を指定すると、名前がそのどれかで始まる CCNx パケットだけを通す
+#   - CAPTURE_SAMPLE_RATE が N (> 1) なら、通すフレームをさらに N 個に 1 個程度に間引く
+#
+# classic BPF にはループが無いため名前をハッシュすることはできません。プレフィックスは
+# Name TLV の先頭のセグメント (T, L, 値) を定数と直接比べます。分岐は前にしか進まないので、
+# 1フレームあたりの命令数は高々プログラムの長さ (プレフィックスのバイト数に比例) です。
+# IP フラグメントの2つ目以降と IPv6 の拡張ヘッダーつきのパケットは通しません
+# (tlv_decoder でもデコードしないため)。
+#
+# 使い方 (組み立てたフィルタの表示と、キャプチャファイルでの確認):
+#   python3 bpf_filter.py
+#   python3 bpf_filter.py --prefix /video --sample 4 --test captures/latest.pcapng
+
+import sys
+import ctypes
+import socket
+import struct
+import argparse
+
+import config
+
+# --- classic BPF の命令 (linux/filter.h) ---
+BPF_LD, BPF_LDX, BPF_ST, BPF_STX, BPF_ALU, BPF_JMP, BPF_RET, BPF_MISC = range(8)
+BPF_W, BPF_H, BPF_B = 0x00, 0x08, 0x10
+BPF_IMM, BPF_ABS, BPF_IND, BPF_MEM, BPF_LEN, BPF_MSH = 0x00, 0x20, 0x40, 0x60, 0x80, 0xA0
+BPF_ADD, BPF_SUB, BPF_MUL, BPF_DIV, BPF_OR, BPF_AND, BPF_LSH, BPF_RSH, BPF_NEG, BPF_MOD = (
+    0x00, 0x10, 0x20, 0x30, 0x40, 0x50, 0x60, 0x70, 0x80, 0x90)
+BPF_JA, BPF_JEQ, BPF_JGT, BPF_JGE, BPF_JSET = 0x00, 0x10, 0x20, 0x30, 0x40
+BPF_K, BPF_X = 0x00, 0x08
+BPF_A = 0x10
+BPF_TAX, BPF_TXA = 0x00, 0x80
+BPF_MEMWORDS = 16
+
+SKF_AD_OFF = -0x1000
+SKF_AD_RANDOM = 56
+SO_ATTACH_FILTER = getattr(socket, "SO_ATTACH_FILTER", 26)
+SO_DETACH_FILTER = getattr(socket, "SO_DETACH_FILTER", 27)
+
+_INSN = struct.Struct("HBBI")  # struct sock_filter
+
+MAX_PREFIX_BYTES = 96  # 1つのプレフィックスで比べる最大バイト数 (条件分岐の飛び先が 255 命令以内に収まるように)
+
+ACCEPT = "accept"
+REJECT = "reject"
+
+class _Assembler:
+    """
+    ラベルつきの命令列を組み立てます。同じ名前のラベルは何度でも定義でき、
+    分岐はその命令より後ろで最も近い定義に飛びます (REJECT などを近くに置くため)。
+    """
+
+    def __init__(self):
+        self.insns = []   # [code, jt, jf, k] (jt, jf はラベル名または None)
+        self.labels = []  # (命令の位置, ラベル名)
+
+    def label(self, name):
+        self.labels.append((len(self.insns), name))
+
+    def emit(self, code, k=0, jt=None, jf=None):
+        self.insns.append([code, jt, jf, k])
+
+    def _target(self, i, name):
+        for pos, label in self.labels:
+            if label == name and pos > i:
+                return pos
+        raise ValueError(f"undefined label after instruction {i}: {name}")
+
+    def assemble(self):
+        program = []
+        for i, (code, jt, jf, k) in enumerate(self.insns):
+            if code & 0x07 == BPF_JMP and code & 0xF0 == BPF_JA:
+                k = self._target(i, k) - i - 1 if isinstance(k, str) else k
+                program.append((code, 0, 0, k))
+                continue
+            offsets = []
+            for target in (jt, jf):
+                off = 0 if target is None else self._target(i, target) - i - 1
+                if not 0 <= off <= 255:
+                    raise ValueError(f"jump from instruction {i} to {target} is too far ({off})")
+                offsets.append(off)
+            program.append((code, offsets[0], offsets[1], k & 0xFFFFFFFF))
+        return program
+
+def _name_segments(prefix):
+    """"/a/b" や "ccnx:/a/b" を NameSegment の値 (bytes) のリストにします。"""
+    if prefix.startswith("ccnx:"):
+        prefix = prefix[len("ccnx:"):]
+    return [s.encode("utf-8") for s in prefix.strip("/").split("/") if s]
+
+def _emit_ports(asm, ports, ok_label):
+    """A 以外を壊さずに、X が指す L4 ヘッダーの送信元・宛先ポートが ports のどれかなら ok_label に飛びます。"""
+    for field in (0, 2):
+        asm.emit(BPF_LD | BPF_H | BPF_IND, field)
+        for port in ports:
+            asm.emit(BPF_JMP | BPF_JEQ | BPF_K, port, jt=ok_label)
+    asm.emit(BPF_RET | BPF_K, 0)
+
+def _emit_prefix(asm, segments, next_label):
+    """X が CCNx のメッセージ TLV を指しているとき、名前が segments で始まらなければ next_label に飛びます。"""
+    total = sum(4 + len(s) for s in segments)
+    if total > MAX_PREFIX_BYTES:
+        raise ValueError(f"prefix is too long for the kernel filter ({total} > {MAX_PREFIX_BYTES} bytes)")
+    asm.emit(BPF_LD | BPF_H | BPF_IND, 4)  # Name TLV の T
+    asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 0x0000, jf=next_label)
+    asm.emit(BPF_LD | BPF_H | BPF_IND, 6)  # Name TLV の L
+    asm.emit(BPF_JMP | BPF_JGE | BPF_K, total, jf=next_label)
+    pos = 8
+    for seg in segments:
+        asm.emit(BPF_LD | BPF_W | BPF_IND, pos)  # NameSegment の T と L
+        asm.emit(BPF_JMP | BPF_JEQ | BPF_K, (0x0001 << 16) | len(seg), jf=next_label)
+        pos += 4
+        i = 0
+        while i < len(seg):
+            rest = len(seg) - i
+            size, width = (BPF_W, 4) if rest >= 4 else (BPF_H, 2) if rest >= 2 else (BPF_B, 1)
+            asm.emit(BPF_LD | size | BPF_IND, pos + i)
+            asm.emit(BPF_JMP | BPF_JEQ | BPF_K, int.from_bytes(seg[i:i + width], "big"), jf=next_label)
+            i += width
+        pos += len(seg)
+
+def compile_filter(udp_ports=config.CCNX_UDP_PORTS, tcp_ports=config.CCNX_TCP_PORTS,
+                   prefixes=config.CAPTURE_BPF_PREFIXES, sample_rate=config.CAPTURE_SAMPLE_RATE,
+                   snaplen=config.CAPTURE_SNAPLEN):
+    """
+    イーサネットのフレームに対するフィルタを組み立て、(code, jt, jf, k) のリストで返します。
+    スクラッチメモリは M[0] = L4 プロトコル, M[1] = L4 ヘッダーの位置, M[2] = CCNx パケットの位置です。
+    """
+    asm = _Assembler()
+    # カーネルの検査は ret の直後の命令でもスクラッチメモリが書かれたかを調べるため、先に初期化しておく
+    asm.emit(BPF_LD | BPF_IMM, 0)
+    for cell in range(3):
+        asm.emit(BPF_ST, cell)
+    asm.emit(BPF_LD | BPF_H | BPF_ABS, 12)
+    asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 0x0800, jf="not_ipv4")
+    # IPv4
+    asm.emit(BPF_LD | BPF_H | BPF_ABS, 20)
+    asm.emit(BPF_JMP | BPF_JSET | BPF_K, 0x1FFF, jt=REJECT)  # 2つ目以降のフラグメント
+    asm.emit(BPF_LD | BPF_B | BPF_ABS, 23)
+    asm.emit(BPF_ST, 0)
+    asm.emit(BPF_LDX | BPF_B | BPF_MSH, 14)  # X = IHL * 4
+    asm.emit(BPF_MISC | BPF_TXA)
+    asm.emit(BPF_ALU | BPF_ADD | BPF_K, 14)
+    asm.emit(BPF_ST, 1)
+    asm.emit(BPF_JMP | BPF_JA, "l4")
+    asm.label("not_ipv4")
+    asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 0x86DD, jf=REJECT)
+    # IPv6 (拡張ヘッダー無し)
+    asm.emit(BPF_LD | BPF_B | BPF_ABS, 20)
+    asm.emit(BPF_ST, 0)
+    asm.emit(BPF_LD | BPF_IMM, 14 + 40)
+    asm.emit(BPF_ST, 1)
+    asm.emit(BPF_JMP | BPF_JA, "l4")
+
+    asm.label(REJECT)
+    asm.emit(BPF_RET | BPF_K, 0)
+    asm.label("l4")
+    asm.emit(BPF_LDX | BPF_MEM, 1)
+    asm.emit(BPF_LD | BPF_MEM, 0)
+    asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 17, jt="udp")
+    asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 6, jt="tcp")
+    asm.emit(BPF_RET | BPF_K, 0)
+    asm.label("udp")
+    _emit_ports(asm, udp_ports, "udp_ok")
+    asm.label("udp_ok")
+    asm.emit(BPF_LD | BPF_MEM, 1)
+    asm.emit(BPF_ALU | BPF_ADD | BPF_K, 8)
+    asm.emit(BPF_ST, 2)
+    asm.emit(BPF_JMP | BPF_JA, "ccnx")
+    asm.label("tcp")
+    _emit_ports(asm, tcp_ports, "tcp_ok")
+    asm.label("tcp_ok")
+    asm.emit(BPF_LD | BPF_B | BPF_IND, 12)  # データオフセット
+    asm.emit(BPF_ALU | BPF_RSH | BPF_K, 4)
+    asm.emit(BPF_ALU | BPF_LSH | BPF_K, 2)
+    asm.emit(BPF_ALU | BPF_ADD | BPF_X)
+    asm.emit(BPF_ST, 2)
+
+    asm.label("ccnx")
+    if prefixes:
+        asm.emit(BPF_LDX | BPF_MEM, 2)
+        asm.emit(BPF_LD | BPF_B | BPF_IND, 0)  # CCNx のバージョン
+        # 失敗時の飛び先はすぐ後ろに置く (末尾の REJECT はプレフィックスの数によっては 255 命令より遠い)
+        asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 1, jt="ccnx_v1")
+        asm.emit(BPF_RET | BPF_K, 0)
+        asm.label("ccnx_v1")
+        asm.emit(BPF_LD | BPF_B | BPF_IND, 7)  # 固定ヘッダー + ホップごとのヘッダーの長さ
+        asm.emit(BPF_ALU | BPF_ADD | BPF_X)
+        asm.emit(BPF_MISC | BPF_TAX)  # X = メッセージ TLV の位置
+        for i, prefix in enumerate(prefixes):
+            _emit_prefix(asm, _name_segments(prefix), f"prefix{i + 1}")
+            asm.emit(BPF_JMP | BPF_JA, "sample")
+            asm.label(f"prefix{i + 1}")
+        asm.label(REJECT)
+        asm.emit(BPF_RET | BPF_K, 0)
+
+    asm.label("sample")
+    if sample_rate and sample_rate > 1:
+        asm.emit(BPF_LD | BPF_W | BPF_ABS, SKF_AD_OFF + SKF_AD_RANDOM)
+        asm.emit(BPF_ALU | BPF_MOD | BPF_K, sample_rate)
+        asm.emit(BPF_JMP | BPF_JEQ | BPF_K, 0, jt=ACCEPT, jf=REJECT)
+    asm.label(ACCEPT)
+    asm.emit(BPF_RET | BPF_K, snaplen)
+    asm.label(REJECT)
+    asm.emit(BPF_RET | BPF_K, 0)
+    return asm.assemble()
+
+def config_filter():
+    """config の設定どおりのフィルタを返します (CAPTURE_BPF_ENABLED が False なら None)。"""
+    return compile_filter() if config.CAPTURE_BPF_ENABLED else None
+
+# --- ソケットへの取り付け ---
+
+def attach_filter(sock, program):
+    """
+    program をソケットに取り付けます。フィルタを付ける前に受信キューに入っていたフレームは、
+    いったんすべてを捨てるフィルタを付けてから読み捨てます。
+    戻り値のバッファはカーネルにコピーされた後は不要ですが、念のため呼び出し側で保持できます。
+    """
+    def fprog(insns):
+        buf = ctypes.create_string_buffer(b"".join(_INSN.pack(*insn) for insn in insns))
+        return buf, struct.pack("HL", len(insns), ctypes.addressof(buf))
+
+    drop_buf, drop = fprog([(BPF_RET | BPF_K, 0, 0, 0)])
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, drop)
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(1)
+    except (BlockingIOError, InterruptedError):
+        pass
+    finally:
+        sock.settimeout(timeout)
+    buf, prog = fprog(program)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, prog)
+    return buf
+
+def detach_filter(sock):
+    sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+
+# --- 確認用 ---
+
+def run_filter(program, frame, rand=None):
+    """program をユーザー空間で実行し、カーネルと同じく通すバイト数 (0 なら破棄) を返します。"""
+    a = x = 0
+    mem = [0] * BPF_MEMWORDS
+    pc = 0
+    n = len(frame)
+
+    def load(off, size):
+        if off == SKF_AD_OFF + SKF_AD_RANDOM:
+            return rand() if rand else 0
+        if off < 0 or off + size > n:
+            return None
+        return int.from_bytes(frame[off:off + size], "big")
+
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        cls = code & 0x07
+        if cls in (BPF_LD, BPF_LDX):
+            mode = code & 0xE0
+            size = {BPF_W: 4, BPF_H: 2, BPF_B: 1}[code & 0x18]
+            if mode == BPF_ABS:
+                v = load(k - 0x100000000 if k & 0x80000000 else k, size)
+            elif mode == BPF_IND:
+                v = load(x + k, size)
+            elif mode == BPF_MEM:
+                v = mem[k]
+            elif mode == BPF_IMM:
+                v = k
+            elif mode == BPF_LEN:
+                v = n
+            elif mode == BPF_MSH:
+                v = load(k, 1)
+                v = None if v is None else (v & 0x0F) * 4
+            if v is None:
+                return 0
+            if cls == BPF_LD:
+                a = v
+            else:
+                x = v
+        elif cls == BPF_ST:
+            mem[k] = a
+        elif cls == BPF_STX:
+            mem[k] = x
+        elif cls == BPF_ALU:
+            op = code & 0xF0
+            v = x if code & BPF_X else k
+            if op == BPF_ADD:
+                a = (a + v) & 0xFFFFFFFF
+            elif op == BPF_SUB:
+                a = (a - v) & 0xFFFFFFFF
+            elif op == BPF_AND:
+                a &= v
+            elif op == BPF_OR:
+                a |= v
+            elif op == BPF_LSH:
+                a = (a << v) & 0xFFFFFFFF
+            elif op == BPF_RSH:
+                a >>= v
+            elif op == BPF_MOD:
+                a %= v
+            else:
+                raise ValueError(f"unsupported ALU op 0x{code:02x}")
+        elif cls == BPF_JMP:
+            op = code & 0xF0
+            if op == BPF_JA:
+                pc += k
+                continue
+            v = x if code & BPF_X else k
+            cond = {BPF_JEQ: a == v, BPF_JGT: a > v, BPF_JGE: a >= v, BPF_JSET: bool(a & v)}[op]
+            pc += jt if cond else jf
+        elif cls == BPF_RET:
+            return a if code & BPF_A else k
+        elif cls == BPF_MISC:
+            if code & 0xF8 == BPF_TXA:
+                a = x
+            else:
+                x = a
+
+def main(argv=None):
+    import random
+    parser = argparse.ArgumentParser(description="Build the kernel capture filter from config")
+    parser.add_argument("--prefix", action="append", default=None, help="通す名前のプレフィックス (複数指定可)")
+    parser.add_argument("--sample", type=int, default=config.CAPTURE_SAMPLE_RATE, help="N 個に 1 個に間引く")
+    parser.add_argument("--test", default=None, help="フィルタを通るフレームを数えるキャプチャファイル")
+    args = parser.parse_args(argv)
+
+    prefixes = config.CAPTURE_BPF_PREFIXES if args.prefix is None else args.prefix
+    program = compile_filter(prefixes=prefixes, sample_rate=args.sample)
+    for i, (code, jt, jf, k) in enumerate(program):
+        print(f"({i:03d}) code=0x{code:02x} jt={jt:3d} jf={jf:3d} k=0x{k:08x}")
+    print(f"{len(program)} instructions")
+    if args.test:
+        from capture_source import open_capture_file
+        total = passed = 0
+        rng = random.Random(0)
+        for ts, linktype, frame in open_capture_file(args.test):
+            total += 1
+            if run_filter(program, frame, rand=lambda: rng.getrandbits(32)):
+                passed += 1
+        print(f"{passed} / {total} frames pass")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
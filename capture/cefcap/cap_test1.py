@@ -1,12 +1,16 @@
 
 # REQ:
-# pip install pyshark
-# sudo apt update
-# sudo apt install wireshark tshark
+# Linux (AF_PACKET) と root 権限 (または CAP_NET_RAW)
+# 以前の pyshark/tshark 版は1秒あたり数千パケットで取りこぼすため、
+# tlv_decoder.py で直接デコードする方式に置き換えました。
 
-import pyshark
 import time
 
+import config
+from bpf_filter import config_filter
+from capture_source import AfPacketCapture, PcapngWriter
+from tlv_decoder import decode_frame
+
 def capture_icn_traffic(interface="eth0", capture_duration=10, output_file="icn_capture.pcapng"):
     """
     指定されたネットワークインターフェースでICN (CCNx) 通信を一定時間キャプチャし、
@@ -17,22 +21,37 @@ def capture_icn_traffic(interface="eth0", capture_duration=10, output_file="icn_
         capture_duration (int): キャプチャする時間 (秒).
         output_file (str): キャプチャ結果を保存するファイル名 (例: "icn_capture.pcapng").
     """
+    capture = None
+    writer = None
     try:
         print(f"ICN (CCNx) 通信を {interface} で {capture_duration} 秒間キャプチャします...")
 
-        # CCNx プロトコルをフィルタリング
-        capture = pyshark.LiveCapture(interface=interface, display_filter='ccnx',
-                                      output_file=output_file)
+        capture = AfPacketCapture(interface, snaplen=config.CAPTURE_SNAPLEN, bpf_program=config_filter())
+        writer = PcapngWriter(output_file, capture.linktype, config.CAPTURE_SNAPLEN)
 
-        # 一定時間キャプチャを実行
-        capture.sniff(timeout=capture_duration)
+        # 一定時間キャプチャを実行 (CCNx パケットを含むフレームだけを保存)
+        n_frames = n_packets = 0
+        deadline = time.time() + capture_duration
+        for ts, linktype, frame in capture:
+            if ts >= deadline:
+                break
+            if frame is None:
+                continue
+            packets = decode_frame(frame, linktype)
+            if packets:
+                writer.write(ts, frame)
+                n_frames += 1
+                n_packets += len(packets)
 
-        print(f"キャプチャ終了。結果は {output_file} に保存されました。")
+        print(f"キャプチャ終了。{n_packets} 個の CCNx パケット ({n_frames} フレーム) を "
+              f"{output_file} に保存しました。 {capture.stats()}")
 
     except Exception as e:
         print(f"エラーが発生しました: {e}")
     finally:
-        if 'capture' in locals() and capture.is_capturing():
+        if writer is not None:
+            writer.close()
+        if capture is not None:
             capture.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,402 @@
+# キャプチャの入力 (pcap/pcapng ファイル, AF_PACKET ソケット) と pcapng への書き出し
+#
+# どの入力も (タイムスタンプ, LINKTYPE, フレーム) を順に返すイテレータで、
+# tlv_decoder.decode_frame にそのまま渡せます。
+
+import os
+import mmap
+import time
+import socket
+import struct
+
+from tlv_decoder import LINKTYPE_ETHERNET
+
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPT_IF_TSRESOL = 9
+
+ETH_P_ALL = 0x0003
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+
+# --- ファイルの読み込み ---
+
+def open_capture_file(path):
+    """pcap / pcapng ファイルを形式を判別して読み、(ts, linktype, frame) を順に返します。"""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if len(head) < 4:
+        return iter(())
+    if struct.unpack("<I", head)[0] == PCAPNG_SHB:
+        return read_pcapng(path)
+    return read_pcap(path)
+
+
+def read_pcap(path):
+    with open(path, "rb") as f:
+        header = f.read(24)
+        magic = struct.unpack("<I", header[:4])[0]
+        if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            endian = "<"
+        else:
+            endian = ">"
+            magic = struct.unpack(">I", header[:4])[0]
+            if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                raise ValueError(f"{path} is not a pcap file")
+        frac = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+        linktype = struct.unpack(endian + "I", header[20:24])[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + "IIII")
+        while True:
+            rh = f.read(16)
+            if len(rh) < 16:
+                return
+            ts_sec, ts_frac, incl_len, _ = record.unpack(rh)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return
+            yield ts_sec + ts_frac * frac, linktype, frame
+
+
+def _pcapng_tsresol(options, endian):
+    """IDB のオプションから1単位あたりの秒数を返します (既定はマイクロ秒)。"""
+    off = 0
+    while off + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, off)
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_IF_TSRESOL and length >= 1:
+            v = options[off + 4]
+            return 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0 ** -v
+        off += 4 + length + (-length % 4)
+    return 1e-6
+
+
+def read_pcapng(path):
+    with open(path, "rb") as f:
+        endian = "<"
+        interfaces = []  # (linktype, 1単位あたりの秒数)
+        while True:
+            bh = f.read(8)
+            if len(bh) < 8:
+                return
+            if struct.unpack("<I", bh[:4])[0] == PCAPNG_SHB:
+                bom = f.read(4)
+                endian = "<" if struct.unpack("<I", bom)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+                total = struct.unpack(endian + "I", bh[4:])[0]
+                f.seek(total - 12, os.SEEK_CUR)
+                interfaces = []  # セクションごとにインタフェースは振り直される
+                continue
+            btype, total = struct.unpack(endian + "II", bh)
+            body = f.read(total - 8)
+            if len(body) < total - 8:
+                return
+            if btype == PCAPNG_EPB:
+                iface, ts_high, ts_low, cap_len, _ = struct.unpack_from(endian + "IIIII", body)
+                linktype, resol = interfaces[iface]
+                yield ((ts_high << 32) | ts_low) * resol, linktype, body[20:20 + cap_len]
+            elif btype == PCAPNG_SPB:
+                orig_len = struct.unpack_from(endian + "I", body)[0]
+                linktype, _ = interfaces[0]
+                yield 0.0, linktype, body[4:4 + orig_len]
+            elif btype == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + "H", body)[0]
+                interfaces.append((linktype, _pcapng_tsresol(body[8:-4], endian)))
+
+
+# --- メモリマップでの読み込み ---
+
+PCAPNG_BLOCK_TYPES = frozenset((PCAPNG_SHB, PCAPNG_IDB, 0x00000002, PCAPNG_SPB, 0x00000004, 0x00000005,
+                                PCAPNG_EPB, 0x0000000A, 0x00000BAD, 0x40000BAD))
+RESYNC_CHAIN = 3  # 分割位置を決めるとき、正しいブロック (レコード) がこの数だけ続くことを確かめる
+
+
+class MappedCapture:
+    """
+    pcap / pcapng ファイルをメモリマップし、ブロックヘッダーを順にたどって
+    (ts, linktype, frame) を返します。frame はマップ上の memoryview で、read() もコピーもしません。
+    close() の前に、受け取った frame への参照は手放してください。
+
+    split(n) はファイルをブロックの境界で n 個の範囲に分け、iter_range(start, end) は
+    その範囲に始まるブロックだけを読むので、範囲ごとに別のプロセスで読めます。
+    pcapng のインタフェース (IDB) は最初のパケットより前にあるものを全範囲で共有します。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size < 24:
+            self._mm = None
+            self.buf = memoryview(b"")
+            self.format = None
+            self.data_start = self.size
+            return
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self._mm)
+        if struct.unpack_from("<I", self.buf, 0)[0] == PCAPNG_SHB:
+            self.format = "pcapng"
+            bom = struct.unpack_from("<I", self.buf, 8)[0]
+            self.endian = "<" if bom == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            self.data_start = 0
+            self._interfaces = self._leading_interfaces()
+        else:
+            self.format = "pcap"
+            magic = struct.unpack_from("<I", self.buf, 0)[0]
+            self.endian = "<"
+            if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                self.endian = ">"
+                magic = struct.unpack_from(">I", self.buf, 0)[0]
+                if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                    raise ValueError(f"{path} is not a pcap file")
+            self.frac = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+            self.snaplen, linktype = struct.unpack_from(self.endian + "II", self.buf, 16)
+            self.linktype = linktype & 0x0FFFFFFF
+            self.data_start = 24
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_range(self.data_start, self.size)
+
+    def close(self):
+        self.buf.release()
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    # --- pcapng ---
+
+    def _leading_interfaces(self):
+        """先頭から最初のパケットのブロックまでにある IDB を読みます。"""
+        interfaces = []
+        off = 0
+        block = struct.Struct(self.endian + "II")
+        while off + 12 <= self.size:
+            btype, total = block.unpack_from(self.buf, off)
+            if btype in (PCAPNG_EPB, PCAPNG_SPB, 0x00000002) or total < 12:
+                break
+            if btype == PCAPNG_IDB:
+                linktype = struct.unpack_from(self.endian + "H", self.buf, off + 8)[0]
+                options = bytes(self.buf[off + 16:off + total - 4])
+                interfaces.append((linktype, _pcapng_tsresol(options, self.endian)))
+            off += total
+        return interfaces
+
+    def _pcapng_block_ok(self, off):
+        if off + 12 > self.size:
+            return False
+        btype, total = struct.unpack_from(self.endian + "II", self.buf, off)
+        return (btype in PCAPNG_BLOCK_TYPES and total >= 12 and total % 4 == 0 and off + total <= self.size
+                and struct.unpack_from(self.endian + "I", self.buf, off + total - 4)[0] == total)
+
+    def _iter_pcapng(self, start, end):
+        buf = self.buf
+        endian = self.endian
+        block = struct.Struct(endian + "II")
+        epb = struct.Struct(endian + "IIII")
+        interfaces = list(self._interfaces) if start > 0 else []
+        off = start
+        size = self.size
+        while off < end and off + 12 <= size:
+            btype, total = block.unpack_from(buf, off)
+            if total < 12 or off + total > size:
+                return
+            if btype == PCAPNG_EPB:
+                iface, ts_high, ts_low, cap_len = epb.unpack_from(buf, off + 8)
+                linktype, resol = interfaces[iface]
+                yield ((ts_high << 32) | ts_low) * resol, linktype, buf[off + 28:off + 28 + cap_len]
+            elif btype == PCAPNG_SPB:
+                orig_len = struct.unpack_from(endian + "I", buf, off + 8)[0]
+                yield 0.0, interfaces[0][0], buf[off + 12:off + 12 + min(orig_len, total - 16)]
+            elif btype == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + "H", buf, off + 8)[0]
+                interfaces.append((linktype, _pcapng_tsresol(bytes(buf[off + 16:off + total - 4]), endian)))
+            elif btype == PCAPNG_SHB:
+                interfaces = []
+            off += total
+
+    # --- pcap ---
+
+    def _pcap_record_ok(self, off, record):
+        if off + 16 > self.size:
+            return False
+        _, ts_frac, incl_len, orig_len = record.unpack_from(self.buf, off)
+        return (incl_len <= max(self.snaplen, 262144) and incl_len <= orig_len <= 262144
+                and ts_frac < round(1 / self.frac) and off + 16 + incl_len <= self.size)
+
+    def _iter_pcap(self, start, end):
+        buf = self.buf
+        record = struct.Struct(self.endian + "IIII")
+        linktype = self.linktype
+        frac = self.frac
+        off = start
+        size = self.size
+        while off < end and off + 16 <= size:
+            ts_sec, ts_frac, incl_len, _ = record.unpack_from(buf, off)
+            off += 16
+            if off + incl_len > size:
+                return
+            yield ts_sec + ts_frac * frac, linktype, buf[off:off + incl_len]
+            off += incl_len
+
+    # --- 範囲 ---
+
+    def iter_range(self, start, end):
+        """start から始まり、先頭が end より前にあるブロック (レコード) を順に返します。"""
+        if self.format == "pcapng":
+            return self._iter_pcapng(start, end)
+        if self.format == "pcap":
+            return self._iter_pcap(start, end)
+        return iter(())
+
+    def _chain_ok(self, off):
+        """off から正しいブロック (レコード) が RESYNC_CHAIN 個続くか (ファイルの終わりまででもよい)。"""
+        if self.format == "pcapng":
+            for _ in range(RESYNC_CHAIN):
+                if off == self.size:
+                    return True
+                if not self._pcapng_block_ok(off):
+                    return False
+                off += struct.unpack_from(self.endian + "I", self.buf, off + 4)[0]
+            return True
+        record = struct.Struct(self.endian + "IIII")
+        for _ in range(RESYNC_CHAIN):
+            if off == self.size:
+                return True
+            if not self._pcap_record_ok(off, record):
+                return False
+            off += 16 + record.unpack_from(self.buf, off)[2]
+        return True
+
+    def _resync(self, off):
+        """off 以降で最初のブロック (レコード) の境界を返します。"""
+        step = 4 if self.format == "pcapng" else 1
+        off = max(off - (off - self.data_start) % step, self.data_start)
+        while off < self.size:
+            if self._chain_ok(off):
+                return off
+            off += step
+        return self.size
+
+    def split(self, n):
+        """ファイルをブロックの境界で最大 n 個の (start, end) に分けます。"""
+        if self.format is None or n <= 1:
+            return [(self.data_start, self.size)]
+        body = self.size - self.data_start
+        bounds = [self.data_start]
+        for i in range(1, n):
+            b = self._resync(self.data_start + body * i // n)
+            if b > bounds[-1]:
+                bounds.append(b)
+        if bounds[-1] < self.size:
+            bounds.append(self.size)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+# --- ファイルへの書き出し ---
+
+class PcapngWriter:
+    """フレームを pcapng (Section Header, Interface Description, Enhanced Packet) で書き出します。"""
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=65535):
+        self.f = open(path, "wb")
+        shb = struct.pack("<IHHq", PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)
+        self._block(PCAPNG_SHB, shb)
+        idb = struct.pack("<HHI", linktype, 0, snaplen)
+        idb += struct.pack("<HHB3x", PCAPNG_OPT_IF_TSRESOL, 1, 6) + struct.pack("<HH", 0, 0)
+        self._block(PCAPNG_IDB, idb)
+
+    def _block(self, btype, body):
+        body += b"\0" * (-len(body) % 4)
+        total = len(body) + 12
+        self.f.write(struct.pack("<II", btype, total) + body + struct.pack("<I", total))
+
+    def write(self, ts, frame, orig_len=None):
+        """フレームを1つ書き、その Enhanced Packet Block のファイル内の位置を返します。"""
+        offset = self.f.tell()
+        us = int(ts * 1_000_000)
+        header = struct.pack("<IIIII", 0, us >> 32, us & 0xFFFFFFFF, len(frame),
+                             len(frame) if orig_len is None else orig_len)
+        self._block(PCAPNG_EPB, header + bytes(frame))
+        return offset
+
+    def tell(self):
+        return self.f.tell()
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class PcapWriter:
+    """フレームを従来の pcap 形式 (マイクロ秒) で書き出します。"""
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=65535):
+        self.f = open(path, "wb")
+        self.f.write(struct.pack("<IHHiIII", PCAP_MAGIC_US, 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, ts, frame, orig_len=None):
+        us = int(round(ts * 1_000_000))
+        self.f.write(struct.pack("<IIII", us // 1_000_000, us % 1_000_000, len(frame),
+                                 len(frame) if orig_len is None else orig_len))
+        self.f.write(frame)
+
+    def close(self):
+        self.f.close()
+
+
+# --- ライブキャプチャ ---
+
+class AfPacketCapture:
+    """
+    AF_PACKET の raw ソケットでインタフェースのフレームを受信します (Linux, root 権限が必要)。
+
+    返すフレームは受信バッファの memoryview で、次の受信で上書きされます。
+    保持する場合は bytes() でコピーしてください。
+    """
+
+    def __init__(self, interface, snaplen=65535, timeout_sec=0.1, rcvbuf=None, bpf_program=None):
+        self.interface = interface
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        if rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((interface, 0))
+        if bpf_program is not None:
+            # bpf_filter.compile_filter の結果。条件に合わないフレームはカーネルで捨てられる
+            from bpf_filter import attach_filter
+            attach_filter(self.sock, bpf_program)
+        self.sock.settimeout(timeout_sec)
+        self._buf = bytearray(snaplen)
+        self._view = memoryview(self._buf)
+        self.linktype = LINKTYPE_ETHERNET
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """次のフレームを返します。タイムアウトした場合は (ts, linktype, None) を返します。"""
+        try:
+            n = self.sock.recv_into(self._buf)
+        except socket.timeout:
+            return time.time(), self.linktype, None
+        return time.time(), self.linktype, self._view[:n]
+
+    def stats(self):
+        """前回の呼び出し以降にカーネルが受け取ったパケット数と破棄したパケット数を返します。"""
+        packets, drops = struct.unpack("II", self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+        return {"kernel_packets": packets, "kernel_drops": drops}
+
+    def close(self):
+        self.sock.close()
@@ -15,13 +15,58 @@ ICN_DISPLAY_FILTER = f'{ICN_PROTOCOL_LAYER_NAME}' # ICNプロトコルレイヤ
 # ICN_DISPLAY_FILTER = f'{ICN_PROTOCOL_LAYER_NAME} or udp port 9695 or tcp port 9696'
 # ICN_DISPLAY_FILTER = f'ethertype 0x800' # IPv4の場合など、基盤プロトコルでフィルタしてからICNレイヤーをチェック
 
+# ネイティブキャプチャ (tlv_decoder.py) で CCNx パケットとして読むポート
+CCNX_UDP_PORTS = (9695,)       # cefnetd
+CCNX_TCP_PORTS = (9695, 9696)  # cefnetd, csmgrd
+
+# ライブキャプチャで1フレームあたり取り込む最大バイト数
+CAPTURE_SNAPLEN = 65535
+
+# ライブキャプチャのソケットに付けるカーネル内フィルタ (bpf_filter.py)
+# CCNX_UDP_PORTS / CCNX_TCP_PORTS 以外のフレームはカーネルで捨てられ、ユーザー空間にコピーされません
+CAPTURE_BPF_ENABLED = True
+CAPTURE_BPF_PREFIXES = ()  # 例: ("/video", "/iot/sensor")。空なら名前では絞り込まない
+CAPTURE_SAMPLE_RATE = 1    # N なら条件に合うフレームを N 個に 1 個程度に間引く (1 なら間引かない)
+
+# パイプライン (main.py) でのサンプリング (sampling.py)。統計は重みで元の量に戻し、誤差も出力する
+# "none": すべて処理 / "nth": SAMPLING_N 個に 1 個 / "flow": Interest/Data の組ごとに SAMPLING_FLOW_RATE の割合
+# "adaptive": プレフィックスごとに 1 秒あたり SAMPLING_TARGET_PPS 個程度まで
+SAMPLING_MODE = "none"
+SAMPLING_N = 10
+SAMPLING_FLOW_RATE = 0.1
+SAMPLING_TARGET_PPS = 1000
+
+# ディスク上のリングバッファへの連続キャプチャ (ringcap.py) の設定
+RINGCAP_SEGMENT_BYTES = 64 * 2 ** 20  # 1セグメント (pcapng ファイル) のサイズ
+RINGCAP_SEGMENTS = 16                 # 残すセグメント数 (これを超えたら古いものから削除)
+
+# キャプチャのパイプライン (main.py) の設定
+PIPELINE_PARSERS = None               # パーサープロセス数 (None なら CPU 数 - 2、最低1)
+PIPELINE_RING_SLOTS = 64              # 共有メモリのリングバッファのスロット数
+PIPELINE_SLOT_BYTES = 1 << 20         # 1スロット (1バッチ) のバイト数
+PIPELINE_BATCH_MAX_DELAY_SEC = 0.05   # スロットが埋まらなくてもパーサーに渡すまでの時間 (秒)
+PIPELINE_STATUS_INTERVAL_SEC = 5.0    # キューの長さや取りこぼし数を表示する間隔 (秒)
+
 # 統計集計時の名前正規化設定
 # Trueの場合、名前を '/' で分割し、指定深度までのプレフィックスで集計
 NORMALIZE_NAMES_BY_PREFIX = True
 PREFIX_DEPTH_FOR_STATS = 3 # 例: /prefix/level1/level2/... の場合、3を指定すると /prefix/level1/level2/ で集計
 
+# ストリーミング集計 (stats_collector.py) の設定
+STATS_MAX_PREFIXES = 4096          # 個別に数えるプレフィックスの最大数 (超えた分は Count-Min Sketch で推定)
+STATS_TOP_K = 50                   # あふれたプレフィックスのうち名前付きで報告する数
+STATS_SNAPSHOT_INTERVAL_SEC = 10.0 # 集計結果を出力する間隔 (秒)
+STATS_IDLE_SNAPSHOTS = 6           # この回数のスナップショットの間通信が無いプレフィックスの枠を解放する
+
 # RTT計算のタイムアウト (秒) - Interest送信後、この時間を超えてもDataが来なければRTT計測失敗とみなす
 RTT_TIMEOUT_SEC = 5.0
 
+# レポート (reporter.py) で集計をまとめる区間の幅 (秒)
+REPORT_INTERVAL_SEC = 300
+
 # RTT計算を有効にするか
 ENABLE_RTT_CALCULATION = True
+
+# RTT計測 (rtt_matcher.py) のタイミングホイールの1スロットの幅 (秒) と、応答待ちとして追跡する Interest の上限
+RTT_WHEEL_TICK_SEC = 0.1
+RTT_MAX_OUTSTANDING = 1_000_000
@@ -1 +1,513 @@
 # ツール実行エントリポイント、引数処理、全体の流れ
+#
+# キャプチャ・デコード・集計を段階に分けたパイプラインで動かします。
+#
+#   キャプチャスレッド : フレームを共有メモリのリングバッファのスロットに詰め、
+#                        いっぱいになった (または一定時間たった) スロットを task キューに渡す
+#   パーサープロセス群 : スロットのフレームをまとめてデコードし、結果を result キューに渡す
+#   集約プロセス       : バッチの番号順に並べ直して StatsCollector / RttMatcher に入れる
+#
+# キャプチャスレッドはフレームのコピー以外何もしないため、デコードや集計が追いつかない場合も
+# カーネルではなくリングバッファで (数えたうえで) 取りこぼします。ファイルの分析では
+# 取りこぼさず、空きスロットを待ちます。
+#
+# --sampling で処理するパケットを間引けます (sampling.py)。nth はキャプチャスレッドでフレームの
+# コピー前に、flow / adaptive はデコード後にパーサーで間引き、統計は重みで元の量に戻して
+# 誤差 (95% 信頼区間の半幅) を付けて表示します。RTT を測るなら Interest/Data の組が残る flow か
+# adaptive を使ってください。
+#
+# 使い方:
+#   python3 main.py analyze --file captures/some_capture.pcapng
+#   sudo python3 main.py live --interface eth0 --duration 60
+#   python3 main.py analyze --file captures/some_capture.pcapng --show-stats packet_types,name_frequency
+#   sudo python3 main.py live --interface eth0 --sampling flow --sample-rate 0.05
+
+import os
+import sys
+import time
+import json
+import math
+import queue
+import signal
+import struct
+import argparse
+import threading
+import multiprocessing as mp
+from collections import deque
+from multiprocessing import shared_memory
+
+import config
+from bpf_filter import config_filter
+from capture_source import AfPacketCapture, MappedCapture
+from rtt_matcher import RttMatcher, print_rows
+from sampling import SAMPLING_MODES, make_sampler
+from stats_collector import COUNTERS, StatsCollector
+from tlv_decoder import CcnxPacket, PACKET_TYPE_NAMES, decode_frame
+
+RECORD = struct.Struct("<dIH2x")  # スロット内の各フレームの前に置く (時刻, 長さ, LINKTYPE)
+BATCH_HEADER = struct.Struct("<I")  # スロットの先頭に置くフレーム数
+
+STATS_SECTIONS = ("packet_types", "name_frequency", "rtt", "pipeline")
+
+# ステージをまたいで共有するカウンター (mp.Array の添字)
+CAPTURED = 0          # キャプチャしたフレーム数
+RING_DROPS = 1        # 空きスロットが無く捨てたフレーム数
+BATCHES = 2           # パーサーに渡したバッチ数
+KERNEL_DROPS = 3      # カーネルで破棄されたフレーム数 (ライブキャプチャのみ)
+AGG_PACKETS = 4       # 集約した CCNx パケット数
+AGG_BATCHES = 5       # 集約したバッチ数
+REORDER_PENDING = 6   # 番号順を待っているバッチ数
+SAMPLED_OUT = 7       # キャプチャスレッドがサンプリング (nth) で間引いたフレーム数
+TRUNCATED = 8         # スロットに入りきらず、入る分だけ切り詰めたフレーム数
+PARSER_BASE = 9       # 以降、パーサーごとに (デコードしたバッチ数, CCNx パケット数, 間引いたパケット数)
+PARSER_STRIDE = 3     # パーサー1つ分のカウンターの数 (各カウンターは1つのプロセスだけが書き込む)
+COUNTER_NAMES = ("captured", "ring_drops", "batches", "kernel_drops",
+                 "aggregated_packets", "aggregated_batches", "reorder_pending", "sampled_out", "truncated")
+
+class FrameRing:
+    """共有メモリ上の固定長スロットの並び。スロットの空き管理はキャプチャスレッドが行います。"""
+
+    def __init__(self, n_slots, slot_bytes, name=None):
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        # spawn で起動した子プロセスは親と同じ resource_tracker を使うため、
+        # 接続しただけのプロセスが終了しても共有メモリは削除されない (削除は作成側の close(unlink=True))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def slot(self, i):
+        """スロット i の memoryview を返します (使い終わったら release() してください)。"""
+        return self.shm.buf[i * self.slot_bytes:(i + 1) * self.slot_bytes]
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# --- キャプチャ ---
+
+class CaptureStage(threading.Thread):
+    """
+    source の (ts, linktype, frame) をリングバッファのスロットに詰めて task キューに渡すスレッド。
+    lossless が False なら、空きスロットが無いときはフレームを捨てて RING_DROPS に数えます。
+    sampler (sampling.NthSampler) があれば、残さないフレームはコピーせず SAMPLED_OUT に数えます。
+    1スロットに入りきらないフレーム (スナップ長の大きいファイルなど) は先頭だけをコピーして TRUNCATED に数えます。
+    """
+
+    def __init__(self, source, ring, task_queue, free_queue, counters, stop_event,
+                 lossless=False, max_delay_sec=config.PIPELINE_BATCH_MAX_DELAY_SEC, deadline=None,
+                 sampler=None):
+        super().__init__(name="capture", daemon=True)
+        self.source = source
+        self.ring = ring
+        self.task_queue = task_queue
+        self.free_queue = free_queue
+        self.counters = counters
+        self.stop_event = stop_event
+        self.lossless = lossless
+        self.max_delay_sec = max_delay_sec
+        self.deadline = deadline
+        self.sampler = sampler
+        self.error = None
+        self._free = deque(range(ring.n_slots))
+        self._seq = 0
+        self._slot = None
+        self._view = None
+        self._off = 0
+        self._count = 0
+        self._batch_started = 0.0
+
+    def _reclaim(self, block=False):
+        try:
+            if block:
+                self._free.append(self.free_queue.get())
+            while True:
+                self._free.append(self.free_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _acquire(self):
+        self._reclaim()
+        while not self._free and self.lossless and not self.stop_event.is_set():
+            self._reclaim(block=True)
+        if not self._free:
+            return False
+        self._slot = self._free.popleft()
+        self._view = self.ring.slot(self._slot)
+        self._off = BATCH_HEADER.size
+        self._count = 0
+        self._batch_started = time.monotonic()
+        return True
+
+    def _flush(self):
+        if self._slot is None:
+            return
+        BATCH_HEADER.pack_into(self._view, 0, self._count)
+        self._view.release()
+        self.task_queue.put((self._seq, self._slot))
+        self._seq += 1
+        self.counters[BATCHES] += 1
+        self._slot = self._view = None
+
+    def run(self):
+        try:
+            self._run()
+        except Exception as e:
+            # 例外 (のトレースバック) はフレームの memoryview を参照しているので、文字列だけ残す
+            # (残っているとキャプチャファイルの mmap を閉じられない)
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self._flush()
+
+    def _run(self):
+        limit = self.ring.slot_bytes
+        room = limit - BATCH_HEADER.size - RECORD.size  # 1フレームに使える最大のバイト数
+        sampler = self.sampler
+        for ts, linktype, frame in self.source:
+            if self.stop_event.is_set() or (self.deadline is not None and ts >= self.deadline):
+                break
+            if frame is None:
+                # タイムアウト: 溜まっているフレームが古ければパーサーに渡す
+                if self._count and time.monotonic() - self._batch_started >= self.max_delay_sec:
+                    self._flush()
+                continue
+            self.counters[CAPTURED] += 1
+            if sampler is not None and not sampler.keep_frame():
+                self.counters[SAMPLED_OUT] += 1
+                continue
+            n = len(frame)
+            if n > room:
+                # デコーダーは途中で切れたメッセージを読み飛ばすので、入る分だけ渡す
+                frame = frame[:room]
+                n = room
+                self.counters[TRUNCATED] += 1
+            if self._slot is not None and self._off + RECORD.size + n > limit:
+                self._flush()
+            if self._slot is None and not self._acquire():
+                self.counters[RING_DROPS] += 1
+                continue
+            RECORD.pack_into(self._view, self._off, ts, n, linktype)
+            self._off += RECORD.size
+            self._view[self._off:self._off + n] = frame
+            self._off += n
+            self._count += 1
+            if time.monotonic() - self._batch_started >= self.max_delay_sec:
+                self._flush()
+
+# --- デコード ---
+
+def parser_main(worker_id, ring_name, n_slots, slot_bytes, task_queue, free_queue, result_queue, counters,
+                sampling=None):
+    """
+    スロットのフレームをデコードし、(バッチ番号, パケットのタプルのリスト) を集約プロセスに送ります。
+    タプルは (時刻, 重み, グループ, *CcnxPacket) です。sampling があれば make_sampler(**sampling) で間引きます。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 終了はキャプチャ側の番兵で行う
+    ring = FrameRing(n_slots, slot_bytes, name=ring_name)
+    sampler = make_sampler(**sampling) if sampling else None
+    base = PARSER_BASE + PARSER_STRIDE * worker_id
+    try:
+        while True:
+            item = task_queue.get()
+            if item is None:
+                break
+            seq, slot = item
+            view = ring.slot(slot)
+            packets = []
+            sampled_out = 0
+            try:
+                n = BATCH_HEADER.unpack_from(view, 0)[0]
+                off = BATCH_HEADER.size
+                for _ in range(n):
+                    ts, length, linktype = RECORD.unpack_from(view, off)
+                    off += RECORD.size
+                    for p in decode_frame(view[off:off + length], linktype):
+                        if sampler is None:
+                            packets.append((ts, 1, None, *p))
+                            continue
+                        weight, group = sampler.keep(ts, p)
+                        if weight:
+                            packets.append((ts, weight, group, *p))
+                        else:
+                            sampled_out += 1
+                    off += length
+            finally:
+                view.release()
+                free_queue.put(slot)
+            result_queue.put((seq, packets))
+            counters[base] += 1
+            counters[base + 1] += len(packets)
+            counters[base + 2] += sampled_out
+    finally:
+        result_queue.put((None, worker_id))
+        ring.close()
+
+# --- 集約 ---
+
+def merge_snapshot(totals, snapshot):
+    """
+    StatsCollector のスナップショットをプレフィックスごとの累計に足し込みます。
+    サンプリングした区間の誤差 (*_err) は区間どうし独立とみなして二乗和の平方根で合わせます。
+    """
+    for row in snapshot["prefixes"]:
+        t = totals.setdefault(row["prefix"], dict.fromkeys(COUNTERS, 0))
+        for key in COUNTERS:
+            t[key] += row[key]
+            err = row.get(key + "_err")
+            if err is not None:
+                t[key + "_err"] = round(math.hypot(t.get(key + "_err", 0), err))
+    for row in snapshot["overflow"]["top"]:
+        t = totals.setdefault(row["prefix"], dict.fromkeys(COUNTERS, 0))
+        t["data_bytes"] += row["data_bytes_est"]
+
+def aggregator_main(result_queue, report_queue, n_parsers, counters, depth, snapshot_interval_sec,
+                    snapshot_file, live, base_weight=1):
+    """
+    パーサーの結果をバッチ番号順に集計し、終了時に最終結果を report_queue に送ります。
+    パケットの重みには、パーサーより前 (カーネルやキャプチャスレッド) で間引いた分の base_weight を掛けます。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    prefix_totals = {}
+    out = open(snapshot_file, "a") if snapshot_file else None
+
+    def on_snapshot(snapshot):
+        merge_snapshot(prefix_totals, snapshot)
+        if out is not None:
+            out.write(json.dumps(snapshot) + "\n")
+            out.flush()
+        if live:
+            top = ", ".join(f"{r['prefix']}={r['data_bytes']}B" for r in snapshot["prefixes"][:3])
+            print(f"[{time.strftime('%H:%M:%S', time.localtime(snapshot['end']))}] "
+                  f"{snapshot['total_packets']} packets, {len(snapshot['prefixes'])} prefixes {top}",
+                  file=sys.stderr)
+
+    collector = StatsCollector(depth=depth, snapshot_interval_sec=snapshot_interval_sec, on_snapshot=on_snapshot)
+    matcher = RttMatcher(depth=depth)
+    packet_types = {}
+    sampled = base_weight != 1
+    pending = {}
+    next_seq = 0
+    done = 0
+    last_ts = None
+    while done < n_parsers:
+        seq, payload = result_queue.get()
+        if seq is None:
+            done += 1
+            continue
+        pending[seq] = payload
+        while next_seq in pending:
+            packets = pending.pop(next_seq)
+            next_seq += 1
+            for t in packets:
+                p = CcnxPacket(*t[3:])
+                weight = t[1] * base_weight
+                if weight != 1:
+                    sampled = True
+                collector.add(t[0], p, weight, t[2])
+                matcher.add(t[0], p)
+                packet_types[p.ptype] = packet_types.get(p.ptype, 0) + weight
+            if packets:
+                last_ts = packets[-1][0]
+            counters[AGG_BATCHES] += 1
+            counters[AGG_PACKETS] += len(packets)
+        counters[REORDER_PENDING] = len(pending)
+    if last_ts is not None:
+        collector.emit_snapshot(last_ts)
+    matcher.flush()
+    if out is not None:
+        out.close()
+    report_queue.put({
+        "packet_types": {PACKET_TYPE_NAMES.get(k, f"type{k}"): round(v) for k, v in sorted(packet_types.items())},
+        "prefixes": prefix_totals,
+        "sampled": sampled,
+        "rtt_prefixes": matcher.prefix_rows(),
+        "rtt_hops": matcher.hop_rows(),
+        "rtt_counters": matcher.counters(),
+    })
+
+# --- パイプライン ---
+
+def pipeline_counters(counters, n_parsers, task_queue, result_queue):
+    """各ステージのキューの長さと取りこぼし数などを辞書で返します。"""
+    stats = {name: counters[i] for i, name in enumerate(COUNTER_NAMES)}
+    stats["parsed_batches"] = [counters[PARSER_BASE + PARSER_STRIDE * i] for i in range(n_parsers)]
+    stats["parsed_packets"] = [counters[PARSER_BASE + PARSER_STRIDE * i + 1] for i in range(n_parsers)]
+    stats["sampled_out"] += sum(counters[PARSER_BASE + PARSER_STRIDE * i + 2] for i in range(n_parsers))
+    try:
+        stats["task_queue_depth"] = task_queue.qsize()
+        stats["result_queue_depth"] = result_queue.qsize()
+    except NotImplementedError:  # macOS
+        pass
+    return stats
+
+def run_pipeline(source, lossless, args, deadline=None, kernel_stats=None, kernel_sample_rate=1):
+    """
+    source をパイプラインで分析してレポートの辞書を返します。
+    kernel_sample_rate はカーネル (bpf_filter) で N 個に 1 個に間引いている場合の N です。
+    """
+    ctx = mp.get_context("spawn")
+    n_parsers = args.parsers or max(1, (os.cpu_count() or 2) - 2)
+    capture_sampler = None
+    parser_sampling = None
+    base_weight = kernel_sample_rate
+    if args.sampling == "nth":
+        capture_sampler = make_sampler("nth", n=args.sample_n)
+        if capture_sampler is not None:
+            base_weight *= capture_sampler.n
+    elif args.sampling != "none":
+        # パーサーはそれぞれ全体のおよそ 1/n_parsers のパケットを見るので、目標レートも分ける
+        parser_sampling = {"mode": args.sampling, "rate": args.sample_rate,
+                           "target_pps": args.target_pps / n_parsers, "depth": args.depth}
+    counters = ctx.Array("q", PARSER_BASE + PARSER_STRIDE * n_parsers, lock=False)
+    ring = FrameRing(args.ring_slots, args.slot_bytes)
+    task_queue = ctx.Queue()
+    free_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    report_queue = ctx.Queue()
+    stop_event = threading.Event()
+
+    parsers = [ctx.Process(target=parser_main, name=f"parser-{i}",
+                           args=(i, ring.name, ring.n_slots, ring.slot_bytes,
+                                 task_queue, free_queue, result_queue, counters, parser_sampling))
+               for i in range(n_parsers)]
+    aggregator = ctx.Process(target=aggregator_main, name="aggregator",
+                             args=(result_queue, report_queue, n_parsers, counters, args.depth,
+                                   args.snapshot_interval, args.snapshot_file, not lossless, base_weight))
+    for p in parsers + [aggregator]:
+        p.start()
+    capture = CaptureStage(source, ring, task_queue, free_queue, counters, stop_event,
+                           lossless=lossless, deadline=deadline, sampler=capture_sampler)
+    capture.start()
+
+    report = None
+    try:
+        next_status = time.monotonic() + args.status_interval
+        while capture.is_alive():
+            capture.join(0.2)
+            if kernel_stats is not None:
+                counters[KERNEL_DROPS] += kernel_stats()["kernel_drops"]
+            if time.monotonic() >= next_status:
+                next_status += args.status_interval
+                stats = pipeline_counters(counters, n_parsers, task_queue, result_queue)
+                print("pipeline: " + " ".join(f"{k}={v}" for k, v in stats.items()), file=sys.stderr)
+    except KeyboardInterrupt:
+        stop_event.set()
+        capture.join()
+    finally:
+        for _ in parsers:
+            task_queue.put(None)
+        for p in parsers:
+            p.join()
+        report = report_queue.get()
+        aggregator.join()
+        report["pipeline"] = pipeline_counters(counters, n_parsers, task_queue, result_queue)
+        ring.close(unlink=True)
+    if capture.error is not None:
+        print(f"キャプチャ中にエラーが発生しました: {capture.error}", file=sys.stderr)
+    return report
+
+# --- 出力 ---
+
+def print_report(report, sections, limit=20):
+    sampled = report.get("sampled", False)
+    if sampled:
+        print("(sampled: counts are estimates, ± is the 95% confidence half-width)")
+        print()
+    if "packet_types" in sections:
+        print("== packet types ==")
+        for kind, n in report["packet_types"].items():
+            print(f"{kind:20} {n:>10}")
+        print()
+    if "name_frequency" in sections:
+        print("== prefixes ==")
+        print(f"{'prefix':40} {'interests':>10} {'data':>10} {'returns':>8} {'data bytes':>12}")
+        rows = sorted(report["prefixes"].items(), key=lambda kv: kv[1]["interests"] + kv[1]["data"], reverse=True)
+        for prefix, t in rows[:limit]:
+            print(f"{prefix[:40]:40} {t['interests']:>10} {t['data']:>10} {t['interest_returns']:>8} "
+                  f"{t['data_bytes']:>12}")
+            if sampled:
+                print(f"{'':40} {'±' + str(t.get('interests_err', 0)):>10} {'±' + str(t.get('data_err', 0)):>10} "
+                      f"{'±' + str(t.get('interest_returns_err', 0)):>8} {'±' + str(t.get('data_bytes_err', 0)):>12}")
+        print()
+    if "rtt" in sections:
+        print("== RTT ==")
+        if sampled:
+            print("(counts below are of sampled packets)")
+        print(" ".join(f"{k}={v}" for k, v in report["rtt_counters"].items()))
+        print_rows(report["rtt_prefixes"], "prefix", limit)
+        print_rows(report["rtt_hops"], "hop", limit)
+        print()
+    if "pipeline" in sections:
+        print("== pipeline ==")
+        for k, v in report["pipeline"].items():
+            print(f"{k:20} {v}")
+
+def parse_sections(value):
+    sections = [s.strip() for s in value.split(",") if s.strip()]
+    for s in sections:
+        if s not in STATS_SECTIONS:
+            raise argparse.ArgumentTypeError(f"unknown stats section: {s} (choose from {', '.join(STATS_SECTIONS)})")
+    return sections
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ICN (CCNx) traffic monitor")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--show-stats", type=parse_sections, default=list(STATS_SECTIONS),
+                        help=f"表示する統計 (カンマ区切り: {','.join(STATS_SECTIONS)})")
+    common.add_argument("--depth", type=int, default=config.PREFIX_DEPTH_FOR_STATS, help="集計するプレフィックスの深さ")
+    common.add_argument("--limit", type=int, default=20, help="表示する行数")
+    common.add_argument("--parsers", type=int, default=config.PIPELINE_PARSERS,
+                        help="パーサープロセス数 (既定: CPU 数 - 2)")
+    common.add_argument("--ring-slots", type=int, default=config.PIPELINE_RING_SLOTS, help="リングバッファのスロット数")
+    common.add_argument("--slot-bytes", type=int, default=config.PIPELINE_SLOT_BYTES, help="1スロットのバイト数")
+    common.add_argument("--snapshot-interval", type=float, default=config.STATS_SNAPSHOT_INTERVAL_SEC,
+                        help="集計結果を区切る間隔 (秒)")
+    common.add_argument("--snapshot-file", default=None, help="区間ごとの集計を JSON Lines で追記するファイル")
+    common.add_argument("--status-interval", type=float, default=config.PIPELINE_STATUS_INTERVAL_SEC,
+                        help="パイプラインの状態を表示する間隔 (秒)")
+    common.add_argument("--sampling", choices=SAMPLING_MODES, default=config.SAMPLING_MODE,
+                        help="パケットの間引き方 (nth: N 個に 1 個, flow: Interest/Data の組ごと, "
+                             "adaptive: プレフィックスごとに目標レートまで)")
+    common.add_argument("--sample-n", type=int, default=config.SAMPLING_N, help="nth で残す間隔 N")
+    common.add_argument("--sample-rate", type=float, default=config.SAMPLING_FLOW_RATE,
+                        help="flow で残す組の割合 (0 < rate <= 1)")
+    common.add_argument("--target-pps", type=float, default=config.SAMPLING_TARGET_PPS,
+                        help="adaptive でプレフィックスごとに残す 1 秒あたりのパケット数")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_analyze = sub.add_parser("analyze", parents=[common], help="キャプチャファイルを分析する")
+    p_analyze.add_argument("--file", required=True, help="pcap / pcapng ファイル")
+    p_live = sub.add_parser("live", parents=[common], help="インタフェースをライブ監視する (root 権限が必要)")
+    p_live.add_argument("--interface", required=True, help="監視するインタフェース (例: eth0)")
+    p_live.add_argument("--duration", type=float, default=None, help="監視する時間 (秒)。省略時は Ctrl-C まで")
+    args = parser.parse_args(argv)
+
+    if args.slot_bytes < BATCH_HEADER.size + RECORD.size + config.CAPTURE_SNAPLEN:
+        parser.error(f"--slot-bytes must be at least {BATCH_HEADER.size + RECORD.size + config.CAPTURE_SNAPLEN}")
+    if args.sample_n < 1 or not 0 < args.sample_rate <= 1 or args.target_pps <= 0:
+        parser.error("--sample-n must be >= 1, --sample-rate in (0, 1] and --target-pps > 0")
+
+    if args.command == "analyze":
+        with MappedCapture(args.file) as capture:
+            report = run_pipeline(iter(capture), lossless=True, args=args)
+    else:
+        bpf_program = config_filter()
+        capture = AfPacketCapture(args.interface, snaplen=config.CAPTURE_SNAPLEN, bpf_program=bpf_program)
+        deadline = time.time() + args.duration if args.duration else None
+        print(f"{args.interface} を監視しています...", file=sys.stderr)
+        try:
+            report = run_pipeline(capture, lossless=False, args=args, deadline=deadline,
+                                  kernel_stats=capture.stats,
+                                  kernel_sample_rate=config.CAPTURE_SAMPLE_RATE if bpf_program else 1)
+        finally:
+            capture.close()
+    print_report(report, args.show_stats, args.limit)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
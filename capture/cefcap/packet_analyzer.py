@@ -1 +1,275 @@
-# Pysharkを使ってパケットからICN情報を抽出する機能
+# キャプチャファイルの CCNx パケットを列指向の NumPy 配列に読み込み、
+# プレフィックスごとのスループット・Interest/Data 比・損失・RTT をベクトル演算で求める機能
+#
+# 以前は Pyshark で1パケットずつ情報を取り出す想定でしたが、tlv_decoder で
+# デコードした結果を列ごとの配列に溜め、集計はすべて配列演算で行います。
+
+import sys
+import argparse
+import multiprocessing as mp
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import config
+from capture_source import MappedCapture
+from tlv_decoder import PT_INTEREST, PT_OBJECT, PT_INTEREST_RETURN, decode_frame
+from utils import normalize_name, format_addr
+
+NO_CHUNK = -1
+
+class PacketTable:
+    """
+    キャプチャ中の CCNx パケットの列指向の表
+
+    ts, ptype, name_id, chunk, packet_len, payload_len, src_id, dst_id, sport, dport
+    の各列が同じ長さの NumPy 配列で、name_id / src_id / dst_id はそれぞれ
+    names / addrs の添字です。チャンク番号の無いパケットの chunk は NO_CHUNK です。
+    """
+
+    COLUMNS = (("ts", "d"), ("ptype", "B"), ("name_id", "I"), ("chunk", "q"),
+               ("packet_len", "I"), ("payload_len", "I"), ("src_id", "I"), ("dst_id", "I"),
+               ("sport", "H"), ("dport", "H"))
+
+    def __init__(self, columns, names, addrs):
+        for key, _ in self.COLUMNS:
+            setattr(self, key, columns[key])
+        self.names = names
+        self.addrs = addrs
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def from_packets(cls, packets):
+        """(ts, CcnxPacket) の列から表を作ります。"""
+        builder = TableBuilder()
+        for ts, p in packets:
+            builder.add(ts, p)
+        return builder.build()
+
+    @property
+    def duration(self):
+        return float(self.ts.max() - self.ts.min()) if len(self) > 1 else 0.0
+
+    def prefix_ids(self, depth=config.PREFIX_DEPTH_FOR_STATS):
+        """
+        各パケットの名前を depth までのプレフィックスにまとめ、(プレフィックスの添字の配列,
+        プレフィックスのリスト) を返します。正規化は異なる名前ごとに1回だけ行います。
+        """
+        prefixes = {}
+        name_to_prefix = np.fromiter(
+            (prefixes.setdefault(normalize_name(n, depth), len(prefixes)) for n in self.names),
+            dtype=np.uint32, count=len(self.names))
+        return name_to_prefix[self.name_id], list(prefixes)
+
+class TableBuilder:
+    """デコードしたパケットを1つずつ受け取り、列ごとの array に溜めます。"""
+
+    def __init__(self):
+        self._cols = {key: array(code) for key, code in PacketTable.COLUMNS}
+        self._names = {}
+        self._addrs = {}
+
+    def add(self, ts, p):
+        c = self._cols
+        names = self._names
+        addrs = self._addrs
+        c["ts"].append(ts)
+        c["ptype"].append(p.ptype)
+        c["name_id"].append(names.setdefault(p.name, len(names)))
+        c["chunk"].append(NO_CHUNK if p.chunk is None else p.chunk)
+        c["packet_len"].append(p.packet_len)
+        c["payload_len"].append(p.payload_len)
+        c["src_id"].append(addrs.setdefault(p.src, len(addrs)))
+        c["dst_id"].append(addrs.setdefault(p.dst, len(addrs)))
+        c["sport"].append(p.sport)
+        c["dport"].append(p.dport)
+
+    def build(self):
+        columns = {key: np.frombuffer(a, dtype=a.typecode) if len(a) else np.zeros(0, a.typecode)
+                   for key, a in self._cols.items()}
+        return PacketTable(columns, list(self._names), [format_addr(a) for a in self._addrs])
+
+def concat_tables(tables):
+    """ファイルの順に並んだ PacketTable をつなげ、names / addrs の添字を振り直します。"""
+    names = {}
+    addrs = {}
+    columns = {key: [] for key, _ in PacketTable.COLUMNS}
+    for t in tables:
+        name_map = np.array([names.setdefault(n, len(names)) for n in t.names], dtype=np.uint32)
+        addr_map = np.array([addrs.setdefault(a, len(addrs)) for a in t.addrs], dtype=np.uint32)
+        for key, _ in PacketTable.COLUMNS:
+            col = getattr(t, key)
+            if len(col) and key == "name_id":
+                col = name_map[col]
+            elif len(col) and key in ("src_id", "dst_id"):
+                col = addr_map[col]
+            columns[key].append(col)
+    columns = {key: np.concatenate(cols).astype(code) if cols else np.zeros(0, code)
+               for (key, code), cols in zip(PacketTable.COLUMNS, columns.values())}
+    return PacketTable(columns, list(names), list(addrs))
+
+def load_range(path, start, end, max_packets=None):
+    """キャプチャファイルの [start, end) に始まるブロックの CCNx パケットを PacketTable に読み込みます。"""
+    builder = TableBuilder()
+    n = 0
+    frame = None
+    with MappedCapture(path) as capture:
+        for ts, linktype, frame in capture.iter_range(start, end):
+            for p in decode_frame(frame, linktype):
+                builder.add(ts, p)
+                n += 1
+            if max_packets is not None and n >= max_packets:
+                break
+        frame = None  # マップを閉じる前に memoryview を手放す
+    return builder.build()
+
+def load_capture(path, max_packets=None, workers=1):
+    """
+    キャプチャファイルの CCNx パケットを PacketTable に読み込みます。
+    workers が 2 以上なら、ファイルをブロックの境界で分けて複数のプロセスでデコードします。
+    """
+    with MappedCapture(path) as capture:
+        ranges = capture.split(workers if max_packets is None else 1)
+    if len(ranges) == 1:
+        return load_range(path, *ranges[0], max_packets=max_packets)
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(len(ranges), mp_context=ctx) as pool:
+        tables = list(pool.map(load_range, [path] * len(ranges), *zip(*ranges)))
+    return concat_tables(tables)
+
+# --- 集計 ---
+
+def match_interest_data(table):
+    """
+    Interest と Data を (名前, チャンク, 経路) で対応づけます。
+
+    Data は、同じ名前・チャンクで宛先と送信元が逆向きの Interest のうち、その Data より
+    前で最も新しいものと対応づけます (その間に別の Data があれば重複として扱いません)。
+    戻り値は (対応した Interest の行番号, Data の行番号, RTT 秒) の配列の組です。
+    """
+    is_interest = table.ptype == PT_INTEREST
+    is_data = table.ptype == PT_OBJECT
+    rows = np.flatnonzero(is_interest | is_data)
+    if len(rows) == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, np.zeros(0)
+    interest = is_interest[rows]
+    # 経路は (消費者, 次ホップ) の向きにそろえる
+    consumer = np.where(interest, table.src_id[rows], table.dst_id[rows])
+    hop = np.where(interest, table.dst_id[rows], table.src_id[rows])
+    order = np.lexsort((table.ts[rows], hop, consumer, table.chunk[rows], table.name_id[rows]))
+    rows = rows[order]
+    interest = interest[order]
+    keys = (table.name_id[rows], table.chunk[rows], consumer[order], hop[order])
+    new_group = np.ones(len(rows), dtype=bool)
+    new_group[1:] = np.logical_or.reduce([k[1:] != k[:-1] for k in keys])
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(rows)), 0))
+    idx = np.arange(len(rows))
+    last_interest = np.maximum.accumulate(np.where(interest, idx, -1))
+    # 各行より前の最後の Data の位置
+    last_data = np.maximum.accumulate(np.where(~interest, idx, -1))
+    prev_data = np.empty_like(last_data)
+    prev_data[0] = -1
+    prev_data[1:] = last_data[:-1]
+    matched = (~interest) & (last_interest >= group_start) & (last_interest > prev_data)
+    data_rows = rows[matched]
+    interest_rows = rows[last_interest[matched]]
+    rtt = table.ts[data_rows] - table.ts[interest_rows]
+    return interest_rows, data_rows, rtt
+
+def summarize_by_prefix(table, depth=config.PREFIX_DEPTH_FOR_STATS, rtt_timeout=config.RTT_TIMEOUT_SEC):
+    """
+    プレフィックスごとの集計を、列の辞書 (各値は NumPy 配列) とプレフィックスのリストで返します。
+
+      interests, data, interest_returns : パケット数
+      data_bytes        : Data の Payload の合計バイト数
+      throughput_bps    : data_bytes をキャプチャ全体の時間で割ったもの
+      interest_data_ratio
+      unanswered, loss_rate : rtt_timeout 以内に Data が来なかった Interest の数と割合
+      rtt_p50_ms, rtt_p95_ms, rtt_p99_ms, rtt_mean_ms
+    """
+    prefix_of, prefixes = table.prefix_ids(depth)
+    n = len(prefixes)
+    is_interest = table.ptype == PT_INTEREST
+    is_data = table.ptype == PT_OBJECT
+    interests = np.bincount(prefix_of[is_interest], minlength=n)
+    data = np.bincount(prefix_of[is_data], minlength=n)
+    returns = np.bincount(prefix_of[table.ptype == PT_INTEREST_RETURN], minlength=n)
+    data_bytes = np.bincount(prefix_of[is_data], weights=table.payload_len[is_data], minlength=n)
+    duration = table.duration
+
+    interest_rows, _, rtt = match_interest_data(table)
+    ok = rtt <= rtt_timeout
+    answered = np.bincount(prefix_of[interest_rows[ok]], minlength=n)
+    unanswered = interests - answered
+
+    rtt_ms = rtt[ok] * 1000
+    rtt_prefix = prefix_of[interest_rows[ok]]
+    percentiles = np.full((n, 4), np.nan)
+    if len(rtt_ms):
+        order = np.lexsort((rtt_ms, rtt_prefix))
+        rtt_ms, rtt_prefix = rtt_ms[order], rtt_prefix[order]
+        bounds = np.searchsorted(rtt_prefix, np.arange(n + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            group = rtt_ms[bounds[i]:bounds[i + 1]]
+            percentiles[i, :3] = np.percentile(group, (50, 95, 99))
+            percentiles[i, 3] = group.mean()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary = {
+            "interests": interests,
+            "data": data,
+            "interest_returns": returns,
+            "data_bytes": data_bytes.astype(np.int64),
+            "throughput_bps": data_bytes * 8 / duration if duration > 0 else np.zeros(n),
+            "interest_data_ratio": np.where(data > 0, interests / np.maximum(data, 1), np.nan),
+            "unanswered": unanswered,
+            "loss_rate": np.where(interests > 0, unanswered / np.maximum(interests, 1), np.nan),
+            "rtt_p50_ms": percentiles[:, 0],
+            "rtt_p95_ms": percentiles[:, 1],
+            "rtt_p99_ms": percentiles[:, 2],
+            "rtt_mean_ms": percentiles[:, 3],
+        }
+    return summary, prefixes
+
+def summary_rows(summary, prefixes, sort_by="data_bytes"):
+    """集計結果を、sort_by の大きい順に並べた辞書のリストにします。"""
+    order = np.argsort(-summary[sort_by], kind="stable")
+    return [dict(prefix=prefixes[i], **{k: v[i].item() for k, v in summary.items()}) for i in order]
+
+def print_summary(rows, limit=20):
+    print(f"{'prefix':40} {'interests':>10} {'data':>10} {'Mbps':>9} {'I/D':>6} {'loss':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for r in rows[:limit]:
+        print(f"{r['prefix'][:40]:40} {r['interests']:>10} {r['data']:>10} "
+              f"{r['throughput_bps'] / 1e6:>9.3f} {r['interest_data_ratio']:>6.2f} "
+              f"{r['loss_rate']:>7.2%} {r['rtt_p50_ms']:>8.2f} {r['rtt_p99_ms']:>8.2f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze CCNx packets in a capture file")
+    parser.add_argument("file", help="pcap / pcapng ファイル")
+    parser.add_argument("--depth", type=int, default=config.PREFIX_DEPTH_FOR_STATS,
+                        help="集計するプレフィックスの深さ")
+    parser.add_argument("--limit", type=int, default=20, help="表示するプレフィックス数")
+    parser.add_argument("--csv", default=None, help="全プレフィックスの集計を書き出す CSV ファイル")
+    parser.add_argument("--workers", type=int, default=1, help="ファイルを分けてデコードするプロセス数")
+    args = parser.parse_args(argv)
+
+    table = load_capture(args.file, workers=args.workers)
+    print(f"{len(table)} CCNx packets, {len(table.names)} names, {table.duration:.1f} s")
+    summary, prefixes = summarize_by_prefix(table, args.depth)
+    rows = summary_rows(summary, prefixes)
+    print_summary(rows, args.limit)
+    if args.csv:
+        import csv
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["prefix"])
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,422 @@
 # 収集した統計を整形して出力する機能
+#
+# キャプチャのセグメント (ringcap.py のリングや cap_test1.py の pcapng) を集計した結果を
+# SQLite に溜め、そこからレポート (HTML / CSV / JSON) を作ります。
+#
+#   seg_* テーブル      : セグメントごと・区間 (REPORT_INTERVAL_SEC) ごとの部分集計
+#   interval_* テーブル : それを区間ごとに足し合わせたもの (レポートはここだけを読む)
+#
+# update は前回から大きさか更新時刻の変わったセグメントだけを読み直し、そのセグメントの
+# 部分集計を置き換えてから、影響のあった区間の interval_* だけを作り直します。
+# そのため、かかる時間は履歴全体ではなく新しいデータの量に比例します。
+# リングから消えたセグメントの集計は残るので、履歴はリングより長く保てます。
+# (セグメントをまたぐ Interest と Data は対応づけないため、境界付近の RTT は少し欠けます)
+#
+# 使い方:
+#   python3 reporter.py update --db report.sqlite3 --ring ring
+#   python3 reporter.py update --db report.sqlite3 captures/*.pcapng
+#   python3 reporter.py report --db report.sqlite3 --format html --out report.html --start 2025-01-01T00:00
+
+import os
+import sys
+import csv
+import html
+import json
+import math
+import sqlite3
+import argparse
+import datetime
+
+import numpy as np
+
+import config
+from packet_analyzer import load_capture, match_interest_data
+from rtt_matcher import RttHistogram
+from tlv_decoder import PT_INTEREST, PT_OBJECT, PT_INTEREST_RETURN
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL,
+    start REAL, end REAL, packets INTEGER);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+
+CREATE TABLE IF NOT EXISTS seg_prefix (
+    segment_id INTEGER, interval INTEGER, prefix TEXT, interests INTEGER, data INTEGER,
+    interest_returns INTEGER, data_bytes INTEGER, rtt_count INTEGER, rtt_sum REAL);
+CREATE TABLE IF NOT EXISTS seg_face (
+    segment_id INTEGER, interval INTEGER, face TEXT,
+    tx_packets INTEGER, tx_bytes INTEGER, rx_packets INTEGER, rx_bytes INTEGER);
+CREATE TABLE IF NOT EXISTS seg_rtt (
+    segment_id INTEGER, interval INTEGER, prefix TEXT, bucket INTEGER, count INTEGER);
+CREATE INDEX IF NOT EXISTS seg_prefix_segment ON seg_prefix (segment_id);
+CREATE INDEX IF NOT EXISTS seg_prefix_interval ON seg_prefix (interval);
+CREATE INDEX IF NOT EXISTS seg_face_segment ON seg_face (segment_id);
+CREATE INDEX IF NOT EXISTS seg_face_interval ON seg_face (interval);
+CREATE INDEX IF NOT EXISTS seg_rtt_segment ON seg_rtt (segment_id);
+CREATE INDEX IF NOT EXISTS seg_rtt_interval ON seg_rtt (interval);
+
+CREATE TABLE IF NOT EXISTS interval_prefix (
+    interval INTEGER, prefix TEXT, interests INTEGER, data INTEGER, interest_returns INTEGER,
+    data_bytes INTEGER, rtt_count INTEGER, rtt_sum REAL, PRIMARY KEY (interval, prefix));
+CREATE TABLE IF NOT EXISTS interval_face (
+    interval INTEGER, face TEXT, tx_packets INTEGER, tx_bytes INTEGER, rx_packets INTEGER,
+    rx_bytes INTEGER, PRIMARY KEY (interval, face));
+CREATE TABLE IF NOT EXISTS interval_rtt (
+    interval INTEGER, prefix TEXT, bucket INTEGER, count INTEGER, PRIMARY KEY (interval, prefix, bucket));
+"""
+
+# 部分集計の列 (seg_* と interval_* で共通)
+PREFIX_COLUMNS = ("interests", "data", "interest_returns", "data_bytes", "rtt_count", "rtt_sum")
+FACE_COLUMNS = ("tx_packets", "tx_bytes", "rx_packets", "rx_bytes")
+
+def rtt_histogram():
+    """RTT の分布に使うビンの定義 (rtt_matcher.RttHistogram と同じもの)"""
+    return RttHistogram(max_sec=config.RTT_TIMEOUT_SEC)
+
+def open_db(path, interval_sec=None, depth=None):
+    """
+    集計の DB を開きます。区間の幅とプレフィックスの深さは最初に作ったときの値を使い続けます。
+    None を渡すと、既存の DB ではその値を、新しい DB では config の値を使います
+    (既存の DB と違う値を渡すと ValueError)。
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    stored = dict(conn.execute("SELECT key, value FROM meta"))
+    if not stored:
+        stored = {"interval_sec": str(config.REPORT_INTERVAL_SEC), "depth": str(config.PREFIX_DEPTH_FOR_STATS),
+                  "rtt_buckets": str(rtt_histogram().n_buckets)}
+        if interval_sec is not None:
+            stored["interval_sec"] = str(int(interval_sec))
+        if depth is not None:
+            stored["depth"] = str(depth)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", stored.items())
+        conn.commit()
+        return conn
+    requested = {"interval_sec": stored["interval_sec"] if interval_sec is None else str(int(interval_sec)),
+                 "depth": stored["depth"] if depth is None else str(depth),
+                 "rtt_buckets": str(rtt_histogram().n_buckets)}
+    if stored != requested:
+        conn.close()
+        raise ValueError(f"{path} was built with {stored}, not {requested}")
+    return conn
+
+def db_settings(conn):
+    stored = dict(conn.execute("SELECT key, value FROM meta"))
+    return int(stored["interval_sec"]), int(stored["depth"])
+
+# --- セグメントの集計 ---
+
+def _group(keys):
+    """keys (同じ長さの整数配列の組) の組み合わせごとに行をまとめ、(一意なキーの配列, 逆引き) を返します。"""
+    if len(keys[0]) == 0:
+        return np.zeros((0, len(keys)), dtype=np.int64), np.zeros(0, dtype=np.intp)
+    stacked = np.stack([np.asarray(k, dtype=np.int64) for k in keys], axis=1)
+    keys, inv = np.unique(stacked, axis=0, return_inverse=True)
+    return keys, inv.reshape(-1)
+
+def summarize_segment(path, interval_sec, depth):
+    """
+    キャプチャファイル1つを区間ごとに集計し、(prefix の行, face の行, rtt の行, 開始時刻, 終了時刻, パケット数)
+    を返します。各行は (interval, 名前, 値...) のタプルです。
+    """
+    table = load_capture(path)
+    n = len(table)
+    if n == 0:
+        return [], [], [], None, None, 0
+    interval = (table.ts // interval_sec).astype(np.int64) * interval_sec
+    prefix_of, prefixes = table.prefix_ids(depth)
+
+    # プレフィックス
+    keys, inv = _group((interval, prefix_of))
+    m = len(keys)
+    is_interest = table.ptype == PT_INTEREST
+    is_data = table.ptype == PT_OBJECT
+    values = {
+        "interests": np.bincount(inv, weights=is_interest, minlength=m),
+        "data": np.bincount(inv, weights=is_data, minlength=m),
+        "interest_returns": np.bincount(inv, weights=table.ptype == PT_INTEREST_RETURN, minlength=m),
+        "data_bytes": np.bincount(inv, weights=np.where(is_data, table.payload_len, 0), minlength=m),
+    }
+    interest_rows, _, rtt = match_interest_data(table)
+    ok = rtt <= config.RTT_TIMEOUT_SEC
+    interest_rows, rtt = interest_rows[ok], rtt[ok]
+    values["rtt_count"] = np.bincount(inv[interest_rows], minlength=m)
+    values["rtt_sum"] = np.bincount(inv[interest_rows], weights=rtt, minlength=m)
+    prefix_rows = [(int(keys[i, 0]), prefixes[keys[i, 1]],
+                    *(int(values[c][i]) for c in PREFIX_COLUMNS[:-1]), float(values["rtt_sum"][i]))
+                   for i in range(m)]
+
+    # 面 (IP アドレス) ごとの送受信
+    face_totals = {}
+    for addr_col, offset in ((table.src_id, 0), (table.dst_id, 2)):
+        fkeys, finv = _group((interval, addr_col))
+        packets = np.bincount(finv, minlength=len(fkeys))
+        nbytes = np.bincount(finv, weights=table.packet_len, minlength=len(fkeys))
+        for i, (iv, addr) in enumerate(fkeys.tolist()):
+            row = face_totals.setdefault((iv, table.addrs[addr]), [0, 0, 0, 0])
+            row[offset] += int(packets[i])
+            row[offset + 1] += int(nbytes[i])
+    face_rows = [(iv, face, *row) for (iv, face), row in face_totals.items()]
+
+    # RTT のヒストグラム
+    hist = rtt_histogram()
+    bucket = np.clip(np.floor(np.log(np.maximum(rtt, hist.min_sec) / hist.min_sec) * hist.scale),
+                     0, hist.n_buckets - 1).astype(np.int64)
+    rkeys, rinv = _group((interval[interest_rows], prefix_of[interest_rows], bucket))
+    counts = np.bincount(rinv, minlength=len(rkeys))
+    rtt_rows = [(iv, prefixes[p], b, int(counts[i])) for i, (iv, p, b) in enumerate(rkeys.tolist())]
+    return prefix_rows, face_rows, rtt_rows, float(table.ts.min()), float(table.ts.max()), n
+
+def update_segment(conn, path):
+    """
+    path が前回から変わっていれば部分集計を置き換え、影響のあった区間の集合を返します
+    (変わっていなければ空集合)。
+    """
+    st = os.stat(path)
+    path = os.path.abspath(path)
+    row = conn.execute("SELECT id, size, mtime FROM segments WHERE path = ?", (path,)).fetchone()
+    if row is not None and row[1] == st.st_size and row[2] == st.st_mtime:
+        return set()
+    interval_sec, depth = db_settings(conn)
+    prefix_rows, face_rows, rtt_rows, start, end, n = summarize_segment(path, interval_sec, depth)
+    touched = {r[0] for r in prefix_rows} | {r[0] for r in face_rows}
+    with conn:
+        if row is None:
+            seg_id = conn.execute("INSERT INTO segments (path, size, mtime, start, end, packets) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", (path, st.st_size, st.st_mtime, start, end, n)).lastrowid
+        else:
+            seg_id = row[0]
+            for table in ("seg_prefix", "seg_face", "seg_rtt"):
+                touched.update(iv for (iv,) in conn.execute(
+                    f"SELECT DISTINCT interval FROM {table} WHERE segment_id = ?", (seg_id,)))
+                conn.execute(f"DELETE FROM {table} WHERE segment_id = ?", (seg_id,))
+            conn.execute("UPDATE segments SET size = ?, mtime = ?, start = ?, end = ?, packets = ? WHERE id = ?",
+                         (st.st_size, st.st_mtime, start, end, n, seg_id))
+        conn.executemany(f"INSERT INTO seg_prefix VALUES (?, ?, ?, {', '.join('?' * len(PREFIX_COLUMNS))})",
+                         [(seg_id, *r) for r in prefix_rows])
+        conn.executemany(f"INSERT INTO seg_face VALUES (?, ?, ?, {', '.join('?' * len(FACE_COLUMNS))})",
+                         [(seg_id, *r) for r in face_rows])
+        conn.executemany("INSERT INTO seg_rtt VALUES (?, ?, ?, ?, ?)", [(seg_id, *r) for r in rtt_rows])
+    return touched
+
+def refresh_intervals(conn, intervals):
+    """intervals の区間だけ、interval_* をセグメントの部分集計から作り直します。"""
+    if not intervals:
+        return
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS touched (interval INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM touched")
+        conn.executemany("INSERT INTO touched VALUES (?)", [(iv,) for iv in intervals])
+        for target, source, keys, columns in (
+                ("interval_prefix", "seg_prefix", ("prefix",), PREFIX_COLUMNS),
+                ("interval_face", "seg_face", ("face",), FACE_COLUMNS),
+                ("interval_rtt", "seg_rtt", ("prefix", "bucket"), ("count",))):
+            group = ", ".join(("interval",) + keys)
+            sums = ", ".join(f"SUM({c})" for c in columns)
+            conn.execute(f"DELETE FROM {target} WHERE interval IN (SELECT interval FROM touched)")
+            conn.execute(f"INSERT INTO {target} SELECT {group}, {sums} FROM {source} "
+                         f"WHERE interval IN (SELECT interval FROM touched) GROUP BY {group}")
+
+def update(conn, paths):
+    """paths のセグメントを取り込み、(読み直したセグメント数, 作り直した区間数) を返します。"""
+    touched = set()
+    n_updated = 0
+    for path in paths:
+        changed = update_segment(conn, path)
+        if changed:
+            n_updated += 1
+            touched |= changed
+    refresh_intervals(conn, touched)
+    return n_updated, len(touched)
+
+def ring_segments(directory):
+    """ringcap.py のリングにある pcapng のパス (古い順)"""
+    from ringcap import load_manifest, segment_path
+    manifest = load_manifest(directory) or {"segments": []}
+    paths = [segment_path(directory, seg["seq"], ".pcapng") for seg in manifest["segments"]]
+    return [p for p in paths if os.path.exists(p)]
+
+# --- レポート ---
+
+def _where(start, end):
+    clauses, params = [], []
+    if start is not None:
+        clauses.append("interval >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("interval < ?")
+        params.append(end)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def _histogram(bucket_counts):
+    hist = rtt_histogram()
+    for bucket, count in bucket_counts:
+        hist.counts[bucket] += count
+        hist.count += count
+    hist.min, hist.max = 0.0, math.inf  # 元の最小・最大値は持っていないのでビンの代表値で答える
+    return hist
+
+def build_report(conn, start=None, end=None, top=20):
+    """[start, end) の区間の集計をまとめた辞書を返します。"""
+    interval_sec, depth = db_settings(conn)
+    where, params = _where(start, end)
+    intervals = [iv for (iv,) in conn.execute(
+        f"SELECT DISTINCT interval FROM interval_face{where} ORDER BY interval", params)]
+    duration = len(intervals) * interval_sec
+
+    prefixes = []
+    for prefix, *vals in conn.execute(
+            f"SELECT prefix, {', '.join(f'SUM({c})' for c in PREFIX_COLUMNS)} FROM interval_prefix{where} "
+            f"GROUP BY prefix ORDER BY SUM(data_bytes) DESC, SUM(interests) DESC LIMIT ?", params + [top]):
+        row = dict(zip(PREFIX_COLUMNS, vals), prefix=prefix)
+        row["throughput_bps"] = row["data_bytes"] * 8 / duration if duration else 0.0
+        row["unanswered"] = row["interests"] - row["rtt_count"]
+        row["rtt_mean_ms"] = row["rtt_sum"] / row["rtt_count"] * 1000 if row["rtt_count"] else None
+        hist = _histogram(conn.execute(
+            f"SELECT bucket, SUM(count) FROM interval_rtt{where}{' AND' if where else ' WHERE'} prefix = ? "
+            "GROUP BY bucket", params + [prefix]))
+        for q in (50, 90, 99):
+            row[f"rtt_p{q}_ms"] = hist.quantile(q / 100) * 1000 if hist.count else None
+        del row["rtt_sum"]
+        prefixes.append(row)
+
+    faces = []
+    for face, *vals in conn.execute(
+            f"SELECT face, {', '.join(f'SUM({c})' for c in FACE_COLUMNS)} FROM interval_face{where} "
+            "GROUP BY face ORDER BY SUM(tx_bytes) + SUM(rx_bytes) DESC LIMIT ?", params + [top]):
+        row = dict(zip(FACE_COLUMNS, vals), face=face)
+        row["tx_bps"] = row["tx_bytes"] * 8 / duration if duration else 0.0
+        row["rx_bps"] = row["rx_bytes"] * 8 / duration if duration else 0.0
+        faces.append(row)
+
+    hist = _histogram(conn.execute(f"SELECT bucket, SUM(count) FROM interval_rtt{where} GROUP BY bucket", params))
+    distribution = [{"lo_ms": hist.min_sec * math.exp(i / hist.scale) * 1000,
+                     "hi_ms": hist.min_sec * math.exp((i + 1) / hist.scale) * 1000, "count": c}
+                    for i, c in enumerate(hist.counts) if c]
+    return {
+        "start": intervals[0] if intervals else None,
+        "end": intervals[-1] + interval_sec if intervals else None,
+        "interval_sec": interval_sec,
+        "depth": depth,
+        "prefixes": prefixes,
+        "faces": faces,
+        "rtt": {
+            "count": hist.count,
+            "p50_ms": hist.quantile(0.5) * 1000 if hist.count else None,
+            "p90_ms": hist.quantile(0.9) * 1000 if hist.count else None,
+            "p99_ms": hist.quantile(0.99) * 1000 if hist.count else None,
+            "distribution": distribution,
+        },
+    }
+
+def _fmt_time(ts):
+    return datetime.datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts is not None else "-"
+
+def _fmt(v, spec=".2f"):
+    return "-" if v is None else format(v, spec)
+
+def write_csv(report, out_base):
+    """<out_base>_prefixes.csv, <out_base>_faces.csv, <out_base>_rtt.csv を書き出し、パスのリストを返します。"""
+    paths = []
+    for name, rows in (("prefixes", report["prefixes"]), ("faces", report["faces"]),
+                       ("rtt", report["rtt"]["distribution"])):
+        path = f"{out_base}_{name}.csv"
+        with open(path, "w", newline="") as f:
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+def render_html(report):
+    e = html.escape
+    out = ["<!DOCTYPE html><html><head><meta charset='utf-8'><title>ICN capture report</title>",
+           "<style>body{font-family:sans-serif}table{border-collapse:collapse}"
+           "td,th{border:1px solid #ccc;padding:2px 6px;text-align:right}td:first-child{text-align:left}"
+           ".bar{background:#4a90d9;height:10px}</style></head><body>",
+           f"<h1>ICN capture report</h1><p>{_fmt_time(report['start'])} - {_fmt_time(report['end'])} "
+           f"(interval {report['interval_sec']} s, prefix depth {report['depth']})</p>"]
+
+    out.append("<h2>Top prefixes</h2><table><tr><th>prefix</th><th>interests</th><th>data</th><th>returns</th>"
+               "<th>unanswered</th><th>Mbps</th><th>RTT p50 ms</th><th>p90 ms</th><th>p99 ms</th></tr>")
+    for r in report["prefixes"]:
+        out.append(f"<tr><td>{e(r['prefix'])}</td><td>{r['interests']}</td><td>{r['data']}</td>"
+                   f"<td>{r['interest_returns']}</td><td>{r['unanswered']}</td><td>{r['throughput_bps'] / 1e6:.3f}</td>"
+                   f"<td>{_fmt(r['rtt_p50_ms'])}</td><td>{_fmt(r['rtt_p90_ms'])}</td><td>{_fmt(r['rtt_p99_ms'])}</td></tr>")
+    out.append("</table>")
+
+    out.append("<h2>Bandwidth per face</h2><table><tr><th>face</th><th>tx packets</th><th>tx Mbps</th>"
+               "<th>rx packets</th><th>rx Mbps</th></tr>")
+    for r in report["faces"]:
+        out.append(f"<tr><td>{e(r['face'])}</td><td>{r['tx_packets']}</td><td>{r['tx_bps'] / 1e6:.3f}</td>"
+                   f"<td>{r['rx_packets']}</td><td>{r['rx_bps'] / 1e6:.3f}</td></tr>")
+    out.append("</table>")
+
+    rtt = report["rtt"]
+    out.append(f"<h2>RTT distribution</h2><p>{rtt['count']} samples, p50 {_fmt(rtt['p50_ms'])} ms, "
+               f"p90 {_fmt(rtt['p90_ms'])} ms, p99 {_fmt(rtt['p99_ms'])} ms</p>"
+               "<table><tr><th>RTT ms</th><th>count</th><th></th></tr>")
+    peak = max((b["count"] for b in rtt["distribution"]), default=1)
+    for b in rtt["distribution"]:
+        out.append(f"<tr><td>{b['lo_ms']:.3f} - {b['hi_ms']:.3f}</td><td>{b['count']}</td>"
+                   f"<td style='text-align:left'><div class='bar' style='width:{300 * b['count'] // peak}px'></div></td></tr>")
+    out.append("</table></body></html>")
+    return "\n".join(out)
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental reports from CCNx capture segments")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_up = sub.add_parser("update", help="新しい・変わったセグメントだけを集計に取り込む")
+    p_up.add_argument("--db", required=True, help="集計の SQLite ファイル")
+    p_up.add_argument("--ring", default=None, help="ringcap.py のリングのディレクトリ")
+    p_up.add_argument("files", nargs="*", help="pcap / pcapng ファイル")
+    p_up.add_argument("--interval", type=int, default=None,
+                      help=f"集計の区間の幅 (秒)。DB を作るときだけ指定する (既定: {config.REPORT_INTERVAL_SEC})")
+    p_up.add_argument("--depth", type=int, default=None,
+                      help=f"プレフィックスの深さ。DB を作るときだけ指定する (既定: {config.PREFIX_DEPTH_FOR_STATS})")
+    p_rep = sub.add_parser("report", help="集計からレポートを作る")
+    p_rep.add_argument("--db", required=True)
+    p_rep.add_argument("--format", choices=("html", "csv", "json"), default="html")
+    p_rep.add_argument("--out", default=None, help="出力先 (csv ではファイル名の先頭部分)。省略時は標準出力")
+    p_rep.add_argument("--start", type=parse_time, default=None, help="開始時刻 (UNIX 時刻または ISO 8601)")
+    p_rep.add_argument("--end", type=parse_time, default=None, help="終了時刻 (UNIX 時刻または ISO 8601)")
+    p_rep.add_argument("--top", type=int, default=20, help="表示するプレフィックス・面の数")
+    args = parser.parse_args(argv)
+
+    if args.command == "update":
+        paths = list(args.files) + (ring_segments(args.ring) if args.ring else [])
+        try:
+            conn = open_db(args.db, args.interval, args.depth)
+        except ValueError as e:
+            parser.error(str(e))
+        n_segments, n_intervals = update(conn, paths)
+        print(f"{n_segments} of {len(paths)} segments updated, {n_intervals} intervals refreshed", file=sys.stderr)
+        conn.close()
+        return 0
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist; run 'update' first")
+    conn = sqlite3.connect(args.db)
+    report = build_report(conn, args.start, args.end, args.top)
+    conn.close()
+    if args.format == "csv":
+        for path in write_csv(report, args.out or "report"):
+            print(path, file=sys.stderr)
+        return 0
+    text = json.dumps(report, indent=1) if args.format == "json" else render_html(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+# キャプチャをディスク上のリングバッファに書き続け、時刻とプレフィックスで素早く取り出す機能
+#
+# 一定サイズの pcapng (セグメント) に順に書き、n_segments 個を超えたら古いものから消します。
+# セグメントごとに索引 (.idx) を持ち、CCNx パケットを含むフレームごとに
+# (時刻, ファイル内の位置, プレフィックス ID, 長さ) を記録します。プレフィックス ID は
+# 同名の .prefixes ファイルの行番号です。各セグメントの時刻の範囲は ring.json にまとめます。
+# extract はこの索引だけで対象のフレームの位置を求め、そこへ直接 seek して読むため、
+# セグメント全体を読み直すことはありません。
+#
+# 使い方:
+#   sudo python3 ringcap.py record --interface eth0 --dir ring
+#   python3 ringcap.py list --dir ring
+#   python3 ringcap.py extract --dir ring --start 2025-01-01T12:00:00 --end 2025-01-01T12:05:00 \
+#       --prefix /video --out incident.pcap
+
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import datetime
+
+import numpy as np
+
+import config
+from bpf_filter import config_filter
+from capture_source import AfPacketCapture, PcapngWriter, PcapWriter, PCAPNG_EPB
+from tlv_decoder import LINKTYPE_ETHERNET, decode_frame
+from utils import normalize_name
+
+MANIFEST = "ring.json"
+INDEX_DTYPE = np.dtype([("ts", "<f8"), ("offset", "<u8"), ("prefix_id", "<u4"), ("length", "<u4")])
+
+def segment_path(directory, seq, ext):
+    return os.path.join(directory, f"seg_{seq:08d}{ext}")
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+# --- 書き込み ---
+
+class _Segment:
+    """書き込み中のセグメントとその索引"""
+
+    def __init__(self, directory, seq, linktype, snaplen):
+        self.seq = seq
+        self.writer = PcapngWriter(segment_path(directory, seq, ".pcapng"), linktype, snaplen)
+        self.idx = open(segment_path(directory, seq, ".idx"), "wb")
+        self.prefix_file = open(segment_path(directory, seq, ".prefixes"), "w")
+        self.prefix_ids = {}
+        self.pending = []
+        self.start = None
+        self.end = None
+        self.frames = 0
+        self.bytes = self.writer.tell()
+
+    def prefix_id(self, prefix):
+        pid = self.prefix_ids.get(prefix)
+        if pid is None:
+            pid = self.prefix_ids[prefix] = len(self.prefix_ids)
+            self.prefix_file.write(prefix + "\n")
+        return pid
+
+    def flush(self):
+        # 索引が指す位置は必ずファイルに書かれているように、pcapng を先に書き出す
+        self.writer.flush()
+        self.bytes = self.writer.tell()
+        self.prefix_file.flush()
+        if self.pending:
+            self.idx.write(np.array(self.pending, dtype=INDEX_DTYPE).tobytes())
+            self.pending = []
+        self.idx.flush()
+
+    def entry(self):
+        return {"seq": self.seq, "start": self.start, "end": self.end, "frames": self.frames,
+                "bytes": self.bytes}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.idx.close()
+        self.prefix_file.close()
+
+class RingCapture:
+    """CCNx パケットを含むフレームを、索引つきのセグメントのリングに書き込みます。"""
+
+    def __init__(self, directory, segment_bytes=config.RINGCAP_SEGMENT_BYTES, n_segments=config.RINGCAP_SEGMENTS,
+                 linktype=LINKTYPE_ETHERNET, snaplen=config.CAPTURE_SNAPLEN, depth=config.PREFIX_DEPTH_FOR_STATS,
+                 flush_interval_sec=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.n_segments = n_segments
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.depth = depth
+        self.flush_interval_sec = flush_interval_sec
+        self._prefix_cache = {}
+        manifest = load_manifest(directory)
+        if manifest is not None and (manifest["linktype"] != linktype or manifest["depth"] != depth):
+            raise ValueError(f"{directory} was recorded with linktype={manifest['linktype']}, "
+                             f"depth={manifest['depth']}")
+        self.segments = manifest["segments"] if manifest else []
+        next_seq = self.segments[-1]["seq"] + 1 if self.segments else 0
+        self.current = None
+        self._open(next_seq)
+        self._next_flush = time.monotonic() + flush_interval_sec
+
+    def _prefix(self, name):
+        prefix = self._prefix_cache.get(name)
+        if prefix is None:
+            if len(self._prefix_cache) >= 1 << 16:
+                self._prefix_cache.clear()
+            prefix = self._prefix_cache[name] = normalize_name(name, self.depth)
+        return prefix
+
+    def _open(self, seq):
+        self.current = _Segment(self.directory, seq, self.linktype, self.snaplen)
+        self.segments.append(self.current.entry())
+        while len(self.segments) > self.n_segments:
+            old = self.segments.pop(0)
+            for ext in (".pcapng", ".idx", ".prefixes"):
+                try:
+                    os.remove(segment_path(self.directory, old["seq"], ext))
+                except FileNotFoundError:
+                    pass
+        self._save()
+
+    def _save(self):
+        self.segments[-1] = self.current.entry()
+        _save_manifest(self.directory, {"linktype": self.linktype, "depth": self.depth,
+                                        "segments": self.segments})
+
+    def write(self, ts, frame, packets):
+        """
+        フレームを書き込み、packets (decode_frame の結果) の各プレフィックスで索引をつけます。
+        セグメントが segment_bytes を超えたら次のセグメントに移ります。
+        """
+        seg = self.current
+        offset = seg.writer.write(ts, frame)
+        if seg.start is None:
+            seg.start = ts
+        seg.end = ts
+        seg.frames += 1
+        seen = None
+        for p in packets:
+            pid = seg.prefix_id(self._prefix(p.name))
+            if pid != seen:
+                seg.pending.append((ts, offset, pid, len(frame)))
+                seen = pid
+        if seg.writer.tell() >= self.segment_bytes:
+            self.rotate()
+        elif time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def rotate(self):
+        self.current.close()
+        self._save()
+        self._open(self.current.seq + 1)
+
+    def flush(self):
+        """書き込み中のセグメントを、extract から読める状態にします。"""
+        self.current.flush()
+        self._save()
+        self._next_flush = time.monotonic() + self.flush_interval_sec
+
+    def close(self):
+        self.current.close()
+        self._save()
+
+def record(capture, ring, duration=None):
+    """capture のフレームのうち CCNx パケットを含むものを ring に書き続けます。"""
+    deadline = time.time() + duration if duration else None
+    n = 0
+    for ts, linktype, frame in capture:
+        if deadline is not None and ts >= deadline:
+            break
+        if frame is None:
+            ring.flush()
+            continue
+        packets = decode_frame(frame, linktype)
+        if packets:
+            ring.write(ts, frame, packets)
+            n += 1
+    return n
+
+# --- 取り出し ---
+
+def _to_uri(prefix):
+    """
+    "/video" や "ccnx:/video/" を索引と同じ "ccnx:/video" の形にします。
+    ルート ("/", "ccnx:/" など) はすべての名前に一致するので None (絞り込まない) を返します。
+    """
+    scheme, sep, path = prefix.partition(":/")
+    if not sep:
+        scheme, path = "ccnx", prefix
+    path = path.strip("/")
+    if not path:
+        return None
+    return f"{scheme}:/{path}"
+
+def _read_frame(f, offset):
+    """offset にある Enhanced Packet Block のフレームを返します。"""
+    f.seek(offset)
+    btype, total = struct.unpack("<II", f.read(8))
+    if btype != PCAPNG_EPB:
+        raise ValueError(f"no Enhanced Packet Block at offset {offset}")
+    body = f.read(total - 8)
+    cap_len = struct.unpack_from("<I", body, 12)[0]
+    return body[20:20 + cap_len]
+
+def extract(directory, out_path, start=None, end=None, prefix=None):
+    """
+    directory のリングから、[start, end] の時刻で prefix 以下の名前を含むフレームを
+    pcap ファイルに書き出し、書き出したフレーム数を返します。
+    prefix が索引の深さより深い場合は、索引で絞り込んだ候補のフレームだけをデコードして確かめます。
+    """
+    manifest = load_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"{directory} has no {MANIFEST}")
+    query = _to_uri(prefix) if prefix is not None else None
+    writer = PcapWriter(out_path, manifest["linktype"], config.CAPTURE_SNAPLEN)
+    n = 0
+    try:
+        for seg in manifest["segments"]:
+            if seg["start"] is None:
+                continue
+            if (start is not None and seg["end"] < start) or (end is not None and seg["start"] > end):
+                continue
+            seq = seg["seq"]
+            try:
+                index = np.fromfile(segment_path(directory, seq, ".idx"), dtype=INDEX_DTYPE)
+                with open(segment_path(directory, seq, ".prefixes")) as f:
+                    prefixes = f.read().splitlines()
+            except FileNotFoundError:
+                continue  # 読んでいる間にリングから消えた
+            mask = np.ones(len(index), dtype=bool)
+            if start is not None:
+                mask &= index["ts"] >= start
+            if end is not None:
+                mask &= index["ts"] <= end
+            verify = np.zeros(len(prefixes), dtype=bool)
+            if query is not None:
+                wanted = np.zeros(len(prefixes), dtype=bool)
+                for i, p in enumerate(prefixes):
+                    if p == query or p.startswith(query + "/"):
+                        wanted[i] = True
+                    elif query.startswith(p + "/"):
+                        wanted[i] = verify[i] = True
+                mask &= wanted[index["prefix_id"]]
+            hits = index[mask]
+            if len(hits) == 0:
+                continue
+            # 同じフレームに複数のプレフィックスの索引があれば1回だけ書く (ファイル順)
+            offsets, first = np.unique(hits["offset"], return_index=True)
+            # 索引の深さより深いプレフィックスでしか一致しないフレームはデコードして確かめる
+            exact = hits["offset"][~verify[hits["prefix_id"]]]
+            check = ~np.isin(offsets, exact)
+            try:
+                f = open(segment_path(directory, seq, ".pcapng"), "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                for offset, row, must_check in zip(offsets.tolist(), first.tolist(), check.tolist()):
+                    frame = _read_frame(f, offset)
+                    if must_check and not any(p.name == query or p.name.startswith(query + "/")
+                                              for p in decode_frame(frame, manifest["linktype"])):
+                        continue
+                    writer.write(float(hits["ts"][row]), frame)
+                    n += 1
+    finally:
+        writer.close()
+    return n
+
+def parse_time(value):
+    """UNIX 時刻 (秒) または ISO 8601 形式 (ローカル時刻) の文字列を UNIX 時刻にします。"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rolling CCNx capture with a time/prefix index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rec = sub.add_parser("record", help="インタフェースのキャプチャをリングに書き続ける (root 権限が必要)")
+    p_rec.add_argument("--interface", required=True)
+    p_rec.add_argument("--dir", required=True, help="リングのディレクトリ")
+    p_rec.add_argument("--segment-mb", type=float, default=config.RINGCAP_SEGMENT_BYTES / 2 ** 20,
+                       help="1セグメントのサイズ (MiB)")
+    p_rec.add_argument("--segments", type=int, default=config.RINGCAP_SEGMENTS, help="残すセグメント数")
+    p_rec.add_argument("--duration", type=float, default=None, help="キャプチャする時間 (秒)。省略時は Ctrl-C まで")
+    p_ls = sub.add_parser("list", help="セグメントと時刻の範囲を表示する")
+    p_ls.add_argument("--dir", required=True)
+    p_ex = sub.add_parser("extract", help="時刻の範囲とプレフィックスでフレームを pcap に取り出す")
+    p_ex.add_argument("--dir", required=True)
+    p_ex.add_argument("--out", required=True, help="出力する pcap ファイル")
+    p_ex.add_argument("--start", type=parse_time, default=None, help="開始時刻 (UNIX 時刻または ISO 8601)")
+    p_ex.add_argument("--end", type=parse_time, default=None, help="終了時刻 (UNIX 時刻または ISO 8601)")
+    p_ex.add_argument("--prefix", default=None, help="名前のプレフィックス (例: /video/a)")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        capture = AfPacketCapture(args.interface, snaplen=config.CAPTURE_SNAPLEN, bpf_program=config_filter())
+        ring = RingCapture(args.dir, int(args.segment_mb * 2 ** 20), args.segments, capture.linktype)
+        try:
+            n = record(capture, ring, args.duration)
+            print(f"{n} frames recorded to {args.dir}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ring.close()
+            capture.close()
+    elif args.command == "list":
+        manifest = load_manifest(args.dir)
+        if manifest is None:
+            print(f"{args.dir} has no {MANIFEST}", file=sys.stderr)
+            return 1
+        for seg in manifest["segments"]:
+            if seg["start"] is None:
+                print(f"seg_{seg['seq']:08d} (empty)")
+                continue
+            t0 = datetime.datetime.fromtimestamp(seg["start"]).isoformat(timespec="seconds")
+            t1 = datetime.datetime.fromtimestamp(seg["end"]).isoformat(timespec="seconds")
+            print(f"seg_{seg['seq']:08d} {t0} - {t1} {seg['frames']:>9} frames {seg['bytes'] / 2 ** 20:>8.1f} MiB")
+    else:
+        n = extract(args.dir, args.out, args.start, args.end, args.prefix)
+        print(f"{n} frames written to {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
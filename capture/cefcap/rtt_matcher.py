@@ -0,0 +1,272 @@
+# キャプチャした Interest と Data を対応づけて RTT を測る機能
+#
+# 応答待ちの Interest を (名前, チャンク, 消費者, 次ホップ) をキーとする辞書に入れ、
+# Data が来たら逆向きの同じキーを引くだけで対応づけます (1パケットあたり O(1))。
+# RTT_TIMEOUT_SEC を過ぎても Data の来ない Interest は、タイミングホイール
+# (時刻で区切ったスロットのリング) を進めるときにまとめて期限切れにするため、
+# 応答待ちの表全体を走査することはありません。
+# RTT はプレフィックスごと・次ホップごとの対数ヒストグラムに溜めます。
+
+import sys
+import math
+import argparse
+from array import array
+
+import config
+from tlv_decoder import PT_INTEREST, PT_OBJECT, PT_INTEREST_RETURN
+from utils import normalize_name, format_addr
+
+class RttHistogram:
+    """
+    RTT (秒) の対数ヒストグラム
+
+    min_sec から max_sec までを1桁あたり buckets_per_decade 個のビンに分けます。
+    範囲外の値は両端のビンに入れます。分位点の誤差はビンの幅 (既定で約 12%) 以内です。
+    """
+
+    def __init__(self, min_sec=1e-5, max_sec=config.RTT_TIMEOUT_SEC, buckets_per_decade=20):
+        self.min_sec = min_sec
+        self.scale = buckets_per_decade / math.log(10)
+        self.n_buckets = int(math.ceil(math.log(max_sec / min_sec) * self.scale)) + 1
+        self.counts = array("q", bytes(8 * self.n_buckets))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, rtt):
+        if rtt > self.min_sec:
+            i = min(int(math.log(rtt / self.min_sec) * self.scale), self.n_buckets - 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.count += 1
+        self.total += rtt
+        if rtt < self.min:
+            self.min = rtt
+        if rtt > self.max:
+            self.max = rtt
+
+    def bucket_value(self, i):
+        """ビン i の代表値 (ビンの両端の幾何平均)"""
+        return self.min_sec * math.exp((i + 0.5) / self.scale)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen > rank:
+                return min(max(self.bucket_value(i), self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        """count, mean_ms, min_ms, p50_ms, p90_ms, p99_ms, max_ms の辞書を返します。"""
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000,
+            "min_ms": self.min * 1000,
+            "p50_ms": self.quantile(0.5) * 1000,
+            "p90_ms": self.quantile(0.9) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class RttMatcher:
+    """
+    Interest と Data を対応づけ、RTT をプレフィックスごと・次ホップごとに集計します。
+
+    同じキーの Interest が応答前に再び来た場合 (再送) は新しい方で上書きし、
+    retransmissions に数えます。InterestReturn (NACK) が来た Interest は応答待ちから外します。
+    """
+
+    def __init__(self, timeout_sec=config.RTT_TIMEOUT_SEC, depth=config.PREFIX_DEPTH_FOR_STATS,
+                 tick_sec=config.RTT_WHEEL_TICK_SEC, max_outstanding=config.RTT_MAX_OUTSTANDING,
+                 enabled=config.ENABLE_RTT_CALCULATION):
+        self.enabled = enabled
+        self.timeout_sec = timeout_sec
+        self.depth = depth
+        self.max_outstanding = max_outstanding
+        self.tick_sec = tick_sec
+        # タイムアウトの時刻が必ずホイール1周以内に収まるだけのスロットを用意する
+        self.n_slots = int(math.ceil(timeout_sec / tick_sec)) + 2
+        self.wheel = [[] for _ in range(self.n_slots)]
+        self.cursor = None  # 最後に処理したティック
+        self.outstanding = {}  # キー -> Interest の時刻
+        self._prefix_cache = {}
+
+        self.by_prefix = {}  # プレフィックス -> RttHistogram
+        self.by_hop = {}     # 次ホップのアドレス -> RttHistogram
+        self.timeouts = {}   # プレフィックス -> 期限切れの Interest 数
+        self.matched = 0
+        self.expired = 0
+        self.retransmissions = 0
+        self.nacked = 0
+        self.unmatched_data = 0
+        self.dropped = 0     # max_outstanding を超えて追跡できなかった Interest
+
+    def _prefix(self, name):
+        prefix = self._prefix_cache.get(name)
+        if prefix is None:
+            if len(self._prefix_cache) >= 1 << 16:
+                self._prefix_cache.clear()
+            prefix = self._prefix_cache[name] = normalize_name(name, self.depth)
+        return prefix
+
+    def add(self, ts, packet):
+        """
+        tlv_decoder.CcnxPacket を1つ処理します。
+        Data が応答待ちの Interest と対応づいた場合はその RTT (秒) を、それ以外は None を返します。
+        """
+        if not self.enabled:
+            return None
+        self.advance(ts)
+        ptype = packet.ptype
+        if ptype == PT_INTEREST:
+            key = (packet.name, packet.chunk, packet.src, packet.dst)
+            outstanding = self.outstanding
+            if key in outstanding:
+                self.retransmissions += 1
+            elif len(outstanding) >= self.max_outstanding:
+                self.dropped += 1
+                return None
+            outstanding[key] = ts
+            deadline_tick = int((ts + self.timeout_sec) / self.tick_sec) + 1
+            self.wheel[deadline_tick % self.n_slots].append((key, ts))
+            return None
+        # Data と InterestReturn は Interest と逆向きに流れる
+        key = (packet.name, packet.chunk, packet.dst, packet.src)
+        sent = self.outstanding.pop(key, None)
+        if ptype == PT_INTEREST_RETURN:
+            if sent is not None:
+                self.nacked += 1
+            return None
+        if ptype != PT_OBJECT:
+            return None
+        if sent is None:
+            self.unmatched_data += 1
+            return None
+        rtt = ts - sent
+        self.matched += 1
+        prefix = self._prefix(packet.name)
+        hist = self.by_prefix.get(prefix)
+        if hist is None:
+            hist = self.by_prefix[prefix] = RttHistogram(max_sec=self.timeout_sec)
+        hist.add(rtt)
+        hist = self.by_hop.get(packet.src)
+        if hist is None:
+            hist = self.by_hop[packet.src] = RttHistogram(max_sec=self.timeout_sec)
+        hist.add(rtt)
+        return rtt
+
+    def advance(self, now):
+        """時刻 now までにタイムアウトした Interest を応答待ちから外します。"""
+        tick = int(now / self.tick_sec)
+        if self.cursor is None:
+            self.cursor = tick
+            return
+        if tick <= self.cursor:
+            return
+        # 1周以上進んだ場合は全スロットを1回ずつ見れば足りる
+        start = max(self.cursor + 1, tick - self.n_slots + 1)
+        outstanding = self.outstanding
+        for t in range(start, tick + 1):
+            slot = self.wheel[t % self.n_slots]
+            if not slot:
+                continue
+            self.wheel[t % self.n_slots] = []
+            for key, sent in slot:
+                if outstanding.get(key) != sent:
+                    continue  # 応答済み、または再送で上書きされた
+                if now - sent >= self.timeout_sec:
+                    del outstanding[key]
+                    self.expired += 1
+                    prefix = self._prefix(key[0])
+                    self.timeouts[prefix] = self.timeouts.get(prefix, 0) + 1
+                else:
+                    self.wheel[(t + 1) % self.n_slots].append((key, sent))
+        self.cursor = tick
+
+    def flush(self):
+        """キャプチャの終わりで、応答待ちの Interest をすべて期限切れとして数えます。"""
+        for key in self.outstanding:
+            prefix = self._prefix(key[0])
+            self.timeouts[prefix] = self.timeouts.get(prefix, 0) + 1
+        self.expired += len(self.outstanding)
+        self.outstanding.clear()
+        self.wheel = [[] for _ in range(self.n_slots)]
+
+    def prefix_rows(self):
+        """プレフィックスごとの RTT の集計を、サンプル数の多い順に辞書のリストで返します。"""
+        prefixes = set(self.by_prefix) | set(self.timeouts)
+        rows = []
+        for prefix in prefixes:
+            hist = self.by_prefix.get(prefix)
+            row = {"prefix": prefix, "timeouts": self.timeouts.get(prefix, 0)}
+            row.update(hist.summary() if hist else {"count": 0})
+            rows.append(row)
+        rows.sort(key=lambda r: r["count"], reverse=True)
+        return rows
+
+    def hop_rows(self):
+        """次ホップごとの RTT の集計を、サンプル数の多い順に辞書のリストで返します。"""
+        rows = [dict(hop=format_addr(hop), **hist.summary()) for hop, hist in self.by_hop.items()]
+        rows.sort(key=lambda r: r["count"], reverse=True)
+        return rows
+
+    def counters(self):
+        return {
+            "matched": self.matched,
+            "expired": self.expired,
+            "outstanding": len(self.outstanding),
+            "retransmissions": self.retransmissions,
+            "nacked": self.nacked,
+            "unmatched_data": self.unmatched_data,
+            "dropped": self.dropped,
+        }
+
+def print_rows(rows, key, limit=20):
+    print(f"{key:40} {'count':>8} {'timeouts':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}")
+    for r in rows[:limit]:
+        if r["count"]:
+            print(f"{r[key][:40]:40} {r['count']:>8} {r.get('timeouts', 0):>8} "
+                  f"{r['p50_ms']:>8.2f} {r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+        else:
+            print(f"{r[key][:40]:40} {0:>8} {r.get('timeouts', 0):>8}")
+
+def main(argv=None):
+    from capture_source import open_capture_file
+    from tlv_decoder import decode_frame
+    parser = argparse.ArgumentParser(description="Measure Interest/Data RTT in a capture file")
+    parser.add_argument("file", help="pcap / pcapng ファイル")
+    parser.add_argument("--depth", type=int, default=config.PREFIX_DEPTH_FOR_STATS,
+                        help="集計するプレフィックスの深さ")
+    parser.add_argument("--timeout", type=float, default=config.RTT_TIMEOUT_SEC, help="RTT のタイムアウト (秒)")
+    parser.add_argument("--limit", type=int, default=20, help="表示する行数")
+    args = parser.parse_args(argv)
+
+    matcher = RttMatcher(timeout_sec=args.timeout, depth=args.depth, enabled=True)
+    for ts, linktype, frame in open_capture_file(args.file):
+        for p in decode_frame(frame, linktype):
+            matcher.add(ts, p)
+    matcher.flush()
+    print(" ".join(f"{k}={v}" for k, v in matcher.counters().items()))
+    print_rows(matcher.prefix_rows(), "prefix", args.limit)
+    print()
+    print_rows(matcher.hop_rows(), "hop", args.limit)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# パケットのサンプリング (全パケットを処理しきれない高レートのリンク向け)
+#
+# どのサンプラーも keep(ts, packet) が (重み, グループ) を返し、重みが 0 ならそのパケットを捨てます。
+# 重みは 1 / 残す確率で、StatsCollector は重みを足して元の量を推定します (Horvitz-Thompson 推定)。
+# グループは誤差の推定 (ランダムグループ法) に使う整数で、一緒に残るパケットには同じ値を返します。
+#
+#   nth      : N 個に 1 個を残す。名前を見ないのでデコード前 (キャプチャスレッド) で間引ける
+#   flow     : (名前, チャンク, 両端のアドレス) のハッシュで残すかを決める。Interest と
+#              その Data は同じ判定になるので、RTT を測れる組がそのまま残る
+#   adaptive : flow と同じ判定を、プレフィックスごとに残すパケットが target_pps 程度に
+#              なるよう確率を変えながら行う。少ないプレフィックスは全部残り、多いものだけ間引かれる
+
+import zlib
+import struct
+
+import config
+from utils import normalize_name
+
+SAMPLING_MODES = ("none", "nth", "flow", "adaptive")
+_HASH_SPACE = 1 << 32
+_CHUNK = struct.Struct("!q")
+
+def _mix32(h):
+    # crc32 は入力に対して線形で、チャンク番号だけが違う名前の値に偏りが出るため、
+    # MurmurHash3 の最終処理でビットを混ぜてからしきい値と比べる
+    # (hash() はプロセスごとに値が変わり、パーサー間で判定がそろわないので使わない)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    return h ^ (h >> 16)
+
+class NthSampler:
+    """N 個に 1 個を残します (重み N)。"""
+
+    def __init__(self, n):
+        self.n = n
+        self._count = 0
+
+    def keep_frame(self):
+        """名前を見ずに判定します (キャプチャスレッド用)。"""
+        self._count += 1
+        if self._count >= self.n:
+            self._count = 0
+            return self.n
+        return 0
+
+    def keep(self, ts, packet):
+        return self.keep_frame(), None
+
+class FlowHashSampler:
+    """(名前, チャンク, 両端のアドレス) のハッシュが rate 未満のパケットを残します (重み 1 / rate)。"""
+
+    def __init__(self, rate, cache_size=1 << 16):
+        self.rate = rate
+        self.threshold = int(rate * _HASH_SPACE)
+        self._name_hash = {}
+        self._cache_size = cache_size
+
+    def flow_hash(self, packet):
+        h = self._name_hash.get(packet.name)
+        if h is None:
+            if len(self._name_hash) >= self._cache_size:
+                self._name_hash.clear()
+            h = self._name_hash[packet.name] = zlib.crc32(packet.name.encode())
+        # Interest と Data で向きが逆になるので、アドレスは小さい順にそろえる
+        a, b = (packet.src, packet.dst) if packet.src <= packet.dst else (packet.dst, packet.src)
+        chunk = -1 if packet.chunk is None else packet.chunk
+        return _mix32(zlib.crc32(a + b + _CHUNK.pack(chunk), h))
+
+    def keep(self, ts, packet):
+        h = self.flow_hash(packet)
+        return (1.0 / self.rate if h < self.threshold else 0), h
+
+class AdaptivePrefixSampler(FlowHashSampler):
+    """
+    プレフィックスごとに、残すパケットが target_pps 程度になるよう確率を window_sec ごとに決め直します。
+    確率が変わった直後の window では、Interest とその Data で判定が分かれることがあります。
+    """
+
+    def __init__(self, target_pps, window_sec=1.0, depth=config.PREFIX_DEPTH_FOR_STATS, min_rate=1e-4):
+        super().__init__(1.0)
+        self.target_pps = target_pps
+        self.window_sec = window_sec
+        self.depth = depth
+        self.min_rate = min_rate
+        self._prefix = {}
+        self._counts = {}  # プレフィックス -> この window で見たパケット数
+        self._rates = {}   # プレフィックス -> 残す確率
+        self._window_end = None
+
+    def _roll(self, ts):
+        for prefix, count in self._counts.items():
+            observed = count / self.window_sec
+            self._rates[prefix] = max(self.min_rate, min(1.0, self.target_pps / observed))
+        # 直前の window に現れなかったプレフィックスは忘れる (次に来たら確率 1 から)
+        self._rates = {p: r for p, r in self._rates.items() if p in self._counts}
+        self._counts = {}
+        self._window_end = ts + self.window_sec
+
+    def keep(self, ts, packet):
+        if self._window_end is None or ts >= self._window_end:
+            self._roll(ts)
+        name = packet.name
+        prefix = self._prefix.get(name)
+        if prefix is None:
+            if len(self._prefix) >= self._cache_size:
+                self._prefix.clear()
+            prefix = self._prefix[name] = normalize_name(name, self.depth)
+        self._counts[prefix] = self._counts.get(prefix, 0) + 1
+        rate = self._rates.get(prefix, 1.0)
+        if rate >= 1.0:
+            return 1.0, None
+        h = self.flow_hash(packet)
+        return (1.0 / rate if h < rate * _HASH_SPACE else 0), h
+
+    def rates(self):
+        """プレフィックスごとの現在の確率 (1 未満のものだけ)"""
+        return {p: r for p, r in self._rates.items() if r < 1.0}
+
+def make_sampler(mode=config.SAMPLING_MODE, n=config.SAMPLING_N, rate=config.SAMPLING_FLOW_RATE,
+                 target_pps=config.SAMPLING_TARGET_PPS, depth=config.PREFIX_DEPTH_FOR_STATS):
+    """mode に応じたサンプラーを返します ("none" なら None)。"""
+    if mode == "none":
+        return None
+    if mode == "nth":
+        return NthSampler(n) if n > 1 else None
+    if mode == "flow":
+        return FlowHashSampler(rate) if rate < 1.0 else None
+    if mode == "adaptive":
+        return AdaptivePrefixSampler(target_pps, depth=depth)
+    raise ValueError(f"unknown sampling mode: {mode} (choose from {', '.join(SAMPLING_MODES)})")
@@ -1 +1,292 @@
 # 抽出した情報から統計を蓄積・計算するクラス
+#
+# パケットを1つずつ受け取り、名前を PREFIX_DEPTH_FOR_STATS までのプレフィックスに
+# まとめて数えるストリーミング集計です。名前からプレフィックス ID への対応は
+# キャッシュするため、同じ名前の正規化 (文字列の分割) は1回だけです。
+# カウンターはプレフィックス ID を添字とする固定長の配列に持ち、
+# snapshot_interval_sec ごとにその区間の集計を on_snapshot に渡します。
+#
+# プレフィックスの種類が max_prefixes を超えた場合、あふれたプレフィックスは
+# Count-Min Sketch で数え、推定値の大きい top_k 個だけを名前付きで報告します。
+# 合計値はあふれた分も含めて正確です。一定期間通信の無いプレフィックスの ID は
+# 再利用するため、名前の種類がいくら増えてもメモリ使用量は一定です。
+#
+# サンプリング (sampling.py) したパケットは add に重み (= 1 / 残した確率) とグループを渡します。
+# カウンターには重みを足して元の量を推定し (Horvitz-Thompson 推定)、誤差はランダムグループ法で
+# 求めます: 残したパケットを SAMPLE_GROUPS 個のグループに分けて別々にも数え、グループごとの
+# 推定値のばらつきから 95% 信頼区間の半幅を *_err としてスナップショットに付けます。
+# flow サンプリングでは同じ名前・チャンクのパケットがまとめて残る (または捨てられる) ため、
+# グループは flow のハッシュで決めます。重み 1 (間引かずに残した) のパケットは誤差に含めません。
+
+import heapq
+import math
+import random
+from array import array
+
+import config
+from tlv_decoder import PT_INTEREST, PT_OBJECT, PT_INTEREST_RETURN
+from utils import normalize_name
+
+OVERFLOW = -1  # 固定長の配列に入りきらなかったプレフィックス
+SAMPLE_GROUPS = 10  # 誤差の推定に使うランダムグループの数
+ERROR_T = 2.262     # 自由度 SAMPLE_GROUPS - 1 の t 分布の 97.5% 点 (95% 信頼区間)
+COUNTERS = ("interests", "data", "interest_returns", "data_bytes")
+
+def _zeros(n):
+    return array("d", bytes(8 * n))
+
+def error_bound(group_sums):
+    """グループごとの (重み付きの) 合計から、全体の推定値の 95% 信頼区間の半幅を返します。"""
+    r = len(group_sums)
+    total = sum(group_sums)
+    var = sum((r * g - total) ** 2 for g in group_sums) / (r * (r - 1))
+    return round(ERROR_T * math.sqrt(var))
+
+class CountMinSketch:
+    """パケット数とバイト数を数える Count-Min Sketch"""
+
+    def __init__(self, width=2048, depth=4, seed=0):
+        self.width = width
+        self.depth = depth
+        rng = random.Random(seed)
+        self.seeds = [rng.getrandbits(32) for _ in range(depth)]
+        self.packets = [_zeros(width) for _ in range(depth)]
+        self.bytes = [_zeros(width) for _ in range(depth)]
+
+    def _cells(self, key):
+        return [hash((s, key)) % self.width for s in self.seeds]
+
+    def add(self, key, nbytes, weight=1):
+        """key を weight 個分数え、(推定パケット数, 推定バイト数) を返します。"""
+        est_p = est_b = None
+        for row, cell in enumerate(self._cells(key)):
+            p = self.packets[row]
+            b = self.bytes[row]
+            p[cell] += weight
+            b[cell] += nbytes * weight
+            if est_p is None or p[cell] < est_p:
+                est_p = p[cell]
+            if est_b is None or b[cell] < est_b:
+                est_b = b[cell]
+        return est_p, est_b
+
+    def reset(self):
+        for rows in (self.packets, self.bytes):
+            for r in rows:
+                r[:] = _zeros(self.width)
+
+class StatsCollector:
+    def __init__(self, depth=config.PREFIX_DEPTH_FOR_STATS, max_prefixes=config.STATS_MAX_PREFIXES,
+                 top_k=config.STATS_TOP_K, snapshot_interval_sec=config.STATS_SNAPSHOT_INTERVAL_SEC,
+                 idle_snapshots=config.STATS_IDLE_SNAPSHOTS, name_cache_size=1 << 16,
+                 on_snapshot=None):
+        self.depth = depth
+        self.max_prefixes = max_prefixes
+        self.top_k = top_k
+        self.snapshot_interval_sec = snapshot_interval_sec
+        self.idle_snapshots = idle_snapshots
+        self.name_cache_size = name_cache_size
+        self.on_snapshot = on_snapshot
+
+        self._name_to_id = {}  # 名前 -> プレフィックス ID (または OVERFLOW)
+        self._prefix_to_id = {}
+        self.prefixes = [None] * max_prefixes  # ID -> プレフィックス
+        self._free_ids = list(range(max_prefixes - 1, -1, -1))
+        self._idle = array("l", bytes(array("l").itemsize * max_prefixes))
+
+        self.interests = _zeros(max_prefixes)
+        self.data = _zeros(max_prefixes)
+        self.interest_returns = _zeros(max_prefixes)
+        self.data_bytes = _zeros(max_prefixes)
+        # 重み付きのパケットが来たときだけ作るグループ別のカウンター (COUNTERS と同じ順、添字は pid * SAMPLE_GROUPS + グループ)
+        self._groups = None
+
+        self.sketch = CountMinSketch()
+        self._overflow_top = {}  # あふれたプレフィックス -> (推定パケット数, 推定バイト数)
+        self.overflow_packets = 0
+        self.overflow_bytes = 0
+        self.total_packets = 0
+        self.total_bytes = 0
+        # total_packets, total_bytes, overflow の packets, data_bytes のグループ別の合計
+        self._total_groups = _zeros(4 * SAMPLE_GROUPS)
+        self._sampled = False
+        self._next_group = 0
+        self._interval_start = None
+
+    # --- 名前の ID 化 ---
+
+    def prefix_id(self, name):
+        pid = self._name_to_id.get(name)
+        if pid is not None:
+            return pid
+        prefix = normalize_name(name, self.depth)
+        pid = self._prefix_to_id.get(prefix)
+        if pid is None:
+            if self._free_ids:
+                pid = self._free_ids.pop()
+                self._prefix_to_id[prefix] = pid
+                self.prefixes[pid] = prefix
+                self._idle[pid] = 0
+            else:
+                pid = OVERFLOW
+        if len(self._name_to_id) >= self.name_cache_size:
+            self._name_to_id.clear()
+        self._name_to_id[name] = pid
+        return pid
+
+    # --- パケットの集計 ---
+
+    def add(self, ts, packet, weight=1, group=None):
+        """
+        tlv_decoder.CcnxPacket を1つ集計します。
+        サンプリングしたパケットなら weight に 1 / (残した確率) を渡します。group は誤差の推定に
+        使うグループを決める整数 (flow のハッシュなど) で、None なら順番に割り当てます。
+        """
+        if self._interval_start is None:
+            self._interval_start = ts
+        elif ts - self._interval_start >= self.snapshot_interval_sec:
+            self.emit_snapshot(ts)
+        nbytes = packet.payload_len if packet.ptype == PT_OBJECT else 0
+        self.total_packets += weight
+        self.total_bytes += nbytes * weight
+        pid = self.prefix_id(packet.name)
+        if weight != 1:
+            self._add_group(pid, packet.ptype, nbytes, weight, group)
+        if pid == OVERFLOW:
+            self._add_overflow(packet.name, nbytes, weight)
+            return
+        ptype = packet.ptype
+        if ptype == PT_INTEREST:
+            self.interests[pid] += weight
+        elif ptype == PT_OBJECT:
+            self.data[pid] += weight
+            self.data_bytes[pid] += nbytes * weight
+        elif ptype == PT_INTEREST_RETURN:
+            self.interest_returns[pid] += weight
+
+    def _add_group(self, pid, ptype, nbytes, weight, group):
+        if group is None:
+            group = self._next_group
+            self._next_group = (group + 1) % SAMPLE_GROUPS
+        g = group % SAMPLE_GROUPS
+        self._sampled = True
+        total = self._total_groups
+        total[g] += weight
+        total[SAMPLE_GROUPS + g] += weight * nbytes
+        if pid == OVERFLOW:
+            total[2 * SAMPLE_GROUPS + g] += weight
+            total[3 * SAMPLE_GROUPS + g] += weight * nbytes
+            return
+        if self._groups is None:
+            self._groups = [_zeros(self.max_prefixes * SAMPLE_GROUPS) for _ in COUNTERS]
+        interests, data, interest_returns, data_bytes = self._groups
+        i = pid * SAMPLE_GROUPS + g
+        if ptype == PT_INTEREST:
+            interests[i] += weight
+        elif ptype == PT_OBJECT:
+            data[i] += weight
+            data_bytes[i] += weight * nbytes
+        elif ptype == PT_INTEREST_RETURN:
+            interest_returns[i] += weight
+
+    def _add_overflow(self, name, nbytes, weight=1):
+        prefix = normalize_name(name, self.depth)
+        self.overflow_packets += weight
+        self.overflow_bytes += nbytes * weight
+        est = self.sketch.add(prefix, nbytes, weight)
+        top = self._overflow_top
+        if prefix in top or len(top) < self.top_k:
+            top[prefix] = est
+        else:
+            smallest = min(top, key=lambda k: top[k][0])
+            if top[smallest][0] < est[0]:
+                del top[smallest]
+                top[prefix] = est
+
+    # --- スナップショット ---
+
+    def snapshot(self, now, reset=True):
+        """
+        前回のスナップショット以降の集計を辞書で返します。
+        reset が True ならカウンターを0に戻し、長く通信の無いプレフィックスの ID を解放します。
+        サンプリングしたパケットがあれば値は推定値になり、"sampled" が True になって
+        各値に 95% 信頼区間の半幅 (*_err) が付きます。
+        """
+        start = self._interval_start if self._interval_start is not None else now
+        groups = self._groups
+        sampled = self._sampled
+        rows = []
+        for pid, prefix in enumerate(self.prefixes):
+            if prefix is None:
+                continue
+            i, d, r = self.interests[pid], self.data[pid], self.interest_returns[pid]
+            if i or d or r:
+                row = {"prefix": prefix, "interests": round(i), "data": round(d),
+                       "interest_returns": round(r), "data_bytes": round(self.data_bytes[pid])}
+                if sampled:
+                    for k, name in enumerate(COUNTERS):
+                        row[name + "_err"] = (error_bound(groups[k][pid * SAMPLE_GROUPS:(pid + 1) * SAMPLE_GROUPS])
+                                              if groups is not None else 0)
+                rows.append(row)
+        rows.sort(key=lambda row: row["data_bytes"], reverse=True)
+        top = heapq.nlargest(self.top_k, self._overflow_top.items(), key=lambda kv: kv[1][0])
+        result = {
+            "start": start,
+            "end": now,
+            "prefixes": rows,
+            "overflow": {
+                "packets": round(self.overflow_packets),
+                "data_bytes": round(self.overflow_bytes),
+                # Count-Min Sketch の推定値 (真の値以上、誤差は全体の 2/width 程度以下)
+                "top": [{"prefix": k, "packets_est": round(v[0]), "data_bytes_est": round(v[1])}
+                        for k, v in top],
+            },
+            "total_packets": round(self.total_packets),
+            "total_data_bytes": round(self.total_bytes),
+            "active_prefixes": len(self._prefix_to_id),
+            "sampled": sampled,
+        }
+        if sampled:
+            total = self._total_groups
+            errors = [error_bound(total[k * SAMPLE_GROUPS:(k + 1) * SAMPLE_GROUPS]) for k in range(4)]
+            result["total_packets_err"], result["total_data_bytes_err"] = errors[:2]
+            result["overflow"]["packets_err"], result["overflow"]["data_bytes_err"] = errors[2:]
+        if reset:
+            self._reset(now)
+        return result
+
+    def emit_snapshot(self, now):
+        snap = self.snapshot(now)
+        if self.on_snapshot is not None:
+            self.on_snapshot(snap)
+        return snap
+
+    def _reset(self, now):
+        evicted = False
+        for pid, prefix in enumerate(self.prefixes):
+            if prefix is None:
+                continue
+            if self.interests[pid] or self.data[pid] or self.interest_returns[pid]:
+                self._idle[pid] = 0
+            else:
+                self._idle[pid] += 1
+                if self._idle[pid] >= self.idle_snapshots:
+                    del self._prefix_to_id[prefix]
+                    self.prefixes[pid] = None
+                    self._free_ids.append(pid)
+                    evicted = True
+        for counters in (self.interests, self.data, self.interest_returns, self.data_bytes):
+            counters[:] = _zeros(self.max_prefixes)
+        self._groups = None
+        self._total_groups = _zeros(4 * SAMPLE_GROUPS)
+        self._sampled = False
+        if evicted or self._overflow_top:
+            # あふれていた名前にも空いた ID を割り当てられるように対応を作り直す
+            self._name_to_id.clear()
+        self.sketch.reset()
+        self._overflow_top = {}
+        self.overflow_packets = 0
+        self.overflow_bytes = 0
+        self.total_packets = 0
+        self.total_bytes = 0
+        self._interval_start = now
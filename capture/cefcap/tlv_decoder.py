@@ -0,0 +1,238 @@
+# CCNx/Cefore パケットのデコーダ (tshark を使わずにフレームから直接読み取る)
+#
+# イーサネット/IPv4/IPv6/UDP/TCP のヘッダーを読み飛ばし、CCNx 1.0 (RFC 8609) の
+# 固定ヘッダーとメッセージ内の Name TLV (Cefore のチャンク番号を含む) だけを読みます。
+# struct.unpack_from でバッファ上を直接読むため、パケットごとのコピーは名前の部分だけです。
+# 同じ名前の文字列化はキャッシュします。
+#
+# TCP はセグメントの先頭から CCNx パケットが並んでいるものとして読み、セグメントを
+# またぐパケットの再構成は行いません (途中から始まるセグメントは読み飛ばします)。
+
+import sys
+import time
+import struct
+from collections import namedtuple
+
+import config
+
+# --- CCNx 1.0 / Cefore の定数 ---
+CCNX_VERSION = 1
+PT_INTEREST = 0x00
+PT_OBJECT = 0x01
+PT_INTEREST_RETURN = 0x02
+PACKET_TYPE_NAMES = {PT_INTEREST: "Interest", PT_OBJECT: "Data", PT_INTEREST_RETURN: "InterestReturn"}
+
+T_INTEREST = 0x0001
+T_OBJECT = 0x0002
+T_NAME = 0x0000
+T_PAYLOAD = 0x0001
+T_NAMESEGMENT = 0x0001
+T_CHUNK = 0x0010  # Cefore のチャンク番号 (Name の最後のセグメント)
+
+# --- リンク層の種類 (pcap の LINKTYPE) ---
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_U16 = struct.Struct("!H")
+_TL = struct.Struct("!HH")
+_FIXED = struct.Struct("!BBHxxxB")  # version, packet_type, packet_length, header_length
+_UDP_PORTS = frozenset(config.CCNX_UDP_PORTS)
+_TCP_PORTS = frozenset(config.CCNX_TCP_PORTS)
+
+# 1つの CCNx パケット
+#   ptype       : パケットタイプ (PT_INTEREST など)
+#   name        : 名前の URI (例: "ccnx:/a/b")。チャンク番号は含まない
+#   chunk       : チャンク番号 (無ければ None)
+#   packet_len  : CCNx パケット全体の長さ
+#   payload_len : Payload TLV の長さ (無ければ 0)
+#   src, dst    : 送信元・宛先 IP アドレス (4 または 16 バイトの bytes)
+#   sport, dport: 送信元・宛先ポート
+#   proto       : IPPROTO_UDP または IPPROTO_TCP
+CcnxPacket = namedtuple("CcnxPacket", "ptype name chunk packet_len payload_len src dst sport dport proto")
+
+_name_cache = {}
+NAME_CACHE_SIZE = 1 << 16
+
+
+def name_to_uri(name_tlv):
+    """Name TLV の値 (チャンク番号を除く) を URI 文字列にします (結果はキャッシュ)。"""
+    uri = _name_cache.get(name_tlv)
+    if uri is not None:
+        return uri
+    parts = []
+    off, end = 0, len(name_tlv)
+    while off + 4 <= end:
+        t, length = _TL.unpack_from(name_tlv, off)
+        value = name_tlv[off + 4:off + 4 + length]
+        if t == T_NAMESEGMENT:
+            parts.append(value.decode("utf-8", "backslashreplace"))
+        else:
+            parts.append(f"0x{t:04x}={value.hex()}")
+        off += 4 + length
+    uri = "ccnx:/" + "/".join(parts)
+    if len(_name_cache) >= NAME_CACHE_SIZE:
+        _name_cache.clear()
+    _name_cache[bytes(name_tlv)] = uri
+    return uri
+
+
+def decode_ccnx(buf, off, end):
+    """
+    buf[off:end] の先頭の CCNx パケットを読み、(ptype, name, chunk, packet_len, payload_len)
+    を返します。CCNx パケットでなければ None を返します。
+    """
+    if end - off < 8:
+        return None
+    version, ptype, packet_len, header_len = _FIXED.unpack_from(buf, off)
+    if version != CCNX_VERSION or header_len < 8 or packet_len < header_len or off + packet_len > end:
+        return None
+    pos = off + header_len
+    msg_type, msg_len = _TL.unpack_from(buf, pos) if pos + 4 <= off + packet_len else (None, 0)
+    if msg_type not in (T_INTEREST, T_OBJECT):
+        return None
+    pos += 4
+    msg_end = min(pos + msg_len, off + packet_len)
+    name = None
+    chunk = None
+    payload_len = 0
+    while pos + 4 <= msg_end:
+        t, length = _TL.unpack_from(buf, pos)
+        pos += 4
+        if t == T_NAME:
+            name_end = pos + length
+            # 最後のセグメントがチャンク番号ならそこで名前を切る
+            seg = pos
+            cut = name_end
+            while seg + 4 <= name_end:
+                st, sl = _TL.unpack_from(buf, seg)
+                if st == T_CHUNK:
+                    chunk = int.from_bytes(buf[seg + 4:seg + 4 + sl], "big")
+                    cut = seg
+                    break
+                seg += 4 + sl
+            name = name_to_uri(bytes(buf[pos:cut]))
+        elif t == T_PAYLOAD:
+            payload_len = length
+        pos += length
+    if name is None:
+        return None
+    return ptype, name, chunk, packet_len, payload_len
+
+
+def _ip_offset(frame, linktype):
+    """リンク層ヘッダーを読み飛ばし、(IP ヘッダーの位置, IP バージョン) を返します。"""
+    if linktype == LINKTYPE_ETHERNET:
+        off = 12
+        ethertype = _U16.unpack_from(frame, off)[0]
+        while ethertype in ETHERTYPE_VLAN:
+            off += 4
+            ethertype = _U16.unpack_from(frame, off)[0]
+        off += 2
+    elif linktype == LINKTYPE_RAW:
+        return 0, frame[0] >> 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype = _U16.unpack_from(frame, 14)[0]
+        off = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype = _U16.unpack_from(frame, 0)[0]
+        off = 20
+    elif linktype == LINKTYPE_NULL:
+        return 4, frame[4] >> 4
+    else:
+        return None, None
+    if ethertype == ETHERTYPE_IPV4:
+        return off, 4
+    if ethertype == ETHERTYPE_IPV6:
+        return off, 6
+    return None, None
+
+
+def decode_frame(frame, linktype=LINKTYPE_ETHERNET):
+    """
+    1つのフレームに含まれる CCNx パケットを CcnxPacket のリストで返します
+    (UDP なら高々1つ、TCP なら複数のことがあります)。
+    """
+    try:
+        off, ipver = _ip_offset(frame, linktype)
+        if off is None:
+            return []
+        if ipver == 4:
+            ihl = (frame[off] & 0x0F) * 4
+            proto = frame[off + 9]
+            ip_end = off + _U16.unpack_from(frame, off + 2)[0]
+            if _U16.unpack_from(frame, off + 6)[0] & 0x1FFF:
+                return []  # IP フラグメントの2つ目以降
+            src = bytes(frame[off + 12:off + 16])
+            dst = bytes(frame[off + 16:off + 20])
+            off += ihl
+        elif ipver == 6:
+            proto = frame[off + 6]
+            ip_end = off + 40 + _U16.unpack_from(frame, off + 4)[0]
+            src = bytes(frame[off + 8:off + 24])
+            dst = bytes(frame[off + 24:off + 40])
+            off += 40
+        else:
+            return []
+        end = min(ip_end, len(frame))
+        sport, dport = _TL.unpack_from(frame, off)
+        if proto == IPPROTO_UDP:
+            if sport not in _UDP_PORTS and dport not in _UDP_PORTS:
+                return []
+            off += 8
+        elif proto == IPPROTO_TCP:
+            if sport not in _TCP_PORTS and dport not in _TCP_PORTS:
+                return []
+            off += (frame[off + 12] >> 4) * 4
+        else:
+            return []
+        packets = []
+        while off < end:
+            decoded = decode_ccnx(frame, off, end)
+            if decoded is None:
+                break
+            packets.append(CcnxPacket(*decoded, src, dst, sport, dport, proto))
+            if proto == IPPROTO_UDP:
+                break
+            off += decoded[3]
+        return packets
+    except (IndexError, struct.error):
+        return []  # 途中で切れたフレーム (snaplen など)
+
+
+def main(argv=None):
+    """キャプチャファイルをデコードして表示します (デコーダの確認用)。"""
+    import argparse
+    from capture_source import open_capture_file
+    parser = argparse.ArgumentParser(description="Decode CCNx packets in a capture file")
+    parser.add_argument("file", help="pcap / pcapng ファイル")
+    parser.add_argument("--quiet", action="store_true", help="パケットを表示せず、件数と速度だけを表示")
+    args = parser.parse_args(argv)
+
+    n_frames = n_packets = 0
+    t0 = time.perf_counter()
+    for ts, linktype, frame in open_capture_file(args.file):
+        n_frames += 1
+        for p in decode_frame(frame, linktype):
+            n_packets += 1
+            if not args.quiet:
+                kind = PACKET_TYPE_NAMES.get(p.ptype, f"type{p.ptype}")
+                chunk = "" if p.chunk is None else f" chunk={p.chunk}"
+                print(f"{ts:.6f} {kind} {p.name}{chunk} len={p.packet_len} payload={p.payload_len}")
+    elapsed = time.perf_counter() - t0
+    rate = n_frames / elapsed if elapsed > 0 else 0
+    print(f"{n_frames} frames, {n_packets} CCNx packets in {elapsed:.2f} s ({rate:.0f} frames/s)",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
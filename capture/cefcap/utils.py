@@ -1 +1,24 @@
 # 汎用ユーティリティ関数 (名前正規化など)
+
+import socket
+
+import config
+
+def normalize_name(name, depth=config.PREFIX_DEPTH_FOR_STATS):
+    """
+    名前を先頭から depth 個のセグメントまでのプレフィックスにします。
+    例: normalize_name("ccnx:/a/b/c/d", 2) -> "ccnx:/a/b"
+    config.NORMALIZE_NAMES_BY_PREFIX が False のときは名前をそのまま返します。
+    """
+    if not config.NORMALIZE_NAMES_BY_PREFIX or depth is None:
+        return name
+    scheme, sep, path = name.partition(":/")
+    if not sep:
+        scheme, path = "", name.lstrip("/")
+    segments = path.split("/", depth)[:depth]
+    prefix = "/" + "/".join(segments)
+    return f"{scheme}:{prefix}" if scheme else prefix
+
+def format_addr(addr):
+    """tlv_decoder が返す IP アドレス (4 / 16 バイト) を文字列にします。"""
+    return socket.inet_ntop(socket.AF_INET if len(addr) == 4 else socket.AF_INET6, addr)
@@ -0,0 +1,97 @@
+# テスト用のキャプチャファイル (data/ccnx_sample.pcap, data/ccnx_sample.pcapng) を作る
+#
+# 同じフレームを pcap と pcapng の両方に書き出します。中身は test_cefcap.py の
+# EXPECTED と対応しているので、フレームを変えたら EXPECTED も合わせて直してください。
+#
+# 使い方:
+#   python3 make_fixture.py
+
+import os
+import sys
+import struct
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefcap"))
+
+from capture_source import PcapngWriter, PcapWriter
+
+CONSUMER = bytes([10, 0, 0, 1])
+ROUTER = bytes([10, 0, 0, 2])
+PRODUCER = bytes([10, 0, 0, 3])
+CONSUMER6 = bytes.fromhex("20010db8000000000000000000000001")
+ROUTER6 = bytes.fromhex("20010db8000000000000000000000002")
+
+def tlv(t, value):
+    return struct.pack("!HH", t, len(value)) + value
+
+def ccnx(ptype, uri, chunk=None, payload=b""):
+    """CCNx 1.0 のパケット (固定ヘッダー + Interest / ContentObject メッセージ) を作ります。"""
+    segments = b"".join(tlv(0x0001, s.encode()) for s in uri.strip("/").split("/"))
+    if chunk is not None:
+        segments += tlv(0x0010, chunk.to_bytes(4, "big"))
+    body = tlv(0x0000, segments)
+    if payload:
+        body += tlv(0x0001, payload)
+    message = tlv(0x0002 if ptype == 1 else 0x0001, body)
+    return struct.pack("!BBHBBBB", 1, ptype, 8 + len(message), 64, 0, 0, 8) + message
+
+def ether(ethertype, payload):
+    return b"\x02\x00\x00\x00\x00\x02" + b"\x02\x00\x00\x00\x00\x01" + struct.pack("!H", ethertype) + payload
+
+def ipv4(src, dst, proto, l4):
+    return ether(0x0800, struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(l4), 0, 0x4000, 64, proto, 0, src, dst) + l4)
+
+def ipv6(src, dst, proto, l4):
+    return ether(0x86DD, struct.pack("!IHBB16s16s", 6 << 28, len(l4), proto, 64, src, dst) + l4)
+
+def udp(sport, dport, payload):
+    return struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+
+def tcp(sport, dport, payload):
+    # オプション (NOP x2 + タイムスタンプ) 付きでヘッダー長 32 バイト
+    options = b"\x01\x01\x08\x0a" + b"\x00" * 8
+    return struct.pack("!HHIIBBHHH", sport, dport, 1, 1, 8 << 4, 0x18, 65535, 0, 0) + options + payload
+
+def frames():
+    """(時刻, フレーム) のリスト"""
+    t0 = 1_700_000_000.0
+    return [
+        # UDP: Interest と Data (RTT 10ms)
+        (t0 + 0.000, ipv4(CONSUMER, ROUTER, 17, udp(40000, 9695, ccnx(0, "/iot/sensor/1", 0)))),
+        (t0 + 0.010, ipv4(ROUTER, CONSUMER, 17, udp(9695, 40000, ccnx(1, "/iot/sensor/1", 0, b"a" * 100)))),
+        # UDP: 再送された Interest (RTT は再送から 10ms)
+        (t0 + 0.020, ipv4(CONSUMER, ROUTER, 17, udp(40000, 9695, ccnx(0, "/iot/sensor/1", 1)))),
+        (t0 + 0.050, ipv4(CONSUMER, ROUTER, 17, udp(40000, 9695, ccnx(0, "/iot/sensor/1", 1)))),
+        (t0 + 0.060, ipv4(ROUTER, CONSUMER, 17, udp(9695, 40000, ccnx(1, "/iot/sensor/1", 1, b"b" * 200)))),
+        # CCNx ではない UDP (DNS)
+        (t0 + 0.070, ipv4(CONSUMER, ROUTER, 17, udp(40001, 53, b"\x00" * 20))),
+        # TCP: 1セグメントに Interest が2つ、応答の Data も2つ (RTT 30ms)
+        (t0 + 0.100, ipv4(CONSUMER, PRODUCER, 6, tcp(50000, 9696, ccnx(0, "/video/a", 0) + ccnx(0, "/video/a", 1)))),
+        (t0 + 0.130, ipv4(PRODUCER, CONSUMER, 6,
+                          tcp(9696, 50000, ccnx(1, "/video/a", 0, b"c" * 300) + ccnx(1, "/video/a", 1, b"d" * 50)))),
+        # 応答の無い Interest
+        (t0 + 0.200, ipv4(CONSUMER, ROUTER, 17, udp(40000, 9695, ccnx(0, "/iot/sensor/2", 0)))),
+        # InterestReturn (NACK)
+        (t0 + 0.300, ipv4(CONSUMER, PRODUCER, 17, udp(40000, 9695, ccnx(0, "/video/b", 7)))),
+        (t0 + 0.305, ipv4(PRODUCER, CONSUMER, 17, udp(9695, 40000, ccnx(2, "/video/b", 7)))),
+        # チャンク番号の無い名前 (IPv6, RTT 5ms)
+        (t0 + 0.400, ipv6(CONSUMER6, ROUTER6, 17, udp(40000, 9695, ccnx(0, "/meta/info")))),
+        (t0 + 0.405, ipv6(ROUTER6, CONSUMER6, 17, udp(9695, 40000, ccnx(1, "/meta/info", None, b"e" * 10)))),
+        # CCNx のポート以外の TCP
+        (t0 + 0.500, ipv4(CONSUMER, PRODUCER, 6, tcp(50001, 80, ccnx(0, "/video/a", 2)))),
+    ]
+
+def main():
+    data_dir = os.path.join(HERE, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    pcap = PcapWriter(os.path.join(data_dir, "ccnx_sample.pcap"))
+    pcapng = PcapngWriter(os.path.join(data_dir, "ccnx_sample.pcapng"))
+    for ts, frame in frames():
+        pcap.write(ts, frame)
+        pcapng.write(ts, frame)
+    pcap.close()
+    pcapng.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
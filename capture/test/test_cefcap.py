@@ -0,0 +1,402 @@
+# cefcap のデコーダ・読み込み・RTT 計測・カーネル内フィルタ・リングバッファ・パイプライン・レポート・サンプリングのテスト
+#
+# data/ccnx_sample.pcap(ng) は make_fixture.py で作ったもので、中身は EXPECTED のとおりです。
+
+import os
+import sys
+import argparse
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefcap"))
+
+import config
+import reporter
+from bpf_filter import compile_filter, run_filter
+from capture_source import MappedCapture, PcapngWriter, open_capture_file, read_pcap, read_pcapng
+from main import main as cefcap_main, run_pipeline
+from packet_analyzer import PacketTable, match_interest_data
+from ringcap import RingCapture, extract, load_manifest, record
+from rtt_matcher import RttMatcher
+from sampling import FlowHashSampler
+from stats_collector import COUNTERS, StatsCollector
+from tlv_decoder import (PT_INTEREST, PT_INTEREST_RETURN, PT_OBJECT, IPPROTO_TCP, IPPROTO_UDP, CcnxPacket,
+                         decode_frame)
+from utils import format_addr, normalize_name
+
+PCAP = os.path.join(HERE, "data", "ccnx_sample.pcap")
+PCAPNG = os.path.join(HERE, "data", "ccnx_sample.pcapng")
+T0 = 1_700_000_000.0
+
+# フレームごとの (ptype, name, chunk, packet_len, payload_len, src, proto) のリスト
+EXPECTED = [
+    [(PT_INTEREST, "ccnx:/iot/sensor/1", 0, 46, 0, "10.0.0.1", IPPROTO_UDP)],
+    [(PT_OBJECT, "ccnx:/iot/sensor/1", 0, 150, 100, "10.0.0.2", IPPROTO_UDP)],
+    [(PT_INTEREST, "ccnx:/iot/sensor/1", 1, 46, 0, "10.0.0.1", IPPROTO_UDP)],
+    [(PT_INTEREST, "ccnx:/iot/sensor/1", 1, 46, 0, "10.0.0.1", IPPROTO_UDP)],
+    [(PT_OBJECT, "ccnx:/iot/sensor/1", 1, 250, 200, "10.0.0.2", IPPROTO_UDP)],
+    [],
+    [(PT_INTEREST, "ccnx:/video/a", 0, 38, 0, "10.0.0.1", IPPROTO_TCP),
+     (PT_INTEREST, "ccnx:/video/a", 1, 38, 0, "10.0.0.1", IPPROTO_TCP)],
+    [(PT_OBJECT, "ccnx:/video/a", 0, 342, 300, "10.0.0.3", IPPROTO_TCP),
+     (PT_OBJECT, "ccnx:/video/a", 1, 92, 50, "10.0.0.3", IPPROTO_TCP)],
+    [(PT_INTEREST, "ccnx:/iot/sensor/2", 0, 46, 0, "10.0.0.1", IPPROTO_UDP)],
+    [(PT_INTEREST, "ccnx:/video/b", 7, 38, 0, "10.0.0.1", IPPROTO_UDP)],
+    [(PT_INTEREST_RETURN, "ccnx:/video/b", 7, 38, 0, "10.0.0.3", IPPROTO_UDP)],
+    [(PT_INTEREST, "ccnx:/meta/info", None, 32, 0, "2001:db8::1", IPPROTO_UDP)],
+    [(PT_OBJECT, "ccnx:/meta/info", None, 46, 10, "2001:db8::2", IPPROTO_UDP)],
+    [],
+]
+
+def read_frames(path):
+    return [(ts, linktype, bytes(frame)) for ts, linktype, frame in open_capture_file(path)]
+
+def decoded_packets(path):
+    """(ts, CcnxPacket) のリスト"""
+    return [(ts, p) for ts, linktype, frame in read_frames(path) for p in decode_frame(frame, linktype)]
+
+@pytest.mark.parametrize("path", [PCAP, PCAPNG])
+def test_decode_frame(path):
+    frames = read_frames(path)
+    assert len(frames) == len(EXPECTED)
+    for (ts, linktype, frame), expected in zip(frames, EXPECTED):
+        got = [(p.ptype, p.name, p.chunk, p.packet_len, p.payload_len, format_addr(p.src), p.proto)
+               for p in decode_frame(frame, linktype)]
+        assert got == expected
+
+def test_decode_frame_truncated():
+    ts, linktype, frame = read_frames(PCAP)[1]
+    # snaplen で切れたフレームは (例外にせず) 読み飛ばす
+    assert decode_frame(frame[:60], linktype) == []
+
+def test_pcap_and_pcapng_agree():
+    pcap = list(read_pcap(PCAP))
+    pcapng = list(read_pcapng(PCAPNG))
+    assert len(pcap) == len(pcapng) == len(EXPECTED)
+    for (ts1, lt1, f1), (ts2, lt2, f2) in zip(pcap, pcapng):
+        assert ts1 == pytest.approx(ts2, abs=1e-6)
+        assert lt1 == lt2
+        assert bytes(f1) == bytes(f2)
+
+@pytest.mark.parametrize("path, reader", [(PCAP, read_pcap), (PCAPNG, read_pcapng)])
+def test_mapped_capture_split(path, reader):
+    expected = [(ts, linktype, bytes(frame)) for ts, linktype, frame in reader(path)]
+    with MappedCapture(path) as capture:
+        assert [(ts, lt, bytes(f)) for ts, lt, f in capture] == expected
+        assert len(capture.split(4)) > 1
+        for n in range(1, 6):
+            ranges = capture.split(n)
+            got = [(ts, lt, bytes(f)) for start, end in ranges for ts, lt, f in capture.iter_range(start, end)]
+            assert got == expected
+
+def test_match_interest_data():
+    packets = decoded_packets(PCAPNG)
+    table = PacketTable.from_packets(packets)
+    interest_rows, data_rows, rtt = match_interest_data(table)
+    pairs = sorted(zip(interest_rows.tolist(), data_rows.tolist(), rtt.tolist()))
+    # 再送された Interest は新しい方と対応づく
+    assert [(i, d) for i, d, _ in pairs] == [(0, 1), (3, 4), (5, 7), (6, 8), (12, 13)]
+    assert [r for _, _, r in pairs] == pytest.approx([0.010, 0.010, 0.030, 0.030, 0.005], abs=1e-6)
+
+def test_rtt_matcher():
+    matcher = RttMatcher(depth=3)
+    rtts = [matcher.add(ts, p) for ts, p in decoded_packets(PCAPNG)]
+    assert [r for r in rtts if r is not None] == pytest.approx([0.010, 0.010, 0.030, 0.030, 0.005], abs=1e-6)
+    matcher.flush()
+    assert matcher.counters() == {"matched": 5, "expired": 1, "outstanding": 0, "retransmissions": 1,
+                                  "nacked": 1, "unmatched_data": 0, "dropped": 0}
+    rows = {r["prefix"]: r for r in matcher.prefix_rows()}
+    assert rows["ccnx:/iot/sensor/1"]["count"] == 2
+    assert rows["ccnx:/iot/sensor/2"]["timeouts"] == 1
+    assert rows["ccnx:/video/a"]["count"] == 2
+    assert {r["hop"]: r["count"] for r in matcher.hop_rows()} == {"10.0.0.2": 2, "10.0.0.3": 2, "2001:db8::2": 1}
+
+def test_rtt_matcher_timeout():
+    matcher = RttMatcher(timeout_sec=0.05, tick_sec=0.01, depth=3)
+    packets = decoded_packets(PCAPNG)
+    for ts, p in packets:
+        matcher.add(ts, p)
+    # /iot/sensor/2 (0.2 秒) は /video/b の Interest (0.3 秒) の時点で期限切れになっている
+    assert matcher.expired == 1
+    assert matcher.counters()["outstanding"] == 0
+
+def test_compile_filter_ports():
+    program = compile_filter(prefixes=(), sample_rate=1, snaplen=65535)
+    for (ts, linktype, frame), expected in zip(read_frames(PCAPNG), EXPECTED):
+        assert run_filter(program, frame) == (65535 if expected else 0)
+
+def test_compile_filter_prefix():
+    program = compile_filter(prefixes=("/video",), sample_rate=1, snaplen=1500)
+    for (ts, linktype, frame), expected in zip(read_frames(PCAPNG), EXPECTED):
+        keep = bool(expected) and expected[0][1].startswith("ccnx:/video/")
+        assert run_filter(program, frame) == (1500 if keep else 0)
+
+def test_compile_filter_sample():
+    program = compile_filter(prefixes=(), sample_rate=4, snaplen=65535)
+    ts, linktype, frame = read_frames(PCAPNG)[0]
+    assert run_filter(program, frame, rand=lambda: 8) == 65535
+    assert run_filter(program, frame, rand=lambda: 9) == 0
+
+def test_compile_filter_many_long_prefixes():
+    # 1つずつは MAX_PREFIX_BYTES 以内でも、合計では条件分岐の届く 255 命令を超えるプレフィックスの並び
+    prefixes = ["/" + "x" * 80 + str(i) for i in range(6)] + ["/video"]
+    program = compile_filter(prefixes=prefixes, sample_rate=1, snaplen=1500)
+    assert len(program) > 256
+    for (ts, linktype, frame), expected in zip(read_frames(PCAPNG), EXPECTED):
+        keep = bool(expected) and expected[0][1].startswith("ccnx:/video/")
+        assert run_filter(program, frame) == (1500 if keep else 0)
+
+# --- ringcap ---
+
+def ccnx_frames():
+    """フィクスチャのうち CCNx パケットを含むフレーム (ringcap.record が書くもの)"""
+    return [(ts, linktype, frame) for ts, linktype, frame in read_frames(PCAP) if decode_frame(frame, linktype)]
+
+def build_ring(directory, segment_bytes=1000, n_segments=100, depth=config.PREFIX_DEPTH_FOR_STATS):
+    ring = RingCapture(str(directory), segment_bytes, n_segments, depth=depth)
+    try:
+        assert record(read_frames(PCAP), ring) == len(ccnx_frames())
+    finally:
+        ring.close()
+
+def extracted(directory, out, **query):
+    n = extract(str(directory), str(out), **query)
+    frames = [(ts, bytes(frame)) for ts, linktype, frame in read_pcap(str(out))]
+    assert len(frames) == n
+    return frames
+
+def test_ringcap_rotation(tmp_path):
+    build_ring(tmp_path / "ring")
+    segments = load_manifest(str(tmp_path / "ring"))["segments"]
+    assert len(segments) > 2
+    assert sum(s["frames"] for s in segments) == len(ccnx_frames())
+    expected = [(pytest.approx(ts, abs=1e-6), frame) for ts, linktype, frame in ccnx_frames()]
+    assert extracted(tmp_path / "ring", tmp_path / "all.pcap") == expected
+
+    # 残すセグメント数を超えた古いセグメントはファイルごと消える
+    build_ring(tmp_path / "small", n_segments=2)
+    segments = load_manifest(str(tmp_path / "small"))["segments"]
+    assert len(segments) == 2
+    assert sorted(os.listdir(tmp_path / "small")) == sorted(
+        [f"seg_{s['seq']:08d}{ext}" for s in segments for ext in (".pcapng", ".idx", ".prefixes")] + ["ring.json"])
+    kept = extracted(tmp_path / "small", tmp_path / "small.pcap")
+    assert 0 < len(kept) < len(expected)
+    assert kept == expected[-len(kept):]
+
+def test_ringcap_extract_time(tmp_path):
+    build_ring(tmp_path / "ring")
+    frames = extracted(tmp_path / "ring", tmp_path / "out.pcap", start=T0 + 0.1, end=T0 + 0.3)
+    assert [round(ts - T0, 3) for ts, frame in frames] == [0.1, 0.13, 0.2, 0.3]
+
+@pytest.mark.parametrize("prefix, depth, expected", [
+    ("/video", 3, [0.1, 0.13, 0.3, 0.305]),
+    ("ccnx:/video/a", 3, [0.1, 0.13]),
+    ("/video/a", 1, [0.1, 0.13]),  # 索引より深いプレフィックスはデコードして確かめる
+    ("/iot/sensor/1/", 3, [0.0, 0.01, 0.02, 0.05, 0.06]),
+    ("/", 3, None),
+    ("ccnx:/", 3, None),
+])
+def test_ringcap_extract_prefix(tmp_path, prefix, depth, expected):
+    build_ring(tmp_path / "ring", depth=depth)
+    frames = extracted(tmp_path / "ring", tmp_path / "out.pcap", prefix=prefix)
+    if expected is None:  # ルートは絞り込まない
+        expected = [round(ts - T0, 3) for ts, linktype, frame in ccnx_frames()]
+    assert [round(ts - T0, 3) for ts, frame in frames] == expected
+
+# --- パイプライン (main.py) ---
+
+def pipeline_args(**overrides):
+    args = dict(parsers=2, sampling="none", sample_n=config.SAMPLING_N, sample_rate=config.SAMPLING_FLOW_RATE,
+                target_pps=config.SAMPLING_TARGET_PPS, depth=config.PREFIX_DEPTH_FOR_STATS,
+                ring_slots=4, slot_bytes=1024, snapshot_interval=config.STATS_SNAPSHOT_INTERVAL_SEC,
+                snapshot_file=None, status_interval=60.0)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+def run_fixture_pipeline(path=PCAPNG, **overrides):
+    with MappedCapture(path) as capture:
+        return run_pipeline(iter(capture), lossless=True, args=pipeline_args(**overrides))
+
+def expected_prefix_totals():
+    totals = {}
+    for ptype, name, chunk, packet_len, payload_len, src, proto in (p for frame in EXPECTED for p in frame):
+        t = totals.setdefault(normalize_name(name, config.PREFIX_DEPTH_FOR_STATS), dict.fromkeys(COUNTERS, 0))
+        t[{PT_INTEREST: "interests", PT_OBJECT: "data", PT_INTEREST_RETURN: "interest_returns"}[ptype]] += 1
+        if ptype == PT_OBJECT:
+            t["data_bytes"] += payload_len
+    return totals
+
+def test_pipeline_counts():
+    # slot_bytes を小さくして、複数のバッチが2つのパーサーに分かれるようにする
+    report = run_fixture_pipeline()
+    packets = [p for frame in EXPECTED for p in frame]
+    assert report["packet_types"] == {"Interest": 8, "Data": 5, "InterestReturn": 1}
+    assert report["prefixes"] == expected_prefix_totals()
+    assert report["sampled"] is False
+    assert report["rtt_counters"]["matched"] == 5
+    stats = report["pipeline"]
+    assert stats["captured"] == len(EXPECTED)
+    assert stats["aggregated_packets"] == sum(stats["parsed_packets"]) == len(packets)
+    assert stats["batches"] == stats["aggregated_batches"] == sum(stats["parsed_batches"]) > 1
+    assert stats["ring_drops"] == stats["sampled_out"] == stats["truncated"] == stats["reorder_pending"] == 0
+
+def test_pipeline_truncates_large_frames():
+    # 1スロットに入りきらないフレーム (TCP で Data が2つ入ったもの) は切り詰めて渡す
+    report = run_fixture_pipeline(slot_bytes=400)
+    stats = report["pipeline"]
+    assert stats["captured"] == len(EXPECTED)
+    assert stats["truncated"] == 1
+    assert report["packet_types"]["Interest"] == 8
+    assert report["prefixes"]["ccnx:/video/a"]["data"] == 0
+
+def test_main_analyze(capsys):
+    assert cefcap_main(["analyze", "--file", PCAP, "--parsers", "1", "--show-stats", "packet_types,pipeline"]) == 0
+    out = capsys.readouterr().out
+    assert "== packet types ==" in out and "== prefixes ==" not in out
+    lines = dict(line.split(None, 1) for line in out.splitlines() if line and not line.startswith("=="))
+    assert lines["Interest"].strip() == "8"
+    assert lines["captured"].strip() == str(len(EXPECTED))
+
+# --- reporter ---
+
+def write_segment(path, shift=0.0, count=None):
+    """フィクスチャのフレームを時刻を shift 秒ずらして pcapng に書きます (count があれば先頭の count 個だけ)。"""
+    writer = PcapngWriter(str(path))
+    for ts, linktype, frame in read_frames(PCAPNG)[:count]:
+        writer.write(ts + shift, frame)
+    writer.close()
+
+def interval_rows(conn):
+    """{(interval, prefix): (rowid, interests, data)}"""
+    return {(iv, prefix): (rowid, i, d) for rowid, iv, prefix, i, d in conn.execute(
+        "SELECT rowid, interval, prefix, interests, data FROM interval_prefix")}
+
+def test_reporter_update_incremental(tmp_path):
+    a, b = tmp_path / "a.pcapng", tmp_path / "b.pcapng"
+    write_segment(a)
+    write_segment(b, shift=600.0, count=7)
+    conn = reporter.open_db(str(tmp_path / "report.sqlite3"), interval_sec=300)
+    assert reporter.update(conn, [str(a), str(b)]) == (2, 2)
+    first = interval_rows(conn)
+    iv_a, iv_b = int(T0 // 300 * 300), int((T0 + 600) // 300 * 300)
+    assert {iv for iv, prefix in first} == {iv_a, iv_b}
+
+    # 変わっていなければ何もしない
+    assert reporter.update(conn, [str(a), str(b)]) == (0, 0)
+    assert interval_rows(conn) == first
+
+    # b だけが伸びたら、b の区間だけを作り直す
+    write_segment(b, shift=600.0)
+    assert reporter.update(conn, [str(a), str(b)]) == (1, 1)
+    second = interval_rows(conn)
+    assert {k: v for k, v in second.items() if k[0] == iv_a} == {k: v for k, v in first.items() if k[0] == iv_a}
+    assert second[(iv_b, "ccnx:/video/a")][1:] == (2, 2)
+    assert first[(iv_b, "ccnx:/video/a")][1:] == (2, 0)
+
+    report = reporter.build_report(conn)
+    totals = {r["prefix"]: r for r in report["prefixes"]}
+    for prefix, t in expected_prefix_totals().items():
+        assert (totals[prefix]["interests"], totals[prefix]["data"], totals[prefix]["data_bytes"]) == (
+            2 * t["interests"], 2 * t["data"], 2 * t["data_bytes"])
+    conn.close()
+
+def test_reporter_settings(tmp_path):
+    db = str(tmp_path / "report.sqlite3")
+    reporter.open_db(db, interval_sec=60, depth=2).close()
+    # 省略すれば作ったときの値を使う
+    conn = reporter.open_db(db)
+    assert reporter.db_settings(conn) == (60, 2)
+    conn.close()
+    with pytest.raises(ValueError):
+        reporter.open_db(db, interval_sec=300)
+    with pytest.raises(SystemExit):
+        reporter.main(["update", "--db", db, "--depth", "3"])
+    assert reporter.main(["update", "--db", db, PCAP]) == 0
+
+# --- サンプリング ---
+
+CLIENTS = [bytes([10, 0, 1, i]) for i in range(1, 9)]
+SERVER = bytes([10, 0, 0, 3])
+
+def synthetic_traffic():
+    """(時刻, CcnxPacket) のリスト。4 つのプレフィックスに、クライアントごとのチャンクの Interest/Data の組と、一部に NACK"""
+    packets = []
+    ts = T0
+    for k, n_chunks in enumerate((4000, 2000, 1000, 500)):
+        name = f"ccnx:/p{k}/obj"
+        for client in CLIENTS:
+            for chunk in range(n_chunks // len(CLIENTS)):
+                ts += 0.0001
+                packets.append((ts, CcnxPacket(PT_INTEREST, name, chunk, 46, 0, client, SERVER, 40000, 9695,
+                                               IPPROTO_UDP)))
+                if chunk % 50 == 7:
+                    packets.append((ts, CcnxPacket(PT_INTEREST_RETURN, name, chunk, 46, 0, SERVER, client, 9695,
+                                                   40000, IPPROTO_UDP)))
+                    continue
+                size = 1000 + chunk % 13 * 37
+                packets.append((ts, CcnxPacket(PT_OBJECT, name, chunk, size + 50, size, SERVER, client, 9695,
+                                               40000, IPPROTO_UDP)))
+    return packets
+
+def collect(packets, sampler=None):
+    collector = StatsCollector(snapshot_interval_sec=1e9)
+    for ts, p in packets:
+        if sampler is None:
+            collector.add(ts, p)
+            continue
+        weight, group = sampler.keep(ts, p)
+        if weight:
+            collector.add(ts, p, weight, group)
+    return collector.snapshot(packets[-1][0])
+
+def test_flow_sampler_keeps_pairs():
+    sampler = FlowHashSampler(0.1)
+    kept = {}
+    for ts, p in synthetic_traffic():
+        kept.setdefault((p.name, p.chunk, frozenset((p.src, p.dst))), set()).add(sampler.keep(ts, p)[0])
+    # Interest とその Data (または NACK) は必ず同じ判定になる
+    assert all(len(weights) == 1 for weights in kept.values())
+    n_kept = sum(1 for weights in kept.values() if weights == {10.0})
+    assert 0.08 * len(kept) < n_kept < 0.12 * len(kept)
+
+def test_flow_sampler_estimates():
+    packets = synthetic_traffic()
+    truth = {row["prefix"]: row for row in collect(packets)["prefixes"]}
+    snapshot = collect(packets, FlowHashSampler(0.1))
+    assert snapshot["sampled"] is True
+    rows = {row["prefix"]: row for row in snapshot["prefixes"]}
+    assert rows.keys() == truth.keys()
+    for prefix, row in rows.items():
+        for key in COUNTERS:
+            if truth[prefix]["data" if key == "data_bytes" else key] < 200:
+                continue  # 残るのが 20 個未満と見込まれる値は、誤差の推定自体があてにならない
+            err = row[key + "_err"]
+            assert 0 < err < 0.5 * truth[prefix][key]
+            # 95% 信頼区間の半幅なので、まれに外れうる分として 1.5 倍まで許す
+            assert abs(row[key] - truth[prefix][key]) <= 1.5 * err, (prefix, key)
+    assert abs(snapshot["total_packets"] - sum(r["interests"] + r["data"] + r["interest_returns"]
+                                               for r in truth.values())) <= 1.5 * snapshot["total_packets_err"]
+
+def test_unsampled_snapshot_has_no_errors():
+    snapshot = collect(synthetic_traffic())
+    assert snapshot["sampled"] is False
+    assert not any(key.endswith("_err") for row in snapshot["prefixes"] for key in row)
+
+def test_pipeline_nth_sampling():
+    report = run_fixture_pipeline(PCAP, sampling="nth", sample_n=2, parsers=1)
+    stats = report["pipeline"]
+    assert report["sampled"] is True
+    assert stats["captured"] == len(EXPECTED)
+    assert stats["sampled_out"] == len(EXPECTED) // 2
+    # 残したフレームは重み 2 で数える
+    assert sum(report["packet_types"].values()) == 2 * stats["aggregated_packets"]
+
+def test_pipeline_flow_sampling():
+    report = run_fixture_pipeline(sampling="flow", sample_rate=0.5)
+    stats = report["pipeline"]
+    packets = [p for frame in EXPECTED for p in frame]
+    assert report["sampled"] is True
+    # パーサーごとに数えた間引いた数と、残した数を足すと全パケット数になる
+    assert stats["aggregated_packets"] + stats["sampled_out"] == len(packets)
+    assert 0 < stats["sampled_out"] < len(packets)
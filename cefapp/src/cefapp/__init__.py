@@ -4,3 +4,12 @@ from cefapp.cefapp import (
     CefAppProducer,
     MetaInfoNotResolvedError,
 )
+from cefapp.profiler import (
+    CefAppProfiler,
+    SamplingProfiler,
+)
+from cefapp.trace import (
+    ReplayHandle,
+    TraceModel,
+    TraceRecorder,
+)
@@ -38,6 +38,10 @@ from rich.traceback import install as _rich_traceback_install
 from cefapp import CefAppConsumer
 from cefapp import MetaInfoNotResolvedError
 from cefapp import CefAppProducer
+from cefapp import CefAppProfiler
+from cefapp.profiler import run_profiled
+from cefapp import TraceModel, TraceRecorder
+from cefapp.trace import sweep
 
 _rich_traceback_install()
 
@@ -54,6 +58,40 @@ _log_hdl.setFormatter(_log_fmt)
 log.addHandler(_log_hdl)
 
 
+def profile_options(func):
+    func = click.option(
+        "--profile-out",
+        default="",
+        help="Output file of raw cProfile stats (with --profiler cprofile).",
+    )(func)
+    func = click.option(
+        "--profiler",
+        type=click.Choice(["none", "cprofile", "sample"]),
+        default="none",
+        help=(
+            "Profiler used with --profile: "
+            "[none] Phase counters only. [cprofile] Run under cProfile. "
+            "[sample] Run under a sampling profiler."
+        ),
+    )(func)
+    func = click.option(
+        "--profile",
+        is_flag=True,
+        help="Enable per-phase timing and print a breakdown at the end.",
+    )(func)
+    return func
+
+
+def run_app(app, name, profile, profiler, profile_out):
+    if not profile:
+        app.run(name)
+        return
+    try:
+        run_profiled(lambda: app.run(name), profiler, profile_out)
+    finally:
+        click.echo(app.profiler.report(), err=True)
+
+
 @click.group()
 def cmd():
     pass
@@ -89,23 +127,38 @@ def cmd():
 )
 @click.option("--debug", "-g", is_flag=True, help="Enable debug flag.")
 @click.option("--quiet", "-q", is_flag=True, help="Enable quiet flag.")
-def consumer(name, timeout, pipeline, filename, output, debug, quiet):
+@click.option(
+    "--trace",
+    default="",
+    help="Record a packet-level trace to this file (for `cefapp replay`).",
+)
+@profile_options
+def consumer(
+    name, timeout, pipeline, filename, output, debug, quiet, trace,
+    profile, profiler, profile_out,
+):
     data_store = output != "none"
     enb_log = not quiet
     if debug:
         log.setLevel(logging.DEBUG)
     with cefpyco.create_handle(enable_log=enb_log) as h:
+        if trace:
+            h = TraceRecorder(h, name)
         app = CefAppConsumer(
             h,
             timeout_limit=timeout,
             pipeline=pipeline,
             data_store=data_store,
             enable_log=enb_log,
+            profiler=CefAppProfiler() if profile else None,
         )
         try:
-            app.run(name)
+            run_app(app, name, profile, profiler, profile_out)
         except MetaInfoNotResolvedError as e:
             return
+        finally:
+            if trace:
+                h.write_csv(trace)
         if filename or output == "file":
             with open(filename or name.split("/")[-1], "w") as f:
                 f.write(app.data)
@@ -138,7 +191,11 @@ def consumer(name, timeout, pipeline, filename, output, debug, quiet):
 )
 @click.option("--debug", "-g", is_flag=True, help="Enable debug flag.")
 @click.option("--quiet", "-q", is_flag=True, help="Enable quiet flag.")
-def producer(name, arg, timeout, block_size, input, debug, quiet):
+@profile_options
+def producer(
+    name, arg, timeout, block_size, input, debug, quiet,
+    profile, profiler, profile_out,
+):
     enb_log = not quiet
     if debug:
         log.setLevel(logging.DEBUG)
@@ -154,9 +211,76 @@ def producer(name, arg, timeout, block_size, input, debug, quiet):
         return
     with cefpyco.create_handle(enable_log=enb_log) as h:
         app = CefAppProducer(
-            h, timeout_limit=timeout, data=data, cob_len=block_size, enable_log=enb_log
+            h,
+            timeout_limit=timeout,
+            data=data,
+            cob_len=block_size,
+            enable_log=enb_log,
+            profiler=CefAppProfiler() if profile else None,
+        )
+        run_app(app, name, profile, profiler, profile_out)
+
+
+def int_list(ctx, param, value):
+    try:
+        return [int(v) for v in value.split(",")]
+    except ValueError:
+        raise click.BadParameter("must be comma-separated integers")
+
+
+def float_list(ctx, param, value):
+    try:
+        return [float(v) for v in value.split(",")]
+    except ValueError:
+        raise click.BadParameter("must be comma-separated numbers")
+
+
+@cmd.command()
+@click.argument("trace")
+@click.option("--run-id", "-r", type=int, default=None, help="Run to replay (default: first run).")
+@click.option(
+    "--pipeline",
+    "-s",
+    default="10",
+    callback=int_list,
+    help="Comma-separated numbers of pipeline to try.",
+)
+@click.option(
+    "--timeout",
+    "-t",
+    default="2",
+    callback=int_list,
+    help="Comma-separated timeout limits to try.",
+)
+@click.option(
+    "--receive-timeout",
+    "-w",
+    default="4",
+    callback=float_list,
+    help="Comma-separated durations of one failed receive (seconds) to try.",
+)
+@click.option("--seed", default=0, help="Seed for transmissions not in the trace.")
+def replay(trace, run_id, pipeline, timeout, receive_timeout, seed):
+    model = TraceModel.from_file(trace, run_id)
+    if not model.count:
+        log.error("No chunks in %s", trace)
+        return
+    click.echo(
+        "trace: %d chunks, %d RTT samples, loss rate %.2f%%"
+        % (model.count, len(model.rtts), model.loss_rate * 100)
+    )
+    click.echo(
+        "%8s %8s %8s %12s %10s %9s %10s %8s"
+        % ("pipeline", "timeout", "recv[s]", "time[s]", "Mbps",
+           "interests", "timeouts", "done%")
+    )
+    for r in sweep(model, pipeline, timeout, receive_timeout, seed):
+        click.echo(
+            "%8d %8d %8.2f %12.3f %10.3f %9d %10d %8.2f"
+            % (r["pipeline"], r["timeout_limit"], r["receive_timeout_sec"],
+               r["total_time_sec"], r["throughput_mbps"], r["interests_sent"],
+               r["timeouts"], 100.0 * r["chunks_received"] / r["chunks_expected"])
         )
-        app.run(name)
 
 
 def main():
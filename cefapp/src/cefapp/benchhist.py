@@ -0,0 +1,274 @@
+# benchhist.py
+# 性能評価結果の履歴 (SQLite) と、ベースラインに対する性能劣化の検出
+#
+# 使い方:
+#   python benchhist.py list
+#   python benchhist.py compare --baseline <rev> [--candidate <rev>] [--script c3]
+import os
+import sys
+import json
+import math
+import socket
+import sqlite3
+import argparse
+import datetime
+import subprocess
+
+# --- 設定 ---
+HISTORY_DB = "cefpyco_bench_history.sqlite3"
+ALPHA = 0.05  # 有意水準
+MIN_CHANGE = 0.05  # これ未満の相対変化は劣化とみなさない (5%)
+DIRTY = "+dirty"  # 未コミットの変更がある作業ツリーで記録したリビジョンに付ける印
+MIN_ABBREV = 7  # 短縮SHAとして前方一致させる最小の長さ (git の既定の短縮長)
+
+# 指標ごとの「良い方向」 (+1: 大きい方が良い, -1: 小さい方が良い)
+# ここにない指標は記録されるが比較対象にはならない
+METRIC_DIRECTIONS = {
+    'throughput_mbps': +1,
+    'success_rate_percent': +1,
+    'interests_per_sec': +1,
+    'total_time_sec': -1,
+    'timeouts': -1,
+    'avg_chunk_rtt_ms': -1,
+    'avg_service_time_us': -1,
+    'p99_service_time_us': -1,
+    'cpu_us_per_data': -1,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at TEXT NOT NULL,
+    git_rev TEXT NOT NULL,
+    host TEXT NOT NULL,
+    script TEXT NOT NULL,
+    params TEXT NOT NULL,
+    run_id INTEGER,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_key
+    ON results (git_rev, host, script, params, metric);
+"""
+
+def connect(path=HISTORY_DB):
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _git(*args):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run(["git", *args], cwd=cwd,
+        capture_output=True, text=True, check=True).stdout.strip()
+
+def current_git_rev():
+    """作業ツリーのgitリビジョン (完全なSHA) を返す (未コミットの変更があれば +dirty を付ける)"""
+    try:
+        rev = _git("rev-parse", "HEAD")
+        dirty = _git("status", "--porcelain", "--untracked-files=no")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + DIRTY if dirty else rev
+
+def _split_dirty(rev):
+    """"<sha>+dirty" を ("<sha>", "+dirty") に分ける"""
+    return (rev[:-len(DIRTY)], DIRTY) if rev.endswith(DIRTY) else (rev, "")
+
+def resolve_git_rev(rev):
+    """ブランチ名・タグ・HEAD~1・短縮SHAなどを完全なSHAにする (+dirty はそのまま残す)
+
+    解決できない場合 (別のリポジトリで記録した履歴など) は rev をそのまま返す。
+    """
+    base, dirty = _split_dirty(rev)
+    try:
+        return _git("rev-parse", "--verify", "--quiet", base + "^{commit}") + dirty
+    except (OSError, subprocess.CalledProcessError):
+        return rev
+
+def same_rev(stored, rev):
+    """履歴の git_rev が rev と同じリビジョンか (以前の記録は短縮SHAなので前方一致でも比べる)"""
+    if stored == rev:
+        return True
+    (a, a_dirty), (b, b_dirty) = _split_dirty(stored), _split_dirty(rev)
+    return a_dirty == b_dirty and min(len(a), len(b)) >= MIN_ABBREV and (a.startswith(b) or b.startswith(a))
+
+def short_rev(rev):
+    """表示用に完全なSHAを12桁に縮める (+dirty はそのまま)"""
+    base, dirty = _split_dirty(rev)
+    return base[:12] + dirty
+
+def record_results(script, params, results, path=HISTORY_DB, git_rev=None, host=None):
+    """評価結果を履歴に追記する
+
+    results の各行のうち数値の列は指標として、文字列の列 (p3.py の target など) は
+    パラメータとして記録する。
+    """
+    git_rev = git_rev or current_git_rev()
+    host = host or socket.gethostname()
+    recorded_at = datetime.datetime.now().isoformat()
+    rows = []
+    for r in results:
+        row_params = dict(params)
+        row_params.update({k: v for k, v in r.items() if isinstance(v, str)})
+        params_s = json.dumps(row_params, sort_keys=True)
+        for k, v in r.items():
+            if k == 'run_id' or isinstance(v, str) or v is None:
+                continue
+            rows.append((recorded_at, git_rev, host, script, params_s,
+                r.get('run_id'), k, float(v)))
+    with connect(path) as conn:
+        conn.executemany(
+            "INSERT INTO results (recorded_at, git_rev, host, script, params, run_id, metric, value)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.close()
+    print(f"Recorded {len(results)} runs to {path} (rev: {git_rev}, host: {host})")
+
+# --- 統計検定 (Welchのt検定) ---
+
+def _betacf(a, b, x):
+    """不完全ベータ関数の連分数展開 (Lentz法)"""
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+def _betainc(a, b, x):
+    """正則化不完全ベータ関数 I_x(a, b)"""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+    front = math.exp(lbeta + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+def welch_t_test(xs, ys):
+    """2標本の平均の差に対する両側p値を返す (標本数が足りなければ None)"""
+    n1, n2 = len(xs), len(ys)
+    if n1 < 2 or n2 < 2:
+        return None
+    m1, m2 = sum(xs) / n1, sum(ys) / n2
+    v1 = sum((x - m1) ** 2 for x in xs) / (n1 - 1)
+    v2 = sum((y - m2) ** 2 for y in ys) / (n2 - 1)
+    se2 = v1 / n1 + v2 / n2
+    if se2 == 0.0:
+        return 1.0 if m1 == m2 else 0.0
+    t = (m2 - m1) / math.sqrt(se2)
+    df = se2 ** 2 / ((v1 / n1) ** 2 / (n1 - 1) + (v2 / n2) ** 2 / (n2 - 1))
+    return _betainc(df / 2.0, 0.5, df / (df + t * t))
+
+# --- 比較 ---
+
+def load_samples(conn, git_rev, script=None, host=None):
+    """{(script, params, host, metric): [value, ...]} を返す"""
+    revs = [r for (r,) in conn.execute("SELECT DISTINCT git_rev FROM results") if same_rev(r, git_rev)]
+    if not revs:
+        return {}
+    sql = f"SELECT script, params, host, metric, value FROM results WHERE git_rev IN ({', '.join('?' * len(revs))})"
+    args = list(revs)
+    if script:
+        sql += " AND script = ?"
+        args.append(script)
+    if host:
+        sql += " AND host = ?"
+        args.append(host)
+    samples = {}
+    for s, p, h, metric, value in conn.execute(sql, args):
+        samples.setdefault((s, p, h, metric), []).append(value)
+    return samples
+
+def compare(conn, baseline, candidate, script=None, host=None,
+        alpha=ALPHA, min_change=MIN_CHANGE):
+    """ベースラインと比較した結果の一覧と、劣化と判定された件数を返す"""
+    base = load_samples(conn, baseline, script, host)
+    cand = load_samples(conn, candidate, script, host)
+    rows = []
+    n_regressions = 0
+    for key in sorted(set(base) & set(cand)):
+        metric = key[3]
+        direction = METRIC_DIRECTIONS.get(metric)
+        if direction is None:
+            continue
+        xs, ys = base[key], cand[key]
+        m1, m2 = sum(xs) / len(xs), sum(ys) / len(ys)
+        change = (m2 - m1) / abs(m1) if m1 else 0.0
+        p = welch_t_test(xs, ys)
+        significant = p is not None and p < alpha and abs(change) >= min_change
+        if not significant:
+            verdict = "-"
+        elif change * direction < 0:
+            verdict = "REGRESSION"
+            n_regressions += 1
+        else:
+            verdict = "improved"
+        rows.append((key, len(xs), m1, len(ys), m2, change, p, verdict))
+    return rows, n_regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark result history.")
+    parser.add_argument("--db", default=HISTORY_DB, help="History database file.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List recorded revisions.")
+    p = sub.add_parser("compare", help="Compare a revision against a baseline.")
+    p.add_argument("--baseline", required=True, help="Baseline git revision.")
+    p.add_argument("--candidate", default=None,
+        help="Candidate git revision (default: current working tree).")
+    p.add_argument("--script", default=None, help="Only compare results of this script.")
+    p.add_argument("--host", default=None, help="Only compare results of this host.")
+    p.add_argument("--alpha", type=float, default=ALPHA, help="Significance level.")
+    p.add_argument("--min-change", type=float, default=MIN_CHANGE,
+        help="Minimum relative change to be reported as a regression.")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    if args.command == "list":
+        for row in conn.execute(
+                "SELECT git_rev, host, script, COUNT(DISTINCT recorded_at || run_id), MAX(recorded_at)"
+                " FROM results GROUP BY git_rev, host, script ORDER BY MAX(recorded_at)"):
+            print("%-18s %-20s %-6s runs=%-4d last=%s" % ((short_rev(row[0]),) + row[1:]))
+        return 0
+
+    baseline = resolve_git_rev(args.baseline)
+    candidate = resolve_git_rev(args.candidate) if args.candidate else current_git_rev()
+    rows, n_regressions = compare(conn, baseline, candidate, args.script,
+        args.host, args.alpha, args.min_change)
+    if not rows:
+        print(f"No comparable results between {args.baseline} ({short_rev(baseline)})"
+            f" and {short_rev(candidate)}.")
+        return 0
+    print(f"baseline: {args.baseline} ({short_rev(baseline)})  candidate: {short_rev(candidate)}")
+    last = None
+    for key, n1, m1, n2, m2, change, p, verdict in rows:
+        if key[:3] != last:
+            last = key[:3]
+            print(f"\n[{key[0]}] host={key[2]} params={key[1]}")
+        p_s = "n/a" if p is None else "%.4f" % p
+        print("  %-22s %12.3f (n=%d) -> %12.3f (n=%d) %+8.2f%%  p=%-7s %s" % (
+            key[3], m1, n1, m2, n2, change * 100, p_s, verdict))
+    print(f"\n{n_regressions} significant regression(s).")
+    return 1 if n_regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
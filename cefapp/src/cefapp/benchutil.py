@@ -0,0 +1,70 @@
+# benchutil.py
+# c2.py / c3.py / p3.py などの性能評価スクリプトで共有する結果スキーマと補助関数
+import csv
+import time
+import threading
+import psutil
+
+# --- 結果スキーマ ---
+# コンシューマ側の評価結果 (c2.py / c3.py と同じ列)
+SUMMARY_FIELDS = [
+    'run_id',
+    'total_time_sec',
+    'total_bytes_expected',
+    'total_bytes_received',
+    'success_rate_percent',
+    'throughput_mbps',
+    'interests_sent',
+    'data_packets_received',
+    'timeouts',
+    'avg_chunk_rtt_ms',
+    'avg_cpu_percent',
+    'avg_mem_percent',
+]
+# プロデューサ側の評価結果で追加される列 (p3.py)
+PRODUCER_FIELDS = [
+    'target',
+    'interests_received',
+    'interests_dropped',
+    'data_packets_sent',
+    'total_bytes_sent',
+    'interests_per_sec',
+    'avg_service_time_us',
+    'p99_service_time_us',
+    'cpu_us_per_data',
+]
+ALL_FIELDS = SUMMARY_FIELDS + PRODUCER_FIELDS
+
+class ResourceMonitor(threading.Thread):
+    """CPUとメモリを監視するスレッド"""
+    def __init__(self):
+        super().__init__()
+        self.stop_event = threading.Event()
+        self.cpu_percents = []
+        self.mem_percents = []
+        self.daemon = True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.cpu_percents.append(psutil.cpu_percent())
+            self.mem_percents.append(psutil.virtual_memory().percent)
+            time.sleep(0.5)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_avg_stats(self):
+        avg_cpu = sum(self.cpu_percents) / len(self.cpu_percents) if self.cpu_percents else 0
+        avg_mem = sum(self.mem_percents) / len(self.mem_percents) if self.mem_percents else 0
+        return avg_cpu, avg_mem
+
+def write_summary_report(path, results):
+    """評価結果をスキーマ順の列でCSVに書き込む (結果に含まれない列は出力しない)"""
+    present = set()
+    for r in results:
+        present.update(r.keys())
+    fieldnames = [f for f in ALL_FIELDS if f in present]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+        writer.writeheader()
+        writer.writerows(results)
@@ -1,10 +1,9 @@
 # consumer.py
 import cefpyco
 import time
-import csv
 import math
-import threading
-import psutil
+from benchutil import ResourceMonitor, write_summary_report
+from benchhist import record_results
 
 # --- 設定 ---
 URI = "ccnx:/test/video"
@@ -14,29 +13,6 @@ PIPELINE_SIZE = 2000
 RECEIVE_TIMEOUT_MS = 1000  # 1秒
 REPORT_FILE = "cefpyco_raw_report.csv"
 
-class ResourceMonitor(threading.Thread):
-    """CPUとメモリを監視するスレッド"""
-    def __init__(self):
-        super().__init__()
-        self.stop_event = threading.Event()
-        self.cpu_percents = []
-        self.mem_percents = []
-        self.daemon = True
-
-    def run(self):
-        while not self.stop_event.is_set():
-            self.cpu_percents.append(psutil.cpu_percent())
-            self.mem_percents.append(psutil.virtual_memory().percent)
-            time.sleep(0.5)
-
-    def stop(self):
-        self.stop_event.set()
-
-    def get_avg_stats(self):
-        avg_cpu = sum(self.cpu_percents) / len(self.cpu_percents) if self.cpu_percents else 0
-        avg_mem = sum(self.mem_percents) / len(self.mem_percents) if self.mem_percents else 0
-        return avg_cpu, avg_mem
-
 def get_total_chunks(handle):
     """メタ情報を取得して総チャンク数を返す"""
     for _ in range(5): # 5回リトライ
@@ -167,10 +143,10 @@ def main():
     # --- CSVファイルへの書き込み ---
     print(f"\nWriting results to {REPORT_FILE}...")
     if all_results:
-        with open(REPORT_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=all_results[0].keys())
-            writer.writeheader()
-            writer.writerows(all_results)
+        write_summary_report(REPORT_FILE, all_results)
+        # 結果は上書きされるCSVとは別に履歴にも追記する
+        record_results("c2", {"uri": URI, "pipeline": PIPELINE_SIZE,
+            "receive_timeout_ms": RECEIVE_TIMEOUT_MS}, all_results)
         print("Test finished successfully.")
     else:
         print("No results to write.")
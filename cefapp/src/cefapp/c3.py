@@ -3,8 +3,8 @@ import cefpyco
 import time
 import csv
 import math
-import threading
-import psutil
+from benchutil import ResourceMonitor, write_summary_report
+from benchhist import record_results
 
 # --- 設定 ---
 URI = "ccnx:/test/video"
@@ -15,29 +15,6 @@ RECEIVE_TIMEOUT_MS = 1000  # 1秒
 SUMMARY_REPORT_FILE = "cefpyco_summary_report.csv"
 TIMESERIES_LOG_FILE = "cefpyco_timeseries_log.csv" # 時系列ログファイル名
 
-class ResourceMonitor(threading.Thread):
-    """CPUとメモリを監視するスレッド"""
-    def __init__(self):
-        super().__init__()
-        self.stop_event = threading.Event()
-        self.cpu_percents = []
-        self.mem_percents = []
-        self.daemon = True
-
-    def run(self):
-        while not self.stop_event.is_set():
-            self.cpu_percents.append(psutil.cpu_percent())
-            self.mem_percents.append(psutil.virtual_memory().percent)
-            time.sleep(0.5)
-
-    def stop(self):
-        self.stop_event.set()
-
-    def get_avg_stats(self):
-        avg_cpu = sum(self.cpu_percents) / len(self.cpu_percents) if self.cpu_percents else 0
-        avg_mem = sum(self.mem_percents) / len(self.mem_percents) if self.mem_percents else 0
-        return avg_cpu, avg_mem
-
 def get_total_chunks(handle):
     """メタ情報を取得して総チャンク数を返す"""
     for _ in range(5): # 5回リトライ
@@ -198,10 +175,10 @@ def main():
     # --- サマリーレポートCSVファイルへの書き込み ---
     print(f"\nWriting summary report to {SUMMARY_REPORT_FILE}...")
     if summary_results:
-        with open(SUMMARY_REPORT_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=summary_results[0].keys())
-            writer.writeheader()
-            writer.writerows(summary_results)
+        write_summary_report(SUMMARY_REPORT_FILE, summary_results)
+        # 結果は上書きされるCSVとは別に履歴にも追記する
+        record_results("c3", {"uri": URI, "pipeline": PIPELINE_SIZE,
+            "receive_timeout_ms": RECEIVE_TIMEOUT_MS}, summary_results)
     else:
         print("No summary results to write.")
         
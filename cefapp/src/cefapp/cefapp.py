@@ -44,12 +44,15 @@ class MetaInfoNotResolvedError(Exception):
     pass
 
 class CefApp(object):
-    def __init__(self, cef_handle, target_name, action_name, timeout_limit, enable_log):
+    def __init__(self, cef_handle, target_name, action_name, timeout_limit, enable_log,
+        profiler=None):
         self.cef_handle = cef_handle
         self.target_name = target_name
         self.action_name = action_name
         self.timeout_limit = timeout_limit
         self.enable_log = enable_log
+        self.profiler = profiler
+        if profiler is not None: profiler.instrument(self)
     
     def log(self, msg, force=False):
         if self.enable_log or force: stderr.write("[cefapp] %s\n" % msg)
@@ -134,11 +137,12 @@ class CefApp(object):
     
 class CefAppConsumer(CefApp):
     def __init__(self, cef_handle, 
-        pipeline=1000, timeout_limit=2, data_store=True, enable_log=True):
+        pipeline=1000, timeout_limit=2, data_store=True, enable_log=True,
+        profiler=None):
         self.pipeline = pipeline
         self.data_store = data_store
         super(CefAppConsumer, self).__init__(
-            cef_handle, "Data", "receive", timeout_limit, enable_log)
+            cef_handle, "Data", "receive", timeout_limit, enable_log, profiler)
     
     @property
     def data(self):
@@ -207,9 +211,10 @@ class CefAppConsumer(CefApp):
         
 class CefAppProducer(CefApp):
     def __init__(self, cef_handle, 
-        data="hello", cob_len=1024, timeout_limit=2, enable_log=True):
+        data="hello", cob_len=1024, timeout_limit=2, enable_log=True,
+        profiler=None):
         super(CefAppProducer, self).__init__(
-            cef_handle, "Interest", "send", timeout_limit, enable_log)
+            cef_handle, "Interest", "send", timeout_limit, enable_log, profiler)
         self.data = data
         self.cob_len = cob_len
         data_len = len(self.data)
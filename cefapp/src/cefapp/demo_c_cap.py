@@ -1,10 +1,9 @@
 # consumer.py
 import cefpyco
 import time
-import csv
-import threading
-import psutil
 from cefapp import CefAppConsumer
+from benchutil import ResourceMonitor, write_summary_report
+from benchhist import record_results
 
 # --- 設定 ---
 URI = "ccnx:/test/video"
@@ -47,29 +46,6 @@ class StatConsumer(CefAppConsumer):
         #  より厳密にはこちらもオーバーライドが必要)
         pass
 
-class ResourceMonitor(threading.Thread):
-    """CPUとメモリを監視するスレッド"""
-    def __init__(self):
-        super().__init__()
-        self.stop_event = threading.Event()
-        self.cpu_percents = []
-        self.mem_percents = []
-        self.daemon = True
-
-    def run(self):
-        while not self.stop_event.is_set():
-            self.cpu_percents.append(psutil.cpu_percent())
-            self.mem_percents.append(psutil.virtual_memory().percent)
-            time.sleep(0.5)
-
-    def stop(self):
-        self.stop_event.set()
-
-    def get_avg_stats(self):
-        avg_cpu = sum(self.cpu_percents) / len(self.cpu_percents) if self.cpu_percents else 0
-        avg_mem = sum(self.mem_percents) / len(self.mem_percents) if self.mem_percents else 0
-        return avg_cpu, avg_mem
-
 def main():
     """性能評価を実行し、結果をCSVに保存するメイン関数"""
     results = []
@@ -128,10 +104,9 @@ def main():
         print("No results to write.")
         return
         
-    with open(REPORT_FILE, 'w', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=results[0].keys())
-        writer.writeheader()
-        writer.writerows(results)
+    write_summary_report(REPORT_FILE, results)
+    # 結果は上書きされるCSVとは別に履歴にも追記する
+    record_results("demo_c_cap", {"uri": URI, "pipeline": PIPELINE_SIZE}, results)
     
     print("Test finished successfully.")
 
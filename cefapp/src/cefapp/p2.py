@@ -18,6 +18,25 @@ def create_dummy_file_if_not_exists():
             f.write(b'\x00' * FILE_SIZE_BYTES)
         print("Dummy file created.")
 
+def serve_packet(handle, packet, content_data, total_chunks, verbose=True):
+    """受信したInterestに対応するDataを返す (p3.py の評価対象でもある)"""
+    if packet.is_interest:
+        # 通常のデータチャンク要求
+        if packet.name == URI:
+            chunk_num = packet.chunk_num
+            if 0 <= chunk_num < total_chunks:
+                offset = chunk_num * CHUNK_SIZE
+                chunk = content_data[offset:offset + CHUNK_SIZE]
+                handle.send_data(URI, chunk, chunk_num, expiry=3600000, cache_time=3600000)
+                if verbose:
+                    print(f"Sent chunk #{chunk_num}")
+
+        # メタ情報（総チャンク数）の要求
+        elif packet.name == META_URI:
+            handle.send_data(META_URI, str(total_chunks), 0)
+            if verbose:
+                print(f"Sent meta info: {total_chunks} chunks")
+
 def main():
     """プロデューサを起動するメイン関数"""
     create_dummy_file_if_not_exists()
@@ -39,21 +58,7 @@ def main():
         while True:
             # Interestを待機
             packet = handle.receive()
-
-            if packet.is_interest:
-                # 通常のデータチャンク要求
-                if packet.name == URI:
-                    chunk_num = packet.chunk_num
-                    if 0 <= chunk_num < total_chunks:
-                        offset = chunk_num * CHUNK_SIZE
-                        chunk = content_data[offset:offset + CHUNK_SIZE]
-                        handle.send_data(URI, chunk, chunk_num, expiry=3600000, cache_time=3600000)
-                        print(f"Sent chunk #{chunk_num}")
-
-                # メタ情報（総チャンク数）の要求
-                elif packet.name == META_URI:
-                    handle.send_data(META_URI, str(total_chunks), 0)
-                    print(f"Sent meta info: {total_chunks} chunks")
+            serve_packet(handle, packet, content_data, total_chunks)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,182 @@
+# producer benchmark
+# プロデューサ側の性能評価: 合成Interestフラッドに対するサービス時間を測定する
+import time
+import random
+from cefapp import CefAppProducer
+from benchutil import ResourceMonitor, write_summary_report
+from benchhist import record_results
+import p2
+
+# --- 設定 ---
+URI = p2.URI
+META_URI = p2.META_URI
+CONTENT_SIZE_BYTES = 10 * 1024 * 1024  # 10MB (評価用コンテンツはメモリ上に生成)
+CHUNK_SIZE = p2.CHUNK_SIZE
+NUM_RUNS = 3  # 試行回数（可変）
+NUM_INTERESTS = 200000  # 1回の試行で投入するInterest数
+DUPLICATE_RATIO = 0.1  # 直近に要求済みのチャンクを再要求する割合
+OUT_OF_RANGE_RATIO = 0.05  # 存在しないチャンク番号を要求する割合
+TARGETS = ["cefapp", "p2"]  # 評価対象: CefAppProducer と p2.py のループ
+REPORT_FILE = "cefpyco_producer_report.csv"
+
+class FloodPacket(object):
+    """cefpycoの受信パケットのうち、プロデューサが参照する属性だけを持つ"""
+    __slots__ = ("is_succeeded", "is_interest", "name", "chunk_num")
+
+    def __init__(self, is_succeeded, name="", chunk_num=0):
+        self.is_succeeded = is_succeeded
+        self.is_interest = is_succeeded
+        self.name = name
+        self.chunk_num = chunk_num
+
+    @property
+    def is_failed(self):
+        return not self.is_succeeded
+
+class FloodHandle(object):
+    """合成Interestを返し、send_dataまでの時間を記録するハンドルの代替"""
+    def __init__(self, packets):
+        self.packets = packets
+        self.index = 0
+        self.failed = FloodPacket(False)
+        self.recv_time = None
+        self.service_times = []
+        self.data_sent = 0
+        self.bytes_sent = 0
+
+    def register(self, name):
+        pass
+
+    def receive(self, *args, **kwargs):
+        if self.index >= len(self.packets):
+            self.recv_time = None
+            return self.failed
+        packet = self.packets[self.index]
+        self.index += 1
+        self.recv_time = time.perf_counter()
+        return packet
+
+    def send_data(self, name, payload, chunk_num=0, **kwargs):
+        now = time.perf_counter()
+        if self.recv_time is not None:
+            # 1つのInterestに対する最初のDataまでをサービス時間とする
+            self.service_times.append(now - self.recv_time)
+            self.recv_time = None
+        self.data_sent += 1
+        self.bytes_sent += len(payload)
+
+def generate_flood(total_chunks, num_interests, seed):
+    """重複・範囲外のチャンク番号を含む合成Interest列を生成する"""
+    rng = random.Random(seed)
+    packets = []
+    next_chunk = 0
+    for _ in range(num_interests):
+        r = rng.random()
+        if r < OUT_OF_RANGE_RATIO:
+            chunk_num = total_chunks + rng.randrange(total_chunks)
+        elif r < OUT_OF_RANGE_RATIO + DUPLICATE_RATIO and next_chunk > 0:
+            chunk_num = rng.randrange(max(0, next_chunk - 1000), next_chunk)
+        else:
+            chunk_num = next_chunk % total_chunks
+            next_chunk += 1
+        packets.append(FloodPacket(True, URI, chunk_num))
+    return packets
+
+def run_cefapp(handle, content_data):
+    """CefAppProducer をフラッドが尽きるまで動かす"""
+    producer = CefAppProducer(handle, data=content_data, cob_len=CHUNK_SIZE,
+        timeout_limit=1, enable_log=False)
+    producer.run(URI)
+
+def run_p2(handle, content_data):
+    """p2.py と同じ処理をフラッドが尽きるまで動かす"""
+    total_chunks = (len(content_data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+    while True:
+        packet = handle.receive()
+        if packet.is_failed:
+            break
+        p2.serve_packet(handle, packet, content_data, total_chunks, verbose=False)
+
+def run_single_test(target, content_data, run_id):
+    """1回のフラッド評価を実行し、統計情報を返す"""
+    total_chunks = (len(content_data) + CHUNK_SIZE - 1) // CHUNK_SIZE
+    handle = FloodHandle(generate_flood(total_chunks, NUM_INTERESTS, seed=run_id))
+
+    cpu_start = time.process_time()
+    run_start_time = time.perf_counter()
+    if target == "cefapp":
+        run_cefapp(handle, content_data)
+    else:
+        run_p2(handle, content_data)
+    run_end_time = time.perf_counter()
+    cpu_time = time.process_time() - cpu_start
+
+    service_times = sorted(handle.service_times)
+    return {
+        "total_time_sec": run_end_time - run_start_time,
+        "cpu_time_sec": cpu_time,
+        "interests_received": handle.index,
+        "data_packets_sent": handle.data_sent,
+        "total_bytes_sent": handle.bytes_sent,
+        "service_times": service_times,
+    }
+
+def main():
+    """性能評価のメインループ"""
+    print(f"Creating a {CONTENT_SIZE_BYTES / 1024 / 1024:.0f}MB content on memory...")
+    content_data = bytes(CONTENT_SIZE_BYTES)
+    summary_results = []
+    run_id = 0
+
+    for target in TARGETS:
+        for i in range(NUM_RUNS):
+            run_id += 1
+            print(f"\n----- Starting Run #{i + 1}/{NUM_RUNS} ({target}) -----")
+
+            monitor = ResourceMonitor()
+            monitor.start()
+            run_stats = run_single_test(target, content_data, i + 1)
+            monitor.stop()
+            monitor.join()
+
+            total_time = run_stats["total_time_sec"]
+            service_times = run_stats["service_times"]
+            n_data = run_stats["data_packets_sent"]
+            throughput_mbps = (run_stats["total_bytes_sent"] * 8) / total_time / 1e6 if total_time > 0 else 0
+            avg_service_us = sum(service_times) / len(service_times) * 1e6 if service_times else 0
+            p99_service_us = service_times[int(len(service_times) * 0.99)] * 1e6 if service_times else 0
+            avg_cpu, avg_mem = monitor.get_avg_stats()
+
+            final_result = {
+                'run_id': run_id,
+                'target': target,
+                'total_time_sec': round(total_time, 3),
+                'throughput_mbps': round(throughput_mbps, 3),
+                'interests_received': run_stats["interests_received"],
+                'interests_dropped': run_stats["interests_received"] - len(service_times),
+                'data_packets_sent': n_data,
+                'total_bytes_sent': run_stats["total_bytes_sent"],
+                'interests_per_sec': round(run_stats["interests_received"] / total_time, 1) if total_time > 0 else 0,
+                'avg_service_time_us': round(avg_service_us, 3),
+                'p99_service_time_us': round(p99_service_us, 3),
+                'cpu_us_per_data': round(run_stats["cpu_time_sec"] / n_data * 1e6, 3) if n_data else 0,
+                'avg_cpu_percent': round(avg_cpu, 2),
+                'avg_mem_percent': round(avg_mem, 2),
+            }
+            summary_results.append(final_result)
+            print(f"Run #{i + 1} ({target}) Summary: {final_result}")
+
+    # --- サマリーレポートCSVファイルへの書き込み ---
+    print(f"\nWriting summary report to {REPORT_FILE}...")
+    if summary_results:
+        write_summary_report(REPORT_FILE, summary_results)
+        # 結果は上書きされるCSVとは別に履歴にも追記する (target はパラメータとして記録される)
+        record_results("p3", {"content_size": CONTENT_SIZE_BYTES, "chunk_size": CHUNK_SIZE,
+            "num_interests": NUM_INTERESTS, "duplicate_ratio": DUPLICATE_RATIO,
+            "out_of_range_ratio": OUT_OF_RANGE_RATIO}, summary_results)
+        print("Test finished successfully.")
+    else:
+        print("No summary results to write.")
+
+if __name__ == '__main__':
+    main()
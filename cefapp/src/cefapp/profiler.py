@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016--2023, National Institute of Information and Communications
+# Technology (NICT). All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the NICT nor the names of its contributors may be
+#    used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE NICT AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE NICT OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys
+import threading
+from time import perf_counter
+from collections import Counter
+
+# Calls on the cefpyco handle and logging are measured as I/O phases.
+# Handlers are measured exclusive of the I/O made inside them, so that their
+# time is the bookkeeping cost (NumPy flag scanning etc.) of CefApp itself.
+IO_PHASES = ("receive", "send_interest", "send_data", "register")
+HANDLER_PHASES = ("resolve_count", "on_start", "on_rcv_failed",
+    "on_rcv_succeeded", "on_rcv_meta",
+    "show_result_on_success", "show_result_on_failure")
+
+class _ProfiledHandle(object):
+    def __init__(self, handle, profiler):
+        self._handle = handle
+        self._profiler = profiler
+        for phase in IO_PHASES:
+            setattr(self, phase, profiler.wrap_io(phase, getattr(handle, phase)))
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+class CefAppProfiler(object):
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.attributed = 0.0
+        self.wall = 0.0
+
+    def instrument(self, app):
+        app.cef_handle = _ProfiledHandle(app.cef_handle, self)
+        app.log = self.wrap_io("log", app.log)
+        for phase in HANDLER_PHASES:
+            setattr(app, phase, self.wrap_handler(phase, getattr(app, phase)))
+        app.run = self.wrap_run(app.run)
+
+    def add(self, phase, elapsed):
+        self.totals[phase] = self.totals.get(phase, 0.0) + elapsed
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def wrap_io(self, phase, func):
+        def _wrapped(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - t0
+                self.attributed += elapsed
+                self.add(phase, elapsed)
+        return _wrapped
+
+    def wrap_handler(self, phase, func):
+        def _wrapped(*args, **kwargs):
+            a0 = self.attributed
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - t0
+                nested = self.attributed - a0
+                # The whole call is attributed now, so that an outer handler
+                # does not count it again as its own time.
+                self.attributed = a0 + elapsed
+                self.add(phase, elapsed - nested)
+        return _wrapped
+
+    def wrap_run(self, func):
+        def _wrapped(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.wall += perf_counter() - t0
+        return _wrapped
+
+    def report(self):
+        lines = ["%-24s %10s %10s %7s %10s" % (
+            "phase", "calls", "total[s]", "wall%", "avg[us]")]
+        wall = self.wall
+        accounted = 0.0
+        for phase in IO_PHASES + ("log",) + HANDLER_PHASES:
+            if phase not in self.counts: continue
+            total = self.totals[phase]
+            count = self.counts[phase]
+            accounted += total
+            lines.append("%-24s %10d %10.4f %7.2f %10.2f" % (
+                phase, count, total, 100.0 * total / wall if wall else 0.0,
+                1e6 * total / count))
+        other = max(wall - accounted, 0.0)
+        lines.append("%-24s %10s %10.4f %7.2f %10s" % (
+            "(loop/other)", "-", other, 100.0 * other / wall if wall else 0.0, "-"))
+        lines.append("%-24s %10s %10.4f" % ("(wall)", "-", wall))
+        return "\n".join(lines)
+
+class SamplingProfiler(object):
+    """Samples the stack of one thread at a fixed interval from a helper thread.
+
+    Unlike cProfile it does not slow down every function call, so it can be
+    used to profile full-speed transfers.
+    """
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.leaf = Counter()
+        self.inclusive = Counter()
+        self.n_samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None: self._thread.join()
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None: continue
+            self.n_samples += 1
+            self.leaf[self._key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                key = self._key(frame)
+                if key not in seen:
+                    seen.add(key)
+                    self.inclusive[key] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _key(frame):
+        code = frame.f_code
+        return "%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno)
+
+    def report(self, limit=20):
+        n = self.n_samples or 1
+        lines = ["%d samples (interval %.1f ms)" % (
+            self.n_samples, self.interval * 1000)]
+        for title, counter in (("self", self.leaf), ("inclusive", self.inclusive)):
+            lines.append("%8s %7s  function" % (title, "%"))
+            for key, count in counter.most_common(limit):
+                lines.append("%8d %7.2f  %s" % (count, 100.0 * count / n, key))
+        return "\n".join(lines)
+
+def run_profiled(func, mode="none", out=None, stream=sys.stderr):
+    """Runs ``func()`` under cProfile or the sampling profiler.
+
+    ``mode`` is one of "none", "cprofile" or "sample".
+    With "cprofile", raw stats are dumped to ``out`` if it is given.
+    """
+    if mode == "cprofile":
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(func)
+        finally:
+            if out: prof.dump_stats(out)
+            pstats.Stats(prof, stream=stream).sort_stats("cumulative").print_stats(20)
+    elif mode == "sample":
+        prof = SamplingProfiler()
+        prof.start()
+        try:
+            return func()
+        finally:
+            prof.stop()
+            stream.write(prof.report() + "\n")
+    return func()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016--2023, National Institute of Information and Communications
+# Technology (NICT). All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the NICT nor the names of its contributors may be
+#    used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE NICT AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE NICT OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Packet-level traces of consumer runs and their offline replay.
+#
+# Traces use the columns of the time-series log of c3.py, so that logs of
+# c3.py can be replayed as well as traces recorded by TraceRecorder.
+
+import csv
+import heapq
+import random
+from time import perf_counter
+from cefapp.cefapp import CefAppConsumer
+
+TRACE_FIELDS = ["run_id", "timestamp_sec", "event_type", "chunk_num",
+    "data_size_bytes", "rtt_ms"]
+INTEREST_SENT = "INTEREST_SENT"
+DATA_RECEIVED = "DATA_RECEIVED"
+TIMEOUT = "TIMEOUT"
+
+class TraceRecorder(object):
+    """Wraps a cefpyco handle and records the events of content ``name``."""
+    def __init__(self, handle, name, run_id=1):
+        self._handle = handle
+        self.name = name
+        self.run_id = run_id
+        self.events = []
+        self._send_times = {}
+        self._t0 = perf_counter()
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+    def _append(self, t, event_type, chunk_num=None, size=None, rtt_ms=None):
+        self.events.append({
+            "run_id": self.run_id,
+            "timestamp_sec": t - self._t0,
+            "event_type": event_type,
+            "chunk_num": chunk_num,
+            "data_size_bytes": size,
+            "rtt_ms": rtt_ms,
+        })
+
+    def send_interest(self, name, chunk_num=0, *args, **kwargs):
+        ret = self._handle.send_interest(name, chunk_num, *args, **kwargs)
+        if name == self.name:
+            t = perf_counter()
+            self._send_times[chunk_num] = t
+            self._append(t, INTEREST_SENT, chunk_num)
+        return ret
+
+    def receive(self, *args, **kwargs):
+        packet = self._handle.receive(*args, **kwargs)
+        t = perf_counter()
+        if packet.is_failed:
+            self._append(t, TIMEOUT)
+        elif packet.name == self.name:
+            c = packet.chunk_num
+            sent = self._send_times.pop(c, None)
+            rtt_ms = round((t - sent) * 1000, 3) if sent is not None else None
+            self._append(t, DATA_RECEIVED, c, len(packet.payload), rtt_ms)
+        return packet
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=TRACE_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.events)
+
+def load_trace(path, run_id=None):
+    """Reads the events of one run in a trace (or a c3.py time-series log).
+
+    If ``run_id`` is None, the first run in the file is read.
+    """
+    events = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if run_id is None: run_id = int(row["run_id"])
+            if int(row["run_id"]) != run_id: continue
+            events.append({
+                "run_id": int(row["run_id"]),
+                "timestamp_sec": float(row["timestamp_sec"]),
+                "event_type": row["event_type"],
+                "chunk_num": int(row["chunk_num"]) if row["chunk_num"] else None,
+                "data_size_bytes": int(row["data_size_bytes"]) if row["data_size_bytes"] else None,
+                "rtt_ms": float(row["rtt_ms"]) if row["rtt_ms"] else None,
+            })
+    return events
+
+class TraceModel(object):
+    """Network behavior observed in a trace.
+
+    For each chunk the outcome of every transmission is kept in order: the RTT
+    in seconds, or None if the Interest was not answered before it was sent
+    again (or before the end of the trace). Transmissions that did not occur in
+    the trace are drawn from the empirical RTT distribution and loss rate.
+    """
+    def __init__(self, events):
+        self.attempts = {}
+        self.sizes = {}
+        pending = {}
+        for e in sorted(events, key=lambda e: e["timestamp_sec"]):
+            c = e["chunk_num"]
+            if e["event_type"] == INTEREST_SENT:
+                if c in pending:
+                    self.attempts.setdefault(c, []).append(None)
+                pending[c] = e["timestamp_sec"]
+            elif e["event_type"] == DATA_RECEIVED:
+                sent = pending.pop(c, None)
+                rtt = e["rtt_ms"] / 1000.0 if e["rtt_ms"] is not None else None
+                if rtt is None and sent is not None:
+                    rtt = e["timestamp_sec"] - sent
+                if rtt is not None:
+                    self.attempts.setdefault(c, []).append(rtt)
+                if e["data_size_bytes"] is not None:
+                    self.sizes[c] = e["data_size_bytes"]
+        for c in pending:
+            self.attempts.setdefault(c, []).append(None)
+        outcomes = [o for a in self.attempts.values() for o in a]
+        self.rtts = sorted(o for o in outcomes if o is not None)
+        self.loss_rate = (len(outcomes) - len(self.rtts)) / len(outcomes) if outcomes else 0.0
+        self.count = max(self.attempts) + 1 if self.attempts else 0
+        self.mean_size = (sum(self.sizes.values()) / len(self.sizes)) if self.sizes else 1024
+
+    @classmethod
+    def from_file(cls, path, run_id=None):
+        return cls(load_trace(path, run_id))
+
+    def outcome(self, chunk_num, attempt, rng):
+        a = self.attempts.get(chunk_num)
+        if a is not None and attempt < len(a):
+            return a[attempt]
+        if not self.rtts or rng.random() < self.loss_rate:
+            return None
+        return self.rtts[rng.randrange(len(self.rtts))]
+
+class _ReplayPacket(object):
+    __slots__ = ("is_failed", "name", "chunk_num", "payload_len")
+    is_interest_return = False
+
+    def __init__(self, is_failed, name="", chunk_num=0, payload_len=0):
+        self.is_failed = is_failed
+        self.name = name
+        self.chunk_num = chunk_num
+        self.payload_len = payload_len
+
+    @property
+    def payload(self):
+        return b"\0" * self.payload_len
+
+    @property
+    def payload_s(self):
+        return "\0" * self.payload_len
+
+class ReplayHandle(object):
+    """A cefpyco handle that plays back a TraceModel on a virtual clock.
+
+    ``receive_timeout`` is the time (in seconds) one failed receive() takes.
+    """
+    def __init__(self, model, name, receive_timeout=4.0, seed=0):
+        self.model = model
+        self.name = name
+        self.receive_timeout = receive_timeout
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.interests_sent = 0
+        self.timeouts = 0
+        self.bytes_received = 0
+        self.duplicates = 0
+        self.received = set()
+        self._sent = {}
+        self._arrivals = []
+        self._seq = 0
+        self._failed = _ReplayPacket(True)
+
+    def register(self, name):
+        pass
+
+    def send_interest(self, name, chunk_num=0, *args, **kwargs):
+        if name != self.name: return
+        self.interests_sent += 1
+        attempt = self._sent.get(chunk_num, 0)
+        self._sent[chunk_num] = attempt + 1
+        rtt = self.model.outcome(chunk_num, attempt, self.rng)
+        if rtt is None: return
+        self._seq += 1
+        heapq.heappush(self._arrivals, (self.now + rtt, self._seq, chunk_num))
+
+    def receive(self, *args, **kwargs):
+        if self._arrivals and self._arrivals[0][0] <= self.now + self.receive_timeout:
+            t, _, c = heapq.heappop(self._arrivals)
+            self.now = max(self.now, t)
+            size = self.model.sizes.get(c, self.model.mean_size)
+            if c in self.received:
+                self.duplicates += 1
+            else:
+                self.received.add(c)
+                self.bytes_received += size
+            return _ReplayPacket(False, self.name, c, size)
+        self.now += self.receive_timeout
+        self.timeouts += 1
+        return self._failed
+
+def replay(model, pipeline, timeout_limit=2, receive_timeout=4.0, count=None,
+    seed=0, name="ccnx:/replay"):
+    """Runs CefAppConsumer against ``model`` and returns the virtual result."""
+    count = count or model.count
+    handle = ReplayHandle(model, name, receive_timeout, seed)
+    app = CefAppConsumer(handle, pipeline=pipeline, timeout_limit=timeout_limit,
+        data_store=False, enable_log=False)
+    app.run(name, count)
+    return {
+        "pipeline": pipeline,
+        "timeout_limit": timeout_limit,
+        "receive_timeout_sec": receive_timeout,
+        "total_time_sec": handle.now,
+        "interests_sent": handle.interests_sent,
+        "timeouts": handle.timeouts,
+        "duplicates": handle.duplicates,
+        "chunks_received": len(handle.received),
+        "chunks_expected": count,
+        "bytes_received": handle.bytes_received,
+        "throughput_mbps": handle.bytes_received * 8 / handle.now / 1e6 if handle.now > 0 else 0.0,
+    }
+
+def sweep(model, pipelines, timeout_limits=(2,), receive_timeouts=(4.0,), seed=0):
+    """Replays every combination of the parameters (fastest first)."""
+    results = []
+    for p in pipelines:
+        for tl in timeout_limits:
+            for rt in receive_timeouts:
+                results.append(replay(model, p, tl, rt, seed=seed))
+    results.sort(key=lambda r: (-r["chunks_received"], r["total_time_sec"]))
+    return results
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016--2023, National Institute of Information and Communications
+# Technology (NICT). All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+# 3. Neither the name of the NICT nor the names of its contributors may be
+#    used to endorse or promote products derived from this software
+#    without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE NICT AND CONTRIBUTORS "AS IS" AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE NICT OR CONTRIBUTORS BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+# Micro-benchmarks of the chunk bookkeeping in CefAppConsumer.
+#
+# Usage: python test/bench_cefapp.py [--sizes 1000,100000,10000000]
+#
+# Each function is timed (best of --repeat runs) and run once more under
+# tracemalloc to report its peak allocation. If the time or allocation per
+# chunk grows by more than --max-growth between two consecutive sizes, the
+# function is reported as scaling badly and the exit status is 1.
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+import mock
+import numpy as np
+from cefapp import CefAppConsumer
+from cefapp.cefapp import CefAppRunningInfo
+
+NAME = "ccnx:/bench"
+
+
+def _discard(*args, **kwargs):
+    pass
+
+
+def create_null_handle():
+    # Calls recorded by MagicMock would dominate time and memory at 10M chunks.
+    m = mock.MagicMock()
+    m.send_interest = _discard
+    m.receive = _discard
+    return m
+
+
+def create_app(n, pipeline=1000):
+    app = CefAppConsumer(create_null_handle(), pipeline=pipeline,
+        data_store=False, enable_log=False)
+    info = CefAppRunningInfo(NAME, n)
+    app.req_flag = np.zeros(n)
+    app.rcv_tail_index = 0
+    app.req_tail_index = 0
+    return app, info
+
+
+def setup_send_next_interest(n):
+    # Worst case: every chunk but the last one is finished, so both tail
+    # indices scan the whole flag array.
+    app, info = create_app(n)
+    info.finished_flag[:-1] = 1
+    info.n_finished = n - 1
+    return lambda: app.send_next_interest(info)
+
+
+def setup_show_result_on_failure(n):
+    # Worst case: every other chunk is missing, so every chunk adds to the
+    # result string.
+    app, info = create_app(n)
+    info.finished_flag[::2] = 1
+    return lambda: app.show_result_on_failure(info)
+
+
+def setup_reset_req_status(n):
+    app, info = create_app(n)
+    info.finished_flag[: n // 2] = 1
+    return lambda: app.reset_req_status(info)
+
+
+def setup_send_interests_with_pipeline(n):
+    app, info = create_app(n)
+    return lambda: app.send_interests_with_pipeline(info)
+
+
+BENCHMARKS = [
+    ("send_next_interest", setup_send_next_interest),
+    ("show_result_on_failure", setup_show_result_on_failure),
+    ("reset_req_status", setup_reset_req_status),
+    ("send_interests_with_pipeline", setup_send_interests_with_pipeline),
+]
+
+
+def measure(setup, n, repeat):
+    best = None
+    for _ in range(repeat):
+        func = setup(n)
+        t0 = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    func = setup(n)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks of the chunk bookkeeping in CefAppConsumer.")
+    parser.add_argument("--sizes", default="1000,100000,10000000",
+        help="Comma-separated numbers of chunks.")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Number of timed runs per size (the best one is reported).")
+    parser.add_argument("--only", default="",
+        help="Comma-separated names of functions to benchmark.")
+    parser.add_argument("--max-growth", type=float, default=4.0,
+        help="Allowed growth of time or allocation per chunk between sizes.")
+    args = parser.parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",")]
+    only = set(filter(None, args.only.split(",")))
+
+    print("%-30s %10s %12s %12s %14s %12s" % (
+        "function", "chunks", "time[s]", "ns/chunk", "peak[bytes]", "B/chunk"))
+    bad = []
+    for name, setup in BENCHMARKS:
+        if only and name not in only: continue
+        prev = None
+        for n in sizes:
+            elapsed, peak = measure(setup, n, args.repeat)
+            per_chunk = (elapsed * 1e9 / n, peak / n)
+            print("%-30s %10d %12.6f %12.2f %14d %12.2f" % (
+                name, n, elapsed, per_chunk[0], peak, per_chunk[1]))
+            if prev is not None:
+                for label, cur, old, floor in zip(
+                        ("time", "allocation"), per_chunk, prev, (1.0, 1.0)):
+                    # Values below the floor (ns or bytes per chunk) are noise
+                    # of the fixed per-call cost.
+                    if cur > floor and cur > old * args.max_growth:
+                        growth = "%.1fx" % (cur / old) if old else "from 0"
+                        bad.append("%s: %s per chunk grew %s at %d chunks" % (
+                            name, label, growth, n))
+            prev = per_chunk
+    for msg in bad:
+        print("SCALING: %s" % msg)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
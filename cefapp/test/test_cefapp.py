@@ -248,3 +248,47 @@ def test_running_consumer_random_order_on_error():
     assert c[0][0][1] == "2"
     assert c[1][0][1] == "hello"
     assert c[2][0][1] == "world"
+
+
+def test_profiling_consumer():
+    m = create_data_mock("ccnx:/test", ["hello", None, "world"])
+    prof = CefAppProfiler()
+    app = CefAppConsumer(m, profiler=prof)
+    app.run("ccnx:/test", 2)
+    assert app.data == "helloworld"
+    assert prof.counts["receive"] == 3
+    assert prof.counts["on_rcv_succeeded"] == 2
+    assert prof.counts["on_rcv_failed"] == 1
+    assert prof.counts["send_interest"] == len(m.send_interest.call_args_list)
+    assert prof.wall >= sum(prof.totals.values())
+    assert "on_rcv_succeeded" in prof.report()
+
+
+def test_profiling_producer():
+    m = create_interest_mock("ccnx:/test", [0, 1])
+    prof = CefAppProfiler()
+    app = CefAppProducer(m, data="helloworld", cob_len=5, profiler=prof)
+    app.run("ccnx:/test")
+    assert len(m.register.call_args_list) == 1
+    assert len(m.send_data.call_args_list) == 2
+    assert prof.counts["send_data"] == 2
+    assert prof.counts["register"] == 1
+
+
+def test_recording_and_replaying_trace(tmp_path):
+    m = create_data_mock("ccnx:/test", ["hello", None, "world", "!!!!!"])
+    rec = TraceRecorder(m, "ccnx:/test")
+    app = CefAppConsumer(rec, pipeline=1)
+    app.run("ccnx:/test", 3)
+    assert app.data == "helloworld!!!!!"
+    path = str(tmp_path / "trace.csv")
+    rec.write_csv(path)
+    model = TraceModel.from_file(path)
+    assert model.count == 3
+    assert model.sizes[1] == 5
+    for pipeline in (1, 3):
+        h = ReplayHandle(model, "ccnx:/replay", receive_timeout=1.0)
+        app = CefAppConsumer(h, pipeline=pipeline, data_store=False)
+        app.run("ccnx:/replay", 3)
+        assert h.received == {0, 1, 2}
+        assert h.bytes_received == 15
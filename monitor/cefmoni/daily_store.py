@@ -2,12 +2,18 @@ import asyncio
 import cefpyco
 import time
 import os
-import csv
 import datetime
 import logging
-from collections import deque
 import json
-import shutil # ディレクトリ削除用
+from record_writer import RecordWriter, delete_old_records, get_current_filename_prefix
+from receiver import PacketReceiver
+from interest_table import InterestTable
+from tsstore import TimeSeriesStore
+from rollup import Compactor
+from streamstats import LatencyStats, RateCounter
+from livestats import LiveStatsWriter
+from metrics_http import MetricsServer
+from prefix_trie import PrefixTrie
 
 # --- ロギング設定 ---
 logging.basicConfig(level=logging.INFO,
@@ -22,8 +28,33 @@ MONITOR_URI_PREFIX = "/your/content/name"  # 監視対象のコンテンツURI
 FACE_ID = 0  # CefpycoのFace ID (通常0でよい)
 UPDATE_INTERVAL_SEC = 1  # now_stat.csv を更新する間隔 (秒)
 RECORD_INTERVAL_HOURS = 1 # 監視記録ファイルを切り替える間隔 (時間)
-DATA_RETENTION_DAYS = 3 # 過去データを保持する日数
+DATA_RETENTION_DAYS = 3 # 生データ (CSVと毎秒・コンテンツごとの記録) を保持する日数
+ROLLUP_1M_RETENTION_DAYS = 28 # 1分ごとの集計を保持する日数
+ROLLUP_1H_RETENTION_DAYS = 365 # 1時間ごとの集計を保持する日数
+ROLLUP_INTERVAL_SEC = 60 # 集計と古いデータの削除を行う間隔 (秒)
 MONITORING_DIR = "./monitoring" # 監視記録を保存するルートディレクトリ
+NOW_STAT_FILE = "./now_stat.csv" # 現在の統計を書き出すファイル
+WRITE_NOW_STAT_CSV = True # now_stat.csv も書き出すか (共有メモリだけで十分なら False)
+LIVE_STATS_FILE = "/dev/shm/cefmoni_live_stats" if os.path.isdir("/dev/shm") else "./live_stats.mmap" # 現在の統計を公開する共有メモリ領域 (livestats.py で読み取る)
+LIVE_STATS_INTERVAL_SEC = 0.1 # 共有メモリ領域を更新する間隔 (秒)
+METRICS_HTTP_PORT = None # 統計を返すHTTPエンドポイント (/metrics, /stats.json) のポート (None: 無効)
+METRICS_HTTP_HOST = "127.0.0.1" # HTTPエンドポイントのアドレス
+METRICS_REFRESH_SEC = 1 # HTTPエンドポイントのレスポンスを作り直す間隔 (秒)
+TS_STORE_DIR = "./monitoring_ts" # 毎秒・コンテンツごとの統計を保存するバイナリ時系列ストア (tsstore.py で検索・CSV出力)
+RECORD_FLUSH_BYTES = 64 * 1024 # 記録ファイルへの書き出しをまとめるバッファサイズ (bytes)
+RECORD_FLUSH_INTERVAL_SEC = 5 # バッファが溜まらなくても書き出す間隔 (秒)
+RECORD_FSYNC_POLICY = "rotate" # fsyncの方針: "none", "rotate" (ファイル切替時), "always" (書き出しごと)
+RECEIVE_BATCH_SIZE = 256 # 受信スレッドがまとめてイベントループに渡すパケット数の上限
+RECEIVE_BATCH_INTERVAL_SEC = 0.01 # 受信したパケットをイベントループに渡すまでの最大待ち時間 (秒)
+RECEIVE_TIMEOUT_MS = 100 # 受信スレッドの1回の receive() のタイムアウト (ミリ秒)
+RECEIVE_QUEUE_MAX_BATCHES = 1024 # イベントループ側で処理待ちにできるバッチ数 (超えた分は破棄)
+INTEREST_LIFETIME_MS = 4000 # 送信するInterestのlifetime (これを過ぎても応答が無ければタイムアウトとみなす)
+INTEREST_TABLE_CAPACITY = 65536 # 応答待ちとして追跡するInterestの最大数
+RATE_WINDOW_SEC = 1 # 受信レート (bps, pps) を求める窓の長さ (秒)
+LATENCY_EWMA_ALPHA = 0.1 # avg_latency_ms の指数加重移動平均の係数
+PREFIX_TRIE_MAX_DEPTH = 4 # 名前の階層ごとの集計で扱う最大の深さ (これより深い名前はこの階層に集計)
+PREFIX_TRIE_MAX_NODES = 10000 # 名前の階層ごとの集計で保持する最大ノード数
+PREFIX_TRIE_TOP_K = 100 # ノード数が上限を超えたときに各階層で残す子ノード数 (通信量の多い順)
 
 # --- グローバル変数 (統計情報) ---
 # 現在の統計
@@ -35,51 +66,42 @@ current_stats = {
     "data_received_bytes": 0,
     "data_receive_rate_bps": 0, # bits per second
     "data_receive_rate_pps": 0, # packets per second
-    "avg_latency_ms": 0, # 平均遅延 (ミリ秒)
-    "jitter_ms": 0,      # ジッター (ミリ秒)
-    "bandwidth_usage_percent": 0 # 帯域使用率 (%)
+    "avg_latency_ms": 0, # 平均遅延 (ミリ秒, 指数加重移動平均)
+    "p50_latency_ms": 0, # 遅延の中央値 (ミリ秒, 推定値)
+    "p99_latency_ms": 0, # 遅延の99パーセンタイル (ミリ秒, 推定値)
+    "jitter_ms": 0,      # ジッター (ミリ秒, RFC 3550)
+    "bandwidth_usage_percent": 0, # 帯域使用率 (%)
+    "interest_timeout_count": 0 # lifetime内に応答の無かったInterest数
 }
 
 # 監視対象コンテンツごとの統計（コンテンツ完了時などに記録）
 content_stats = {} # key: content_name (Interest URI), value: dict of stats
 
-# 遅延計算のためのInterest送信時刻記録
-interest_timestamps = {} # key: Interest nonce, value: send_time
+# 名前の階層ごとの統計 (1時間ごとに <HH>_prefixes.csv に記録してリセット)
+prefix_trie = PrefixTrie(max_depth=PREFIX_TRIE_MAX_DEPTH, max_nodes=PREFIX_TRIE_MAX_NODES,
+                         top_k=PREFIX_TRIE_TOP_K)
 
-# ジッター計算のためのData受信時刻記録
-# 連続するデータパケットのタイムスタンプを保持
-data_reception_times = deque(maxlen=100) # 最近100個のデータパケット受信時刻を保持
+# 遅延計算のためのInterest送信時刻記録 (key: (name, chunk), value: send_time)
+interest_table = InterestTable(capacity=INTEREST_TABLE_CAPACITY,
+                               lifetime_sec=INTEREST_LIFETIME_MS / 1000)
+
+# 遅延・ジッターと受信レートのストリーミング統計 (current_stats の元になる)
+latency_stats = LatencyStats(ewma_alpha=LATENCY_EWMA_ALPHA)
+data_rate = RateCounter(window_sec=RATE_WINDOW_SEC)
 
 # 帯域幅計算用
-last_data_bytes = 0
-last_data_time = time.time()
 network_interface_bandwidth_mbps = 1000 # ネットワークインターフェースの理論帯域幅 (Mbps) - 環境に合わせて変更
 
-# --- 補助関数 ---
+# 現在の統計を公開する共有メモリ領域 (main() で作成)
+live_stats = None
 
-def get_current_filename_prefix(base_dir=MONITORING_DIR):
-    """現在の時刻に基づいてファイル名のプレフィックスを生成します。"""
-    now = datetime.datetime.now()
-    date_str = now.strftime("%Y-%m-%d")
-    hour_str = now.strftime("%H")
-    
-    dir_path = os.path.join(base_dir, date_str)
-    os.makedirs(dir_path, exist_ok=True)
-    
-    return os.path.join(dir_path, f"{hour_str}")
+# 監視記録の書き込みスレッド (main() で起動)
+record_writer = None
 
-def write_csv_header(filepath, stats_dict):
-    """CSVファイルのヘッダーを書き込みます。"""
-    if not os.path.exists(filepath):
-        with open(filepath, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(stats_dict.keys())
+# バイナリ時系列ストア (main() で作成し、書き込みスレッドからだけ使う)
+ts_store = None
 
-def append_to_csv(filepath, stats_dict):
-    """CSVファイルに1行データを追記します。"""
-    with open(filepath, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(stats_dict.values())
+# --- 補助関数 ---
 
 def get_data_packet_name_prefix(name):
     """
@@ -105,59 +127,77 @@ def get_data_packet_name_prefix(name):
 
 # --- 統計計算ロジック ---
 
+def refresh_current_stats(now):
+    """ストリーミング統計から current_stats のレートと遅延の項目を更新します。"""
+    # 帯域幅の計算 (直近 RATE_WINDOW_SEC 秒間の bits/sec)
+    data_rate_pps, data_rate_Bps = data_rate.rates(now)
+    data_rate_bps = data_rate_Bps * 8
+
+    # 帯域使用率の計算 (%)
+    # 理論帯域幅 (bps) に変換
+    network_bandwidth_bps = network_interface_bandwidth_mbps * 1_000_000
+    bandwidth_usage = (data_rate_bps / network_bandwidth_bps) * 100 if network_bandwidth_bps > 0 else 0
+
+    current_stats["data_receive_rate_bps"] = data_rate_bps
+    current_stats["data_receive_rate_pps"] = data_rate_pps
+    current_stats["bandwidth_usage_percent"] = min(bandwidth_usage, 100.0) # 100%を超えないように
+
+    # 遅延とジッター (ms)
+    current_stats["avg_latency_ms"] = latency_stats.ewma.value
+    current_stats["p50_latency_ms"] = latency_stats.p50.value
+    current_stats["p99_latency_ms"] = latency_stats.p99.value
+    current_stats["jitter_ms"] = latency_stats.jitter.value
+
 async def update_realtime_stats():
     """
-    現在の統計情報を定期的に更新し、now_stat.csv に保存します。
+    現在の統計情報を定期的に更新し、時系列ストア (と now_stat.csv) に保存します。
     """
-    global current_stats, last_data_bytes, last_data_time
+    global current_stats
 
     while True:
         await asyncio.sleep(UPDATE_INTERVAL_SEC)
 
         now = time.time()
-        
-        # 帯域幅の計算 (bits/sec)
-        time_diff = now - last_data_time
-        if time_diff > 0:
-            data_rate_bps = (current_stats["data_received_bytes"] * 8) / time_diff
-            data_rate_pps = current_stats["data_received_count"] / time_diff
-            
-            # 帯域使用率の計算 (%)
-            # 理論帯域幅 (bps) に変換
-            network_bandwidth_bps = network_interface_bandwidth_mbps * 1_000_000
-            bandwidth_usage = (data_rate_bps / network_bandwidth_bps) * 100 if network_bandwidth_bps > 0 else 0
-
-            current_stats["data_receive_rate_bps"] = data_rate_bps
-            current_stats["data_receive_rate_pps"] = data_rate_pps
-            current_stats["bandwidth_usage_percent"] = min(bandwidth_usage, 100.0) # 100%を超えないように
-        
-        # ジッターの計算 (ms)
-        if len(data_reception_times) >= 2:
-            intervals = np.diff(list(data_reception_times)) * 1000 # ミリ秒に変換
-            current_stats["jitter_ms"] = np.std(intervals) if len(intervals) > 0 else 0
-        else:
-            current_stats["jitter_ms"] = 0
-
-        # now_stat.csv へ保存
+
+        # lifetimeを過ぎても応答の無いInterestをタイムアウトとして数える
+        interest_table.expire(now)
+        current_stats["interest_timeout_count"] = interest_table.timeouts
+        refresh_current_stats(now)
+
         current_stats["timestamp"] = datetime.datetime.now().isoformat()
-        now_stat_filepath = "./now_stat.csv"
-        
-        try:
-            write_csv_header(now_stat_filepath, current_stats)
-            with open(now_stat_filepath, 'w', newline='') as f: # 常に上書き
-                writer = csv.writer(f)
-                writer.writerow(current_stats.keys())
-                writer.writerow(current_stats.values())
-            logger.debug(f"now_stat.csv updated: {json.dumps(current_stats)}")
-        except Exception as e:
-            logger.error(f"Failed to write now_stat.csv: {e}")
-
-        # 次の期間の計算のためにリセット (差分計算用)
-        last_data_bytes = current_stats["data_received_bytes"]
-        last_data_time = now
-        
+        if WRITE_NOW_STAT_CSV:
+            # now_stat.csv へ保存 (書き込みスレッドがアトミックに置き換える)
+            record_writer.publish_snapshot(NOW_STAT_FILE, current_stats)
+        record_writer.call(ts_store.append, "second", now, dict(current_stats))
+        logger.debug(f"Current stats updated: {json.dumps(current_stats)}")
+
         # 各種カウンターはゼロリセットしない (累積値を表示するため)。
-        # 帯域幅やPPSは、あくまで直近1秒間のレートとして算出される。
+        # 帯域幅やPPSは、あくまで直近 RATE_WINDOW_SEC 秒間のレートとして算出される。
+
+async def publish_live_stats():
+    """
+    current_stats を LIVE_STATS_INTERVAL_SEC ごとに共有メモリ領域へ公開します。
+    書き込みはメモリへのコピーだけなので、イベントループ上で直接行います。
+    """
+    while True:
+        await asyncio.sleep(LIVE_STATS_INTERVAL_SEC)
+        now = time.time()
+        refresh_current_stats(now)
+        live_stats.publish(current_stats, now)
+
+def collect_metrics():
+    """HTTPエンドポイント用に、current_stats とプレフィックスごとの統計を返します。"""
+    refresh_current_stats(time.time())
+    per_prefix = {}
+    for uri_prefix, stats in content_stats.items():
+        latency = stats["latency"]
+        record = {k: v for k, v in stats.items() if k not in ("end_time", "latency")}
+        record["avg_latency_ms"] = latency.mean
+        record["p50_latency_ms"] = latency.p50.value
+        record["p99_latency_ms"] = latency.p99.value
+        record["jitter_ms"] = latency.jitter.value
+        per_prefix[uri_prefix] = record
+    return dict(current_stats), per_prefix
 
 def reset_per_content_stats(uri_prefix):
     """新しいコンテンツの統計情報を初期化します。"""
@@ -170,96 +210,97 @@ def reset_per_content_stats(uri_prefix):
         "total_data_received_bytes": 0,
         "content_delivery_time_ms": 0, # コンテンツ全体の遅延
         "avg_data_rate_bps": 0,
-        "avg_latency_ms": 0,
-        "jitter_ms": 0,
-        "data_segment_latencies": [], # 各データセグメントの遅延リスト
-        "data_reception_times": deque(maxlen=1000) # このコンテンツのための受信時刻
+        "latency": LatencyStats(ewma_alpha=LATENCY_EWMA_ALPHA) # 各データセグメントの遅延の統計
     }
     logger.info(f"Initialized stats for new content: {uri_prefix}")
 
 
 # --- Cefpyco イベントハンドラ ---
 
+def process_packet(info, reception_time):
+    """受信した1パケットで統計を更新します。"""
+    global current_stats, content_stats
+
+    if info.is_interest:
+        # ここでは自身がInterestを送信する側の統計を監視するため、
+        # 受信したInterestは通常無視するか、特別なロジックで処理する。
+        # コンテンツ提供者として動作する場合にのみ意味がある。
+        pass # 例: logger.debug(f"Received Interest: {info.name}")
+
+    elif info.is_data:
+        data_name = info.name
+        data_payload_size = info.payload_len
+
+        logger.debug(f"Received Data: Name={data_name}, Size={data_payload_size} bytes")
+
+        # グローバル統計の更新
+        current_stats["data_received_count"] += 1
+        current_stats["data_received_bytes"] += data_payload_size
+        data_rate.add(reception_time, data_payload_size)
+        content_prefix = get_data_packet_name_prefix(data_name)
+
+        # Interest送信時刻との差分で遅延を計算
+        latency = None
+        interest_send_time = interest_table.match(info.name, info.chunk_num)
+        if interest_send_time is not None:
+            latency = (reception_time - interest_send_time) * 1000 # ミリ秒
+            latency_stats.update(latency)
+
+            # コンテンツごとの統計を更新
+            if content_prefix and content_prefix in content_stats:
+                content_stats[content_prefix]["latency"].update(latency)
+                content_stats[content_prefix]["total_data_received_count"] += 1
+                content_stats[content_prefix]["total_data_received_bytes"] += data_payload_size
+
+        # 名前の階層ごとの統計を更新
+        if content_prefix:
+            prefix_trie.record_data(content_prefix, data_payload_size, latency)
+
+    elif info.is_nack:
+        logger.warning(f"Received NACK for Interest (Nonce: {info.nonce})")
+        # 追跡中のInterestから該当Interestを削除
+        interest_table.remove(info.name, info.chunk_num)
+        content_prefix = get_data_packet_name_prefix(info.name)
+        if content_prefix:
+            prefix_trie.record_nack(content_prefix)
+        
+    elif info.is_cs_miss:
+        logger.info(f"CS_MISS for Interest (Nonce: {info.nonce})")
+        # CS_MISSもNACKと同様に処理することが多い
+        interest_table.remove(info.name, info.chunk_num)
+
 async def handle_cefpyco_events(loop):
     """
     Cefpycoのイベントを処理するコルーチン。
     Interest送信、Data受信、NACK/CS_MISSなど。
-    """
-    global current_stats, content_stats, interest_timestamps, data_reception_times
-
-    with cefpyco.CefpycoHandle() as handle:
-        handle.set_log_level(3) # Cefpycoのログレベルを設定 (0:None, 1:Error, 2:Warn, 3:Info, 4:Debug)
-        handle.register(MONITOR_URI_PREFIX) # 監視対象のURIを登録
-
-        logger.info(f"Cefpyco node initialized. Monitoring URI prefix: {MONITOR_URI_PREFIX}")
 
+    受信は PacketReceiver のスレッドで行い、このコルーチンはまとめて渡された
+    パケットを処理するだけなので、他のコルーチンを止めることはありません。
+    """
+    queue = asyncio.Queue(maxsize=RECEIVE_QUEUE_MAX_BATCHES)
+    receiver = PacketReceiver(loop, queue, MONITOR_URI_PREFIX,
+                              batch_size=RECEIVE_BATCH_SIZE,
+                              batch_interval_sec=RECEIVE_BATCH_INTERVAL_SEC,
+                              receive_timeout_ms=RECEIVE_TIMEOUT_MS)
+    receiver.start()
+    reported_drops = 0
+    try:
         while True:
-            info = handle.receive()
-            if info.is_succeeded:
-                if info.is_interest:
-                    # ここでは自身がInterestを送信する側の統計を監視するため、
-                    # 受信したInterestは通常無視するか、特別なロジックで処理する。
-                    # コンテンツ提供者として動作する場合にのみ意味がある。
-                    pass # 例: logger.debug(f"Received Interest: {info.name}")
-
-                elif info.is_data:
-                    data_name = info.name
-                    data_payload_size = info.payload_len
-                    reception_time = time.time()
-
-                    logger.debug(f"Received Data: Name={data_name}, Size={data_payload_size} bytes")
-
-                    # グローバル統計の更新
-                    current_stats["data_received_count"] += 1
-                    current_stats["data_received_bytes"] += data_payload_size
-
-                    # Interest送信時刻との差分で遅延を計算
-                    if info.name in interest_timestamps: # より正確にはNonceで紐付けるべき
-                        latency = (reception_time - interest_timestamps.pop(info.name)) * 1000 # ミリ秒
-                        
-                        # グローバル統計の平均遅延を更新 (移動平均など)
-                        if current_stats["avg_latency_ms"] == 0:
-                            current_stats["avg_latency_ms"] = latency
-                        else:
-                            # 簡易的な移動平均 (より複雑なフィルタリングも可能)
-                            current_stats["avg_latency_ms"] = (current_stats["avg_latency_ms"] * 0.9 + latency * 0.1)
-
-                        # コンテンツごとの統計を更新
-                        content_prefix = get_data_packet_name_prefix(data_name)
-                        if content_prefix and content_prefix in content_stats:
-                            content_stats[content_prefix]["data_segment_latencies"].append(latency)
-                            content_stats[content_prefix]["total_data_received_count"] += 1
-                            content_stats[content_prefix]["total_data_received_bytes"] += data_payload_size
-                            content_stats[content_prefix]["data_reception_times"].append(reception_time)
-                        
-                    # ジッター計算用に受信時刻を記録
-                    data_reception_times.append(reception_time)
-
-                elif info.is_nack:
-                    logger.warning(f"Received NACK for Interest (Nonce: {info.nonce})")
-                    # Interest送信時刻リストから該当Interestを削除
-                    for name, ts in list(interest_timestamps.items()):
-                        if info.name == name: # より堅牢なNonceでの検索が必要
-                            interest_timestamps.pop(name)
-                            break
-                    
-                elif info.is_cs_miss:
-                    logger.info(f"CS_MISS for Interest (Nonce: {info.nonce})")
-                    # CS_MISSもNACKと同様に処理することが多い
-                    for name, ts in list(interest_timestamps.items()):
-                        if info.name == name: # より堅牢なNonceでの検索が必要
-                            interest_timestamps.pop(name)
-                            break
-
-            # Cefpycoのイベントループをブロックしないように、少し待機
-            await asyncio.sleep(0.001) # 1ms待機
+            batch = await queue.get()
+            for reception_time, info in batch:
+                process_packet(info, reception_time)
+            if receiver.dropped_packets != reported_drops:
+                reported_drops = receiver.dropped_packets
+                logger.warning(f"Receive queue overflowed: {reported_drops} packets dropped so far")
+    finally:
+        receiver.stop()
 
 async def send_interests_periodically():
     """
     監視対象のURIにInterestを定期的に送信します。
     ここではデモのため、単純なシーケンシャルなセグメントをリクエストします。
     """
-    global current_stats, interest_timestamps, content_stats
+    global current_stats, content_stats
     
     segment_num = 0
     # ここでは便宜上、無限にInterestを送信し続けます。
@@ -275,10 +316,11 @@ async def send_interests_periodically():
             # ここではシンプルにするためInterestの名前もURIとして保持
             interest_send_time = time.time()
             try:
-                handle.send_interest(request_uri, lifetime=4000) # lifetimeを長めに設定
+                handle.send_interest(request_uri, lifetime=INTEREST_LIFETIME_MS) # lifetimeを長めに設定
                 current_stats["interest_sent_count"] += 1
                 current_stats["interest_sent_bytes"] += len(request_uri.encode('utf-8')) # URIのバイト数を概算
-                interest_timestamps[request_uri] = interest_send_time # InterestのURIをキーとしてタイムスタンプを保存
+                interest_table.add(request_uri, now=interest_send_time) # InterestのURIとチャンク番号をキーとして送信時刻を保存
+                prefix_trie.record_interest(MONITOR_URI_PREFIX, len(request_uri.encode('utf-8')))
                 logger.debug(f"Sent Interest: {request_uri}")
 
                 # 新しいコンテンツの開始を検出 (簡易的な判定)
@@ -303,19 +345,25 @@ async def manage_monitoring_records():
     last_record_hour = datetime.datetime.now().hour
     
     while True:
-        await asyncio.sleep(60) # 1分ごとにチェック
+        # 1分ごと (ただし時間の切り替わりは逃さないように) にチェック
+        now = datetime.datetime.now()
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        await asyncio.sleep(min(60, (next_hour - now).total_seconds() + 0.01))
 
         # 時間ごとのファイル切り替え
-        current_hour = datetime.datetime.now().hour
+        now = datetime.datetime.now()
+        current_hour = now.hour
         if current_hour != last_record_hour:
             logger.info(f"Time for new record file. Current hour: {current_hour}, Last record hour: {last_record_hour}")
-            # ここで、直前の時間のコンテンツ統計を集計し、ファイルに書き込む
-            # このデモでは、コンテンツ完了時に記録するため、特別な集計は行わないが、
-            # もし時間ごとの集計が必要ならここにロジックを追加
+            # 直前の時間の名前の階層ごとの統計を、その時間の記録ファイルに書き込む
+            hour_end = now.replace(minute=0, second=0, microsecond=0).timestamp() - 0.001
+            for record in prefix_trie.records():
+                record_writer.append(record, suffix="_prefixes", ts=hour_end)
+            prefix_trie.reset()
             last_record_hour = current_hour
 
         # 古いディレクトリの削除
-        delete_old_records()
+        delete_old_records(MONITORING_DIR, DATA_RETENTION_DAYS)
 
 def record_content_completion(uri_prefix):
     """
@@ -326,7 +374,8 @@ def record_content_completion(uri_prefix):
         logger.warning(f"No stats found for completed content: {uri_prefix}")
         return
 
-    stats = content_stats[uri_prefix]
+    stats = content_stats.pop(uri_prefix)
+    latency = stats.pop("latency")
     stats["end_time"] = time.time()
     
     if stats["start_time"] is not None and stats["end_time"] is not None:
@@ -336,56 +385,17 @@ def record_content_completion(uri_prefix):
     if stats["content_delivery_time_ms"] > 0:
         stats["avg_data_rate_bps"] = (stats["total_data_received_bytes"] * 8) / (stats["content_delivery_time_ms"] / 1000)
 
-    # 平均遅延計算
-    if stats["data_segment_latencies"]:
-        stats["avg_latency_ms"] = np.mean(stats["data_segment_latencies"])
-
-    # ジッター計算
-    if len(stats["data_reception_times"]) >= 2:
-        intervals = np.diff(list(stats["data_reception_times"])) * 1000 # ミリ秒
-        stats["jitter_ms"] = np.std(intervals) if len(intervals) > 0 else 0
-
-    # 記録ファイルへの保存
-    filename_prefix = get_current_filename_prefix()
-    record_filepath = f"{filename_prefix}.csv" # 時間ごとのファイル
-    
-    try:
-        # ヘッダーを書き込む（ファイルが存在しない場合のみ）
-        write_csv_header(record_filepath, stats)
-        # データを追記
-        append_to_csv(record_filepath, stats)
-        logger.info(f"Recorded content stats for {uri_prefix} to {record_filepath}")
-    except Exception as e:
-        logger.error(f"Failed to record content stats to CSV: {e}")
+    # 遅延とジッター
+    stats["avg_latency_ms"] = latency.mean
+    stats["p50_latency_ms"] = latency.p50.value
+    stats["p99_latency_ms"] = latency.p99.value
+    stats["jitter_ms"] = latency.jitter.value
 
-    # 記録後、そのコンテンツの統計をリセット（次の通信のために）
-    del content_stats[uri_prefix]
-
-
-def delete_old_records():
-    """
-    指定日数以上経過した古い監視記録ディレクトリを削除します。
-    """
-    now = datetime.datetime.now()
-    
-    if not os.path.exists(MONITORING_DIR):
-        return
-
-    for dir_name in os.listdir(MONITORING_DIR):
-        dir_path = os.path.join(MONITORING_DIR, dir_name)
-        if os.path.isdir(dir_path):
-            try:
-                # ディレクトリ名から日付を解析 (例: "2023-10-26")
-                dir_date = datetime.datetime.strptime(dir_name, "%Y-%m-%d")
-                
-                # 指定日数以上経過しているかチェック
-                if (now - dir_date).days > DATA_RETENTION_DAYS:
-                    logger.info(f"Deleting old monitoring directory: {dir_path}")
-                    shutil.rmtree(dir_path)
-            except ValueError:
-                logger.warning(f"Skipping non-date directory: {dir_path}")
-            except Exception as e:
-                logger.error(f"Error deleting directory {dir_path}: {e}")
+    # 時間ごとの記録ファイルへの保存 (書き込みスレッドがまとめて書き出す)
+    record_writer.append(stats)
+    record_writer.call(ts_store.append, "content", stats["end_time"], stats, uri_prefix)
+    logger.info(f"Recorded content stats for {uri_prefix}")
+    # 記録したコンテンツの統計は content_stats から取り除いてある（次の通信のために）
 
 # --- メイン関数 ---
 
@@ -393,18 +403,46 @@ async def main():
     """
     すべての非同期タスクを起動します。
     """
+    global record_writer, ts_store, live_stats
+
     logger.info("Starting QAM Monitoring Node...")
 
     # 各ディレクトリを確実に作成
     os.makedirs(MONITORING_DIR, exist_ok=True)
 
+    # 監視記録の書き込みスレッドを起動 (イベントループがディスクI/Oで止まらないように)
+    record_writer = RecordWriter(lambda now=None: get_current_filename_prefix(MONITORING_DIR, now),
+                                 flush_bytes=RECORD_FLUSH_BYTES,
+                                 flush_interval_sec=RECORD_FLUSH_INTERVAL_SEC,
+                                 fsync_policy=RECORD_FSYNC_POLICY)
+    record_writer.start()
+    ts_store = TimeSeriesStore(TS_STORE_DIR, flush_interval_sec=RECORD_FLUSH_INTERVAL_SEC)
+
+    # 1分・1時間ごとの集計と、保持期間を過ぎたデータの削除を行うスレッドを起動
+    compactor = Compactor(TS_STORE_DIR,
+                          {"raw": DATA_RETENTION_DAYS,
+                           "1m": ROLLUP_1M_RETENTION_DAYS,
+                           "1h": ROLLUP_1H_RETENTION_DAYS},
+                          interval_sec=ROLLUP_INTERVAL_SEC)
+    compactor.start()
+
+    # 現在の統計を公開する共有メモリ領域を作成
+    live_stats = LiveStatsWriter(LIVE_STATS_FILE,
+                                 [k for k, v in current_stats.items() if k != "timestamp"])
+    logger.info(f"Publishing live stats to {LIVE_STATS_FILE}")
+
     # 非同期タスクの起動
     tasks = [
         asyncio.create_task(handle_cefpyco_events(asyncio.get_event_loop())),
         asyncio.create_task(update_realtime_stats()),
+        asyncio.create_task(publish_live_stats()),
         asyncio.create_task(manage_monitoring_records()),
         asyncio.create_task(send_interests_periodically()) # デモ用: Interestを定期的に送信
     ]
+    if METRICS_HTTP_PORT is not None:
+        metrics_server = MetricsServer(collect_metrics, METRICS_HTTP_HOST, METRICS_HTTP_PORT,
+                                       refresh_sec=METRICS_REFRESH_SEC)
+        tasks.append(asyncio.create_task(metrics_server.serve()))
 
     try:
         await asyncio.gather(*tasks)
@@ -413,6 +451,10 @@ async def main():
     except Exception as e:
         logger.critical(f"An unhandled error occurred in main: {e}")
     finally:
+        compactor.stop()
+        live_stats.close()
+        record_writer.call(ts_store.close)
+        record_writer.close()
         logger.info("QAM Monitoring Node stopped.")
 
 
@@ -0,0 +1,89 @@
+import math
+import time
+
+
+class InterestTable:
+    """
+    遅延計測のための、PIT風の送信済みInterest追跡テーブル。
+
+    エントリは (name, chunk) をキーとし、Dataとの照合・削除は辞書引きだけで O(1) です。
+    cefpyco からは送信したInterestのnonceを得られず、Dataにもnonceが無いため、
+    同じチャンクを再送した場合は送信時刻を上書きし、最後の送信からの遅延を計ります。
+
+    応答の無いInterestはタイミングホイールで期限切れにし、timeouts に数えます。
+    テーブルが capacity に達したときは最も古いエントリを追い出し、evictions に
+    数えます。これにより負荷が高くてもメモリ使用量と処理量は一定に保たれます。
+    """
+
+    def __init__(self, capacity=65536, lifetime_sec=4.0, tick_sec=0.1):
+        self.capacity = capacity
+        self.lifetime_sec = lifetime_sec
+        self.tick_sec = tick_sec
+        self._n_slots = int(math.ceil(lifetime_sec / tick_sec)) + 1
+        self._wheel = [{} for _ in range(self._n_slots)]  # 各スロット: {key: None}
+        self._entries = {}  # key: (name, chunk), value: (send_time, expiry_tick)
+        self._tick = None  # 最後に期限切れ処理をしたtick
+        self.matched = 0
+        self.timeouts = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, name, chunk=0, now=None):
+        """送信したInterestを登録します。同じキーが既にあれば (再送) 送信時刻を更新します。"""
+        if now is None:
+            now = time.time()
+        key = (name, chunk)
+        if key in self._entries:
+            self._discard(key)
+        elif len(self._entries) >= self.capacity:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+        expiry_tick = int((now + self.lifetime_sec) / self.tick_sec)
+        self._entries[key] = (now, expiry_tick)
+        self._wheel[expiry_tick % self._n_slots][key] = None
+
+    def match(self, name, chunk=0):
+        """
+        応答に対応するInterestをテーブルから取り除き、その送信時刻を返します。
+        対応するInterestが無ければ None を返します。
+        """
+        key = (name, chunk)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._discard(key)
+        self.matched += 1
+        return entry[0]
+
+    def remove(self, name, chunk=0):
+        """NACKなどで応答が来ないと分かったInterestを取り除きます。"""
+        key = (name, chunk)
+        if key not in self._entries:
+            return False
+        self._discard(key)
+        return True
+
+    def expire(self, now=None):
+        """期限切れのInterestを取り除き、その数を返します。"""
+        if now is None:
+            now = time.time()
+        cur = int(now / self.tick_sec)
+        if self._tick is None:
+            self._tick = cur - self._n_slots
+        # 1周より長く呼ばれなかった場合も、各スロットは1回ずつ見れば十分
+        start = max(self._tick + 1, cur - self._n_slots + 1)
+        expired = 0
+        for t in range(start, cur + 1):
+            slot = self._wheel[t % self._n_slots]
+            for key in [k for k in slot if self._entries[k][1] <= cur]:
+                self._discard(key)
+                expired += 1
+        self._tick = cur
+        self.timeouts += expired
+        return expired
+
+    def _discard(self, key):
+        _, expiry_tick = self._entries.pop(key)
+        del self._wheel[expiry_tick % self._n_slots][key]
@@ -0,0 +1,157 @@
+"""
+共有メモリ (mmap) を使った現在の統計の公開と読み取り。
+
+監視ノードは LiveStatsWriter で固定レイアウトの領域に数値を書き込み、
+ダッシュボードなどのローカルのプロセスは LiveStatsReader で読み取ります。
+読み取りはファイルI/Oを伴わず、監視ノードの処理を待たせることもありません。
+
+レイアウト (リトルエンディアン):
+  0   magic "CMLV", version (u16), 項目数 (u16), 予約 (u32)
+  16  シーケンス番号 (u64)  書き込み中は奇数
+  24  更新時刻 (f64, UNIX時刻)
+  32  項目名 (NAME_SIZE バイトずつ, NUL詰め)
+  ..  値 (f64 × 項目数)
+
+書き込みはシーケンスロックで、シーケンス番号を奇数にしてから値を書き、偶数に
+戻します。リーダーは前後で同じ偶数のシーケンス番号を読めたときだけ値を採用するため、
+書き込み途中の値を読むことはありません。
+
+使い方 (コマンドライン):
+  python livestats.py --interval 0.1
+"""
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+
+MAGIC = b"CMLV"
+VERSION = 1
+NAME_SIZE = 32
+_HEADER = struct.Struct("<4sHHI")
+_SEQ = struct.Struct("<Q")
+_SEQ_OFFSET = 16
+_TIME = struct.Struct("<d")
+_TIME_OFFSET = 24
+_NAMES_OFFSET = 32
+
+
+def _layout(n_fields):
+    values_offset = _NAMES_OFFSET + NAME_SIZE * n_fields
+    return values_offset, values_offset + 8 * n_fields
+
+
+class LiveStatsWriter:
+    """
+    fields の各項目 (数値) を path の共有メモリ領域に公開します。
+
+    ファイルは一時ファイルに初期化してから置き換えるため、古い領域を開いている
+    リーダーが壊れた内容を読むことはありません (古い領域は更新されなくなるので、
+    リーダーは更新時刻が古ければ開き直してください)。
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = list(fields)
+        self._values = struct.Struct(f"<{len(self.fields)}d")
+        self._values_offset, size = _layout(len(self.fields))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * size)
+        fd = os.open(tmp_path, os.O_RDWR)
+        try:
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        _HEADER.pack_into(self._mm, 0, MAGIC, VERSION, len(self.fields), 0)
+        for i, name in enumerate(self.fields):
+            encoded = name.encode()[:NAME_SIZE]
+            self._mm[_NAMES_OFFSET + NAME_SIZE * i:_NAMES_OFFSET + NAME_SIZE * i + len(encoded)] = encoded
+        os.replace(tmp_path, path)
+        self._seq = 0
+
+    def publish(self, stats, now=None):
+        """stats (辞書) の値を書き込みます。無い項目や数値でない項目は 0 になります。"""
+        values = []
+        for name in self.fields:
+            v = stats.get(name)
+            values.append(float(v) if isinstance(v, (int, float)) else 0.0)
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)  # 奇数: 書き込み中
+        _TIME.pack_into(self._mm, _TIME_OFFSET, time.time() if now is None else now)
+        self._values.pack_into(self._mm, self._values_offset, *values)
+        self._seq += 1
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+
+    def close(self):
+        self._mm.close()
+
+
+class LiveStatsReader:
+    """LiveStatsWriter が公開している統計を読み取ります。"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reopen()
+
+    def reopen(self):
+        """領域を開き直します (監視ノードが再起動して領域を作り直した場合など)。"""
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_fields, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a live stats region")
+        self.fields = []
+        for i in range(n_fields):
+            raw = self._mm[_NAMES_OFFSET + NAME_SIZE * i:_NAMES_OFFSET + NAME_SIZE * (i + 1)]
+            self.fields.append(raw.rstrip(b"\0").decode())
+        self._values = struct.Struct(f"<{n_fields}d")
+        self._values_offset, _ = _layout(n_fields)
+
+    def read(self, max_retries=1000):
+        """
+        一貫した値の組を {"timestamp": 更新時刻, 項目: 値, ...} で返します。
+        一度も公開されていなければ None を返します。
+        """
+        mm = self._mm
+        for _ in range(max_retries):
+            seq = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq & 1:
+                time.sleep(0)  # 書き込みが終わるのを待つ
+                continue
+            ts = _TIME.unpack_from(mm, _TIME_OFFSET)[0]
+            values = self._values.unpack_from(mm, self._values_offset)
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq:
+                if seq == 0:
+                    return None
+                result = {"timestamp": ts}
+                result.update(zip(self.fields, values))
+                return result
+        raise TimeoutError("Live stats are being updated too frequently to read")
+
+    def close(self):
+        self._mm.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print live monitoring stats")
+    parser.add_argument("--path", default="/dev/shm/cefmoni_live_stats", help="共有メモリ領域のパス")
+    parser.add_argument("--interval", type=float, default=1.0, help="表示間隔 (秒)")
+    parser.add_argument("--count", type=int, default=0, help="表示回数 (0: 無制限)")
+    args = parser.parse_args(argv)
+
+    reader = LiveStatsReader(args.path)
+    n = 0
+    try:
+        while args.count == 0 or n < args.count:
+            print(reader.read())
+            n += 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+監視ノードの統計を返すローカル用の軽量HTTPエンドポイント。
+
+  GET /metrics     Prometheus のテキスト形式
+  GET /stats.json  JSON
+
+レスポンスはタイマーで refresh_sec ごとに (ヘッダーを含めて) 作り直しておき、
+リクエストごとにはそのバイト列を書き出すだけです。統計の直列化はリクエスト数に
+よらず更新間隔ごとに1回しか行われません。サーバーは監視ノードと同じ
+イベントループ上で動きます。
+"""
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "cefmoni"
+_NOT_FOUND = (b"HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+              b"Content-Length: 10\r\nConnection: close\r\n\r\nNot Found\n")
+
+
+def _response(body, content_type):
+    header = (f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\n"
+              f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    return header.encode() + body
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _metric_type(name):
+    # 累積値 (リセットしないカウンター) は counter、それ以外は gauge
+    return "counter" if name.endswith(("_count", "_bytes")) else "gauge"
+
+
+def render_prometheus(current, per_prefix):
+    """current (辞書) と per_prefix ({プレフィックス: 辞書}) をPrometheusのテキスト形式にします。"""
+    lines = []
+    for name, value in current.items():
+        if not isinstance(value, (int, float)):
+            continue
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} {_metric_type(name)}")
+        lines.append(f"{metric} {float(value)!r}")
+    series = {}
+    for prefix, stats in per_prefix.items():
+        label = _escape_label(prefix)
+        for name, value in stats.items():
+            if isinstance(value, (int, float)):
+                series.setdefault(name, []).append(f"{{prefix=\"{label}\"}} {float(value)!r}")
+    for name, samples in series.items():
+        metric = f"{METRIC_PREFIX}_content_{name}"
+        lines.append(f"# TYPE {metric} {_metric_type(name)}")
+        lines.extend(metric + s for s in samples)
+    lines.append("")
+    return "\n".join(lines)
+
+
+class MetricsServer:
+    """
+    collect() が返す (current_stats, {プレフィックス: 統計}) を配信するHTTPサーバー。
+    collect() はイベントループ上で refresh_sec ごとに呼ばれます。
+    """
+
+    def __init__(self, collect, host="127.0.0.1", port=9464, refresh_sec=1.0):
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self.refresh_sec = refresh_sec
+        self.requests = 0
+        self._responses = {}
+        self._server = None
+
+    def refresh(self):
+        current, per_prefix = self.collect()
+        prom = render_prometheus(current, per_prefix).encode()
+        doc = json.dumps({"timestamp": time.time(), "current": current, "content": per_prefix},
+                         default=str).encode()
+        self._responses = {
+            "/metrics": _response(prom, "text/plain; version=0.0.4; charset=utf-8"),
+            "/stats.json": _response(doc, "application/json"),
+        }
+
+    async def serve(self):
+        """サーバーを起動し、レスポンスを更新し続けます。"""
+        self.refresh()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        try:
+            while True:
+                await asyncio.sleep(self.refresh_sec)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Failed to render metrics: {e}")
+        finally:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # ヘッダーは読み捨てる
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            path = parts[1].decode(errors="replace").split("?", 1)[0] if len(parts) >= 2 else ""
+            writer.write(self._responses.get(path, _NOT_FOUND))
+            self.requests += 1
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,170 @@
+"""
+名前の階層ごとに統計を集計するプレフィックス木。
+
+/iot/sensor/001 への記録は /, /iot, /iot/sensor, /iot/sensor/001 のすべての
+ノードに加算されます。名前からノード列への対応はキャッシュするため、同じ名前を
+何度記録しても文字列の分割は1回だけで、更新は深さに比例する O(depth) です。
+
+メモリ使用量は次の2つで抑えます。
+  max_depth : これより深い名前は max_depth 階層目のノードに集計する
+  max_nodes : ノード数がこれを超えたら、各ノードの子を通信量の多い top_k 個に絞り、
+              それでも多ければ通信量の少ない葉から削除する
+削除したノードの値は親ノードに含まれたままなので、上位の階層の集計は正確です。
+"""
+
+
+class PrefixNode:
+    __slots__ = ("name", "depth", "parent", "children",
+                 "interests", "interest_bytes", "data", "data_bytes", "nacks",
+                 "latency_count", "latency_sum_ms", "latency_max_ms")
+
+    def __init__(self, name, depth, parent):
+        self.name = name
+        self.depth = depth
+        self.parent = parent
+        self.children = {}
+        self.reset()
+
+    def reset(self):
+        self.interests = 0
+        self.interest_bytes = 0
+        self.data = 0
+        self.data_bytes = 0
+        self.nacks = 0
+        self.latency_count = 0
+        self.latency_sum_ms = 0.0
+        self.latency_max_ms = 0.0
+
+    @property
+    def traffic(self):
+        return self.interests + self.data + self.nacks
+
+    def as_record(self):
+        return {
+            "prefix": self.name,
+            "depth": self.depth,
+            "interest_count": self.interests,
+            "interest_bytes": self.interest_bytes,
+            "data_received_count": self.data,
+            "data_received_bytes": self.data_bytes,
+            "nack_count": self.nacks,
+            "avg_latency_ms": self.latency_sum_ms / self.latency_count if self.latency_count else 0,
+            "max_latency_ms": self.latency_max_ms,
+        }
+
+
+class PrefixTrie:
+    """名前の階層ごとの Interest/Data/NACK の数とバイト数、遅延の集計"""
+
+    def __init__(self, max_depth=4, max_nodes=10000, top_k=100, cache_size=65536):
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.top_k = top_k
+        self.cache_size = cache_size
+        self.root = PrefixNode("/", 0, None)
+        self.n_nodes = 1
+        self.pruned = 0  # 削除したノード数の累計
+        self._cache = {}  # key: 名前, value: ルートからのノード列
+
+    def _path(self, name):
+        nodes = self._cache.get(name)
+        if nodes is not None:
+            return nodes
+        node = self.root
+        nodes = [node]
+        path = name[5:] if name.startswith("ccnx:") else name
+        for component in path.strip("/").split("/")[:self.max_depth]:
+            if not component:
+                continue
+            child = node.children.get(component)
+            if child is None:
+                child = PrefixNode(f"{node.name.rstrip('/')}/{component}", node.depth + 1, node)
+                node.children[component] = child
+                self.n_nodes += 1
+            node = child
+            nodes.append(node)
+        nodes = tuple(nodes)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[name] = nodes
+        if self.n_nodes > self.max_nodes:
+            self.prune()
+            return self._path(name)
+        return nodes
+
+    def record_interest(self, name, nbytes=0):
+        for node in self._path(name):
+            node.interests += 1
+            node.interest_bytes += nbytes
+
+    def record_data(self, name, nbytes=0, latency_ms=None):
+        for node in self._path(name):
+            node.data += 1
+            node.data_bytes += nbytes
+            if latency_ms is not None:
+                node.latency_count += 1
+                node.latency_sum_ms += latency_ms
+                if latency_ms > node.latency_max_ms:
+                    node.latency_max_ms = latency_ms
+
+    def record_nack(self, name):
+        for node in self._path(name):
+            node.nacks += 1
+
+    def merge(self, name, interests=0, interest_bytes=0, data=0, data_bytes=0, nacks=0,
+              latency_count=0, latency_sum_ms=0.0, latency_max_ms=0.0):
+        """他の集計 (別プロセスの差分など) の値を name の経路にまとめて加算します。"""
+        for node in self._path(name):
+            node.interests += interests
+            node.interest_bytes += interest_bytes
+            node.data += data
+            node.data_bytes += data_bytes
+            node.nacks += nacks
+            node.latency_count += latency_count
+            node.latency_sum_ms += latency_sum_ms
+            if latency_max_ms > node.latency_max_ms:
+                node.latency_max_ms = latency_max_ms
+
+    def nodes(self):
+        """すべてのノードを深さ優先で返します。"""
+        return self._subtree(self.root)
+
+    def records(self):
+        """記録のあるノードの統計を、ファイルに書き出せる辞書のリストで返します。"""
+        return [n.as_record() for n in self.nodes() if n.traffic]
+
+    def reset(self):
+        """木の形はそのままで、すべてのノードの値を0にします (1時間ごとの記録の後など)。"""
+        for node in self.nodes():
+            node.reset()
+
+    def prune(self):
+        """ノード数が max_nodes の8割以下になるまで、通信量の少ないノードを削除します。"""
+        self._cache.clear()
+        for node in list(self.nodes()):
+            if len(node.children) > self.top_k:
+                ranked = sorted(node.children.items(), key=lambda kv: kv[1].traffic, reverse=True)
+                for key, child in ranked[self.top_k:]:
+                    self._remove(node, key, child)
+        target = self.max_nodes * 8 // 10
+        while self.n_nodes > target:
+            leaves = sorted((n for n in self.nodes() if not n.children and n.parent is not None),
+                            key=lambda n: n.traffic)
+            if not leaves:
+                break
+            for leaf in leaves[:self.n_nodes - target]:
+                self._remove(leaf.parent, leaf.name.rsplit("/", 1)[1], leaf)
+
+    def _remove(self, parent, key, child):
+        n = sum(1 for _ in self._subtree(child))
+        del parent.children[key]
+        self.n_nodes -= n
+        self.pruned += n
+
+    @staticmethod
+    def _subtree(node):
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            yield n
+            stack.extend(n.children.values())
@@ -0,0 +1,68 @@
+import time
+import asyncio
+import logging
+import threading
+import cefpyco
+
+logger = logging.getLogger(__name__)
+
+
+class PacketReceiver(threading.Thread):
+    """
+    専用スレッドでCefpycoHandle.receive()を呼び、受信したパケットをまとめて
+    asyncio.Queue に渡します。バッチは (受信時刻, パケット) のリストです。
+
+    receive()はブロックするため、イベントループ上で呼ぶと他のコルーチンが
+    受信タイムアウトの間止まってしまいます。このスレッドは batch_size 個
+    溜まるか batch_interval_sec が経過するか受信がタイムアウトしたときに、
+    それまでのパケットを1つのリストとしてキューに入れます。
+    キューが満杯のときはそのバッチを捨て、dropped_packets に数えます。
+
+    Cefpycoのハンドルはスレッドセーフではないため、ハンドルはこのスレッドの
+    中で生成し、このスレッドからだけ使います。
+    """
+
+    def __init__(self, loop, queue, uri_prefix, batch_size=256, batch_interval_sec=0.01,
+                 receive_timeout_ms=100, log_level=3):
+        super().__init__(name="cefpyco-receiver", daemon=True)
+        self.loop = loop
+        self.queue = queue
+        self.uri_prefix = uri_prefix
+        self.batch_size = batch_size
+        self.batch_interval_sec = batch_interval_sec
+        self.receive_timeout_ms = receive_timeout_ms
+        self.log_level = log_level
+        self.received_packets = 0
+        self.dropped_packets = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        with cefpyco.CefpycoHandle() as handle:
+            handle.set_log_level(self.log_level) # Cefpycoのログレベルを設定 (0:None, 1:Error, 2:Warn, 3:Info, 4:Debug)
+            handle.register(self.uri_prefix) # 監視対象のURIを登録
+            logger.info(f"Cefpyco node initialized. Monitoring URI prefix: {self.uri_prefix}")
+
+            batch = []
+            deadline = time.monotonic() + self.batch_interval_sec
+            while not self._stop_event.is_set():
+                info = handle.receive(timeout_ms=self.receive_timeout_ms)
+                if info.is_succeeded:
+                    # 遅延計算のため、受信時刻はこのスレッドで記録する
+                    batch.append((time.time(), info))
+                    self.received_packets += 1
+                if batch and (not info.is_succeeded or len(batch) >= self.batch_size
+                              or time.monotonic() >= deadline):
+                    self.loop.call_soon_threadsafe(self._put, batch)
+                    batch = []
+                if not batch:
+                    deadline = time.monotonic() + self.batch_interval_sec
+
+    def _put(self, batch):
+        # イベントループのスレッドで実行される
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            self.dropped_packets += len(batch)
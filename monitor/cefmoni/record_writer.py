@@ -0,0 +1,200 @@
+import os
+import csv
+import time
+import queue
+import shutil
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("none", "rotate", "always")
+
+_STOP = object()
+
+
+def get_current_filename_prefix(base_dir, now=None):
+    """現在の時刻 (now を指定した場合はその時刻) に基づいて <base_dir>/<YYYY-MM-DD>/<HH> を返します。"""
+    if now is None:
+        now = datetime.datetime.now()
+    dir_path = os.path.join(base_dir, now.strftime("%Y-%m-%d"))
+    os.makedirs(dir_path, exist_ok=True)
+    return os.path.join(dir_path, now.strftime("%H"))
+
+
+def delete_old_records(base_dir, retention_days):
+    """
+    base_dir の日付ごとの記録ディレクトリのうち、retention_days 日より古いものを削除します。
+    時系列ストアの生データは Compactor が集計してから削除するため、ここでは扱いません。
+    """
+    if not os.path.exists(base_dir):
+        return
+    now = datetime.datetime.now()
+    for dir_name in os.listdir(base_dir):
+        dir_path = os.path.join(base_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            continue
+        try:
+            # ディレクトリ名から日付を解析 (例: "2023-10-26")
+            dir_date = datetime.datetime.strptime(dir_name, "%Y-%m-%d")
+            if (now - dir_date).days > retention_days:
+                logger.info(f"Deleting old monitoring directory: {dir_path}")
+                shutil.rmtree(dir_path)
+        except ValueError:
+            logger.warning(f"Skipping non-date directory: {dir_path}")
+        except Exception as e:
+            logger.error(f"Error deleting directory {dir_path}: {e}")
+
+
+class _HourlyFile:
+    """1時間分の記録ファイル (ヘッダーは新規ファイルのときだけ書き込む)"""
+
+    def __init__(self, path, buffer_size):
+        self.path = path
+        self.has_header = os.path.exists(path) and os.path.getsize(path) > 0
+        self.f = open(path, 'a', newline='', buffering=buffer_size)
+        self.writer = csv.writer(self.f)
+
+    def writerow(self, keys, values):
+        n = 0
+        if not self.has_header:
+            n += self.writer.writerow(keys)
+            self.has_header = True
+        return n + self.writer.writerow(values)
+
+    def flush(self, fsync):
+        self.f.flush()
+        if fsync:
+            os.fsync(self.f.fileno())
+
+    def close(self, fsync):
+        self.flush(fsync)
+        self.f.close()
+
+
+class RecordWriter(threading.Thread):
+    """
+    監視記録をバックグラウンドスレッドで書き込みます。
+
+    レコードごとにファイルを開閉する代わりに、その時間帯のファイルを開いたまま
+    バッファに溜め、flush_bytes を超えるか flush_interval_sec が経過したときに
+    まとめて書き出します。ファイル名は prefix_func (get_current_filename_prefix)
+    でレコードの時刻から決まります。時間帯ごとのファイルは開いたままにしておき、
+    前回の書き出しから書き込みの無かった時間帯のファイルを書き出しの際に閉じます。
+    時間帯の境目で前後の時間帯の行 (ts=hour_end の "_prefixes" など) が交互に
+    来ても、そのたびにファイルを開き直すことはありません。
+
+    fsync_policy:
+      "none"   : fsyncしない (OSに任せる)
+      "rotate" : ファイルを閉じるときと終了時にfsyncする
+      "always" : 書き出しのたびにfsyncする
+    """
+
+    def __init__(self, prefix_func, flush_bytes=64 * 1024, flush_interval_sec=5.0,
+                 fsync_policy="rotate"):
+        super().__init__(name="record-writer", daemon=True)
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.prefix_func = prefix_func
+        self.flush_bytes = flush_bytes
+        self.flush_interval_sec = flush_interval_sec
+        self.fsync_policy = fsync_policy
+        self._queue = queue.SimpleQueue()
+        self._files = {}  # key: (時間帯 (年, 月, 日, 時), suffix), value: _HourlyFile
+        self._active_hours = set()  # 前回の書き出し以降に書き込んだ時間帯
+        self._pending_bytes = 0
+        self._next_flush = time.monotonic() + flush_interval_sec
+
+    # --- イベントループ側から呼ぶAPI (ブロックしない) ---
+
+    def append(self, record, suffix="", ts=None):
+        """
+        その時間帯の記録ファイル (<prefix><suffix>.csv) に1行追記します。
+        ts (UNIX時刻) を指定すると、現在ではなくその時刻の時間帯のファイルに書きます。
+        """
+        if ts is None:
+            ts = time.time()
+        self._queue.put(("row", ts, suffix, tuple(record.keys()), tuple(record.values())))
+
+    def publish_snapshot(self, path, record):
+        """path をヘッダーと1行だけのCSVでアトミックに置き換えます。"""
+        self._queue.put(("snapshot", path, tuple(record.keys()), tuple(record.values())))
+
+    def call(self, func, *args):
+        """func(*args) を書き込みスレッドで実行します。"""
+        self._queue.put(("call", func, args))
+
+    def close(self):
+        """キューに残っている記録を書き切ってからスレッドを終了します。"""
+        self._queue.put(_STOP)
+        self.join()
+
+    # --- 書き込みスレッド ---
+
+    def run(self):
+        while True:
+            timeout = max(0.0, self._next_flush - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                try:
+                    self._handle(item)
+                except Exception as e:
+                    logger.error(f"Failed to write monitoring record: {e}")
+            if self._pending_bytes >= self.flush_bytes or time.monotonic() >= self._next_flush:
+                self._flush()
+        self._close_files()
+
+    def _handle(self, item):
+        kind = item[0]
+        if kind == "row":
+            _, ts, suffix, keys, values = item
+            hour = time.localtime(ts)[:4]
+            f = self._files.get((hour, suffix))
+            if f is None:
+                prefix = self.prefix_func(now=datetime.datetime.fromtimestamp(ts))
+                f = _HourlyFile(f"{prefix}{suffix}.csv", self.flush_bytes)
+                self._files[(hour, suffix)] = f
+            self._active_hours.add(hour)
+            self._pending_bytes += f.writerow(keys, values)
+        elif kind == "snapshot":
+            _, path, keys, values = item
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(keys)
+                writer.writerow(values)
+            os.replace(tmp_path, path)
+        elif kind == "call":
+            _, func, args = item
+            func(*args)
+
+    def _flush(self):
+        fsync = self.fsync_policy == "always"
+        for f in self._files.values():
+            try:
+                f.flush(fsync)
+            except Exception as e:
+                logger.error(f"Failed to flush {f.path}: {e}")
+        # 書き込みの無かった時間帯 (過ぎた時間帯) のファイルはここで閉じる
+        self._close_files(keep=self._active_hours)
+        self._active_hours = set()
+        self._pending_bytes = 0
+        self._next_flush = time.monotonic() + self.flush_interval_sec
+
+    def _close_files(self, keep=()):
+        """keep に含まれない時間帯のファイルを閉じます。"""
+        fsync = self.fsync_policy != "none"
+        for key, f in list(self._files.items()):
+            if key[0] in keep:
+                continue
+            try:
+                f.close(fsync)
+            except Exception as e:
+                logger.error(f"Failed to close {f.path}: {e}")
+            del self._files[key]
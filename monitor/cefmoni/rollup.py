@@ -0,0 +1,287 @@
+"""
+監視データの多段ダウンサンプリング (ロールアップ)。
+
+時系列ストア (tsstore.py) の生データ ("second", "content") から、1分ごと・1時間ごとの
+集計ストリーム ("second_1m", "second_1h", "content_1m", "content_1h") を作ります。
+各集計レコードは、元の各項目の最小・最大・平均とレコード数、そして SKETCH_FIELDS の
+項目については分位点を求めるための対数バケットのスケッチを持ちます。
+スケッチはバケットごとの件数なので、足し合わせるだけで併合でき (1時間の集計は
+1分の集計から作ります)、任意の期間の p50/p99 を相対誤差 SKETCH_RELATIVE_ERROR
+程度で求められます。
+
+Compactor はバックグラウンドスレッドで定期的にロールアップを進め、保持期間を
+過ぎたセグメントを削除します。生データはロールアップが済むまで削除しません。
+
+使い方 (コマンドライン):
+  python rollup.py --stream second --level 1h --field avg_latency_ms \\
+      --from 2024-01-01 --to 2024-02-01
+"""
+import os
+import sys
+import math
+import time
+import logging
+import argparse
+import datetime
+import threading
+import numpy as np
+import tsstore
+
+logger = logging.getLogger(__name__)
+
+# --- 分位点スケッチ ---
+SKETCH_BUCKETS = 192
+SKETCH_MIN = 0.01  # これ以下の値は先頭のバケットに入る
+SKETCH_MAX = 1e5   # これ以上の値は末尾のバケットに入る
+SKETCH_GAMMA = (SKETCH_MAX / SKETCH_MIN) ** (1.0 / (SKETCH_BUCKETS - 2))
+SKETCH_RELATIVE_ERROR = (SKETCH_GAMMA - 1) / (SKETCH_GAMMA + 1)
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+# スケッチを持つ項目 (ミリ秒単位の値)
+SKETCH_FIELDS = {
+    "second": ("avg_latency_ms", "jitter_ms"),
+    "content": ("avg_latency_ms", "jitter_ms", "content_delivery_time_ms"),
+}
+
+# 集計の段階: (名前, 幅 (秒), 元にするストリームの段階, セグメントの長さ)
+LEVELS = (
+    ("1m", 60, None, tsstore.SEGMENT_DAY),
+    ("1h", 3600, "1m", tsstore.SEGMENT_MONTH),
+)
+
+
+def sketch_index(values):
+    """値をスケッチのバケット番号に変換します。"""
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        idx = np.ceil(np.log(values / SKETCH_MIN) / np.log(SKETCH_GAMMA))
+    idx = np.where(values > SKETCH_MIN, idx, 0)
+    return np.clip(np.nan_to_num(idx), 0, SKETCH_BUCKETS - 1).astype(np.intp)
+
+
+def sketch_bucket(value):
+    """1つの値のバケット番号 (sketch_index のスカラー版)"""
+    if not value > SKETCH_MIN:
+        return 0
+    return min(int(math.ceil(math.log(value / SKETCH_MIN) / _LOG_GAMMA)), SKETCH_BUCKETS - 1)
+
+
+def sketch_quantiles(counts, qs):
+    """スケッチ (バケットごとの件数) から分位点 qs (0..1) の推定値を返します。"""
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum()
+    if total == 0:
+        return [float("nan")] * len(qs)
+    cum = np.cumsum(counts)
+    result = []
+    for q in qs:
+        i = int(np.searchsorted(cum, q * (total - 1), side="right"))
+        if i == 0:
+            result.append(SKETCH_MIN)
+        else:
+            # バケット (MIN*γ^(i-1), MIN*γ^i] の代表値
+            result.append(SKETCH_MIN * SKETCH_GAMMA ** i * 2 / (SKETCH_GAMMA + 1))
+    return result
+
+
+# --- 集計 ---
+
+def _value_fields(raw_dtype):
+    return [n for n in raw_dtype.names if n not in ("ts", "prefix_id")]
+
+
+def rollup_dtype(stream):
+    """stream の集計ストリームのスキーマを返します。"""
+    raw_dtype = tsstore.STREAM_DTYPES[stream]
+    fields = [("ts", "<f8")]  # 集計期間の開始時刻
+    if "prefix_id" in raw_dtype.names:
+        fields.append(("prefix_id", "<u4"))
+    fields.append(("count", "<u8"))
+    for name in _value_fields(raw_dtype):
+        fields += [(f"{name}_min", "<f8"), (f"{name}_max", "<f8"), (f"{name}_mean", "<f8")]
+    for name in SKETCH_FIELDS[stream]:
+        fields.append((f"{name}_sketch", "<u4", (SKETCH_BUCKETS,)))
+    return np.dtype(fields)
+
+
+ROLLUP_DTYPES = {f"{stream}_{level}": rollup_dtype(stream)
+                 for stream in tsstore.STREAM_DTYPES for level, _, _, _ in LEVELS}
+ROLLUP_SEGMENT_FORMATS = {f"{stream}_{level}": fmt
+                          for stream in tsstore.STREAM_DTYPES for level, _, _, fmt in LEVELS}
+ALL_DTYPES = {**tsstore.STREAM_DTYPES, **ROLLUP_DTYPES}
+
+
+def rollup(stream, records, width):
+    """
+    records (stream の生データ、またはその集計) を width 秒ごと
+    (content はさらにプレフィックスごと) に集計した構造化配列を返します。
+    """
+    dtype = rollup_dtype(stream)
+    out_names = dtype.names
+    if len(records) == 0:
+        return np.zeros(0, dtype=dtype)
+    is_raw = "count" not in records.dtype.names
+    starts = np.floor(records["ts"] / width) * width
+    if "prefix_id" in out_names:
+        keys = np.rec.fromarrays([starts, records["prefix_id"]], names="ts,prefix_id")
+    else:
+        keys = starts
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    out = np.zeros(len(uniq), dtype=dtype)
+    if "prefix_id" in out_names:
+        out["ts"] = uniq["ts"]
+        out["prefix_id"] = uniq["prefix_id"]
+    else:
+        out["ts"] = uniq
+
+    counts = np.ones(len(records)) if is_raw else records["count"].astype(float)
+    np.add.at(out["count"], inverse, counts.astype(np.uint64))
+    total = out["count"].astype(float)
+    for name in _value_fields(tsstore.STREAM_DTYPES[stream]):
+        if is_raw:
+            lo = hi = records[name].astype(float)
+            weighted = lo
+        else:
+            lo, hi = records[f"{name}_min"], records[f"{name}_max"]
+            weighted = records[f"{name}_mean"] * counts
+        out[f"{name}_min"] = np.inf
+        out[f"{name}_max"] = -np.inf
+        np.minimum.at(out[f"{name}_min"], inverse, lo)
+        np.maximum.at(out[f"{name}_max"], inverse, hi)
+        sums = np.zeros(len(uniq))
+        np.add.at(sums, inverse, weighted)
+        out[f"{name}_mean"] = sums / np.maximum(total, 1)
+    for name in SKETCH_FIELDS[stream]:
+        sketch = out[f"{name}_sketch"]
+        if is_raw:
+            np.add.at(sketch, (inverse, sketch_index(records[name])), 1)
+        else:
+            np.add.at(sketch, inverse, records[f"{name}_sketch"])
+    return out
+
+
+def summarize(records, field):
+    """集計レコードを併合して、期間全体の field の統計を返します。"""
+    sketch = records[f"{field}_sketch"].sum(axis=0) if f"{field}_sketch" in records.dtype.names else None
+    count = int(records["count"].sum())
+    result = {
+        "count": count,
+        "min": float(records[f"{field}_min"].min()),
+        "max": float(records[f"{field}_max"].max()),
+        "mean": float((records[f"{field}_mean"] * records["count"]).sum() / count),
+    }
+    if sketch is not None:
+        result["p50"], result["p95"], result["p99"] = sketch_quantiles(sketch, (0.5, 0.95, 0.99))
+    return result
+
+
+# --- バックグラウンドでの集計と削除 ---
+
+class Compactor(threading.Thread):
+    """
+    interval_sec ごとに、完了した集計期間のロールアップを作り、保持期間を過ぎた
+    セグメントを削除するスレッド。
+
+    retention_days はストリームの段階 ("raw", "1m", "1h") ごとの保持日数です。
+    生データはまだ書き込み中の可能性があるため、集計期間の終わりから
+    grace_sec 経過してからロールアップします。
+    """
+
+    def __init__(self, root, retention_days, interval_sec=60, grace_sec=30):
+        super().__init__(name="rollup-compactor", daemon=True)
+        self.root = root
+        self.retention_days = retention_days
+        self.interval_sec = interval_sec
+        self.grace_sec = grace_sec
+        self.store = tsstore.TimeSeriesStore(root, dtypes=ROLLUP_DTYPES,
+                                             segment_formats=ROLLUP_SEGMENT_FORMATS)
+        self.reader = tsstore.TimeSeriesReader(root, dtypes=ALL_DTYPES)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.compact(time.time())
+            except Exception as e:
+                logger.error(f"Failed to compact monitoring data: {e}")
+            self._stop_event.wait(self.interval_sec)
+        self.store.close()
+
+    def compact(self, now):
+        """now までに完了した期間をロールアップし、古いセグメントを削除します。"""
+        for stream in tsstore.STREAM_DTYPES:
+            rolled_until = {}
+            for level, width, source_level, _ in LEVELS:
+                source = stream if source_level is None else f"{stream}_{source_level}"
+                target = f"{stream}_{level}"
+                start = self._next_start(target, source, width)
+                end = np.floor((now - self.grace_sec) / width) * width
+                if source_level is not None:
+                    end = min(end, rolled_until[source_level])
+                if start is not None and start < end:
+                    records = rollup(stream, self.reader.query(source, start, end), width)
+                    self.store.append_array(target, records)
+                    self.store.flush()
+                    logger.debug(f"Rolled up {len(records)} records into {target}")
+                rolled_until[level] = end
+            # 次の段階の元になるデータ (生データと1分の集計) は、ロールアップが済んだ期間より前のものだけを消す
+            consumers = {source_level or "raw": level for level, _, source_level, _ in LEVELS}
+            for level in ("raw",) + tuple(level for level, _, _, _ in LEVELS):
+                target = stream if level == "raw" else f"{stream}_{level}"
+                consumer = consumers.get(level)
+                self._drop(level, target, now, until=rolled_until[consumer] if consumer else None)
+
+    def _next_start(self, target, source, width):
+        """target にまだ集計していない最初の期間の開始時刻 (元データが無ければ None)"""
+        for name in reversed(tsstore.list_segments(self.root, target)):
+            records = tsstore.open_segment(os.path.join(self.root, target, f"{name}.seg"))
+            if len(records):
+                return float(records["ts"][-1]) + width
+        for name in tsstore.list_segments(self.root, source):
+            records = tsstore.open_segment(os.path.join(self.root, source, f"{name}.seg"))
+            if len(records):
+                return float(np.floor(records["ts"][0] / width) * width)
+        return None
+
+    def _drop(self, level, target, now, until=None):
+        cutoff = now - self.retention_days[level] * 86400
+        if until is not None:
+            cutoff = min(cutoff, until)
+        dropped = self.store.drop_before(target, cutoff)
+        if dropped:
+            logger.info(f"Deleted {dropped} old segments of {target}")
+
+
+def _parse_time(s):
+    return datetime.datetime.fromisoformat(s).timestamp() if s else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize rolled-up monitoring data")
+    parser.add_argument("--root", default="./monitoring_ts", help="ストアのルートディレクトリ")
+    parser.add_argument("--stream", default="second", choices=sorted(tsstore.STREAM_DTYPES))
+    parser.add_argument("--level", default="1h", choices=[level for level, _, _, _ in LEVELS])
+    parser.add_argument("--field", default="avg_latency_ms")
+    parser.add_argument("--from", dest="t0", default=None, help="開始時刻 (ISO 8601)")
+    parser.add_argument("--to", dest="t1", default=None, help="終了時刻 (ISO 8601)")
+    parser.add_argument("--prefix", default=None, help="プレフィックス (content のみ)")
+    args = parser.parse_args(argv)
+
+    reader = tsstore.TimeSeriesReader(args.root, dtypes=ALL_DTYPES)
+    records = reader.query(f"{args.stream}_{args.level}", _parse_time(args.t0),
+                           _parse_time(args.t1), args.prefix)
+    if len(records) == 0:
+        print("No records.")
+        return 0
+    summary = summarize(records, args.field)
+    print(f"{args.field}: " + " ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                                       for k, v in summary.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
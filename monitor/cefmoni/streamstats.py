@@ -0,0 +1,168 @@
+"""
+定数メモリで更新できるストリーミング統計。
+
+いずれのクラスも値を1つずつ受け取って O(1) で更新し、過去の値を保持しません。
+監視対象のプレフィックスがいくつあっても、1つあたりのメモリ使用量は一定です。
+"""
+import math
+
+
+class Ewma:
+    """指数加重移動平均。最初の値でそのまま初期化します。"""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.value = 0.0
+        self.initialized = False
+
+    def update(self, x):
+        if self.initialized:
+            self.value += self.alpha * (x - self.value)
+        else:
+            self.value = x
+            self.initialized = True
+        return self.value
+
+
+class Rfc3550Jitter:
+    """
+    RFC 3550 (RTP) の到着間ジッター。
+
+    連続する2パケットの転送時間 (ここではInterest送信からData受信までの遅延) の
+    差の絶対値を、ゲイン 1/16 で平滑化します。
+    """
+
+    def __init__(self, gain=1.0 / 16):
+        self.gain = gain
+        self.value = 0.0
+        self._last_transit = None
+
+    def update(self, transit):
+        if self._last_transit is not None:
+            d = abs(transit - self._last_transit)
+            self.value += (d - self.value) * self.gain
+        self._last_transit = transit
+        return self.value
+
+
+class P2Quantile:
+    """
+    P² アルゴリズム (Jain and Chlamtac, 1985) による分位点 p の推定。
+    5つのマーカーだけを保持します。5件目までは正確な値を返します。
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self._q = []  # マーカーの高さ
+        self._n = [0, 1, 2, 3, 4]  # マーカーの位置
+        self._np = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]  # マーカーの理想的な位置
+        self._dn = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def update(self, x):
+        self.count += 1
+        q = self._q
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        n = self._n
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._np[i] += self._dn[i]
+        for i in (1, 2, 3):
+            d = self._np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self._q, self._n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    @property
+    def value(self):
+        if self.count == 0:
+            return 0.0
+        if self.count <= 5:
+            return self._q[min(int(round(self.p * (self.count - 1))), self.count - 1)]
+        return self._q[2]
+
+
+class RateCounter:
+    """
+    直近 window_sec 秒間の件数とバイト数のレート。
+
+    窓を n_buckets 個の固定幅のバケットに分けた環状バッファで数えるため、
+    メモリ使用量は件数によらず一定です。
+    """
+
+    def __init__(self, window_sec=1.0, n_buckets=10):
+        self.window_sec = window_sec
+        self.n_buckets = n_buckets
+        self.bucket_sec = window_sec / n_buckets
+        self._slots = [None] * n_buckets  # 各バケットが表す時間帯の番号
+        self._counts = [0] * n_buckets
+        self._bytes = [0] * n_buckets
+
+    def add(self, now, nbytes=0, count=1):
+        slot = int(now / self.bucket_sec)
+        i = slot % self.n_buckets
+        if self._slots[i] != slot:
+            self._slots[i] = slot
+            self._counts[i] = 0
+            self._bytes[i] = 0
+        self._counts[i] += count
+        self._bytes[i] += nbytes
+
+    def rates(self, now):
+        """直近の窓での (件数/秒, バイト/秒) を返します。"""
+        cur = int(now / self.bucket_sec)
+        count = nbytes = 0
+        for i in range(self.n_buckets):
+            slot = self._slots[i]
+            if slot is not None and cur - self.n_buckets < slot <= cur:
+                count += self._counts[i]
+                nbytes += self._bytes[i]
+        return count / self.window_sec, nbytes / self.window_sec
+
+
+class LatencyStats:
+    """遅延の件数・平均・最小・最大・EWMA・ジッター・p50/p99 をまとめて更新します。"""
+
+    def __init__(self, ewma_alpha=0.1):
+        self.count = 0
+        self.mean = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.ewma = Ewma(ewma_alpha)
+        self.jitter = Rfc3550Jitter()
+        self.p50 = P2Quantile(0.5)
+        self.p99 = P2Quantile(0.99)
+
+    def update(self, latency):
+        self.count += 1
+        self.mean += (latency - self.mean) / self.count
+        self.min = min(self.min, latency)
+        self.max = max(self.max, latency)
+        self.ewma.update(latency)
+        self.jitter.update(latency)
+        self.p50.update(latency)
+        self.p99.update(latency)
@@ -0,0 +1,335 @@
+"""
+複数のプレフィックスを複数のワーカープロセスに分担させて監視します。
+
+プレフィックスは名前順に並べて順番にワーカーに割り当て (各ワーカーの担当数の差は
+高々1つ)、各ワーカーは自分の
+CefpycoHandle でそのプレフィックスだけを登録して受信します (プローブを有効にすると
+Interestも自分で送信し、遅延を測ります)。ワーカーは ship_interval_sec ごとに
+プレフィックスごとの差分 (件数・バイト数・遅延の和と最大値・遅延のスケッチ) だけを
+キューで送り、集約プロセスがそれを足し合わせて、daily_store.py と同じ形式の
+時系列ストア ("second" ストリーム) と1時間ごとの <HH>_prefixes.csv に書き込みます。
+ロールアップと保持期間を過ぎた記録の削除も daily_store.py と同じように行います。
+ワーカー同士は何も共有しないため、処理能力はおおむねコア数に比例します。
+
+使い方:
+  python supervisor.py --prefix /iot --prefix /video --workers 4
+  python supervisor.py --prefixes-file prefixes.txt --probe-interval 0.1
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import logging
+import argparse
+import datetime
+import multiprocessing as mp
+from interest_table import InterestTable
+from prefix_trie import PrefixTrie
+from record_writer import RecordWriter, delete_old_records, get_current_filename_prefix
+from rollup import SKETCH_BUCKETS, Compactor, sketch_bucket, sketch_quantiles
+from streamstats import Rfc3550Jitter
+from tsstore import TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+# 差分のタプルの並び (ワーカー -> 集約プロセス)
+DELTA_FIELDS = ("interests", "interest_bytes", "data", "data_bytes", "nacks",
+                "latency_count", "latency_sum_ms", "latency_max_ms")
+
+
+def shard_prefixes(prefixes, n_workers):
+    """
+    プレフィックスを名前順に並べ、ワーカーに順番に割り当てます。
+    監視するプレフィックスは起動時にすべて分かっているので、ハッシュで散らすより
+    担当数がそろい、プレフィックスがワーカー数以上あれば空のワーカーもできません。
+    """
+    shards = [[] for _ in range(n_workers)]
+    for i, prefix in enumerate(sorted(prefixes)):
+        shards[i % n_workers].append(prefix)
+    return shards
+
+
+# --- ワーカープロセス ---
+
+class _PrefixDelta:
+    __slots__ = DELTA_FIELDS + ("sketch", "jitter")
+
+    def __init__(self):
+        self.jitter = Rfc3550Jitter()
+        self.reset()
+
+    def reset(self):
+        self.interests = 0
+        self.interest_bytes = 0
+        self.data = 0
+        self.data_bytes = 0
+        self.nacks = 0
+        self.latency_count = 0
+        self.latency_sum_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.sketch = {}  # key: バケット番号, value: 件数 (疎な表現)
+
+    def add_latency(self, latency_ms):
+        self.latency_count += 1
+        self.latency_sum_ms += latency_ms
+        if latency_ms > self.latency_max_ms:
+            self.latency_max_ms = latency_ms
+        b = sketch_bucket(latency_ms)
+        self.sketch[b] = self.sketch.get(b, 0) + 1
+        self.jitter.update(latency_ms)
+
+    def pack(self):
+        return (tuple(getattr(self, f) for f in DELTA_FIELDS), self.sketch, self.jitter.value)
+
+
+def _content_prefix(name, prefixes):
+    """name が属する監視対象のプレフィックス (最長一致) を返します。"""
+    best = None
+    for prefix in prefixes:
+        if (name == prefix or name.startswith(prefix + "/")) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return best
+
+
+def worker_main(worker_id, prefixes, out_queue, stop_event, args):
+    """1つのワーカープロセスの本体"""
+    import cefpyco  # 使うのはワーカーだけなので、集約プロセスでは読み込まない
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker{worker_id} - %(levelname)s - %(message)s')
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 終了は stop_event で受け取る
+    deltas = {prefix: _PrefixDelta() for prefix in prefixes}
+    table = InterestTable(capacity=args.interest_table_capacity,
+                          lifetime_sec=args.interest_lifetime_ms / 1000)
+    segments = {prefix: 0 for prefix in prefixes}
+    reported_timeouts = 0
+
+    with cefpyco.CefpycoHandle() as handle:
+        handle.set_log_level(args.cefpyco_log_level)
+        for prefix in prefixes:
+            handle.register(prefix)
+        logger.info(f"Monitoring {len(prefixes)} prefixes: {', '.join(prefixes)}")
+
+        next_ship = time.monotonic() + args.ship_interval_sec
+        next_probe = time.monotonic()
+        while not stop_event.is_set():
+            if args.probe_interval_sec > 0 and time.monotonic() >= next_probe:
+                now = time.time()
+                for prefix in prefixes:
+                    uri = f"{prefix}/s={segments[prefix]}"
+                    try:
+                        handle.send_interest(uri, lifetime=args.interest_lifetime_ms)
+                    except Exception as e:
+                        logger.error(f"Failed to send Interest: {e}")
+                        continue
+                    table.add(uri, now=now)
+                    d = deltas[prefix]
+                    d.interests += 1
+                    d.interest_bytes += len(uri.encode('utf-8'))
+                    segments[prefix] += 1
+                next_probe += args.probe_interval_sec
+
+            info = handle.receive(timeout_ms=args.receive_timeout_ms)
+            if info.is_succeeded and (info.is_data or info.is_nack):
+                prefix = _content_prefix(info.name, prefixes)
+                if prefix is not None:
+                    d = deltas[prefix]
+                    if info.is_data:
+                        d.data += 1
+                        d.data_bytes += info.payload_len
+                        send_time = table.match(info.name, info.chunk_num)
+                        if send_time is not None:
+                            d.add_latency((time.time() - send_time) * 1000)
+                    else:
+                        d.nacks += 1
+                        table.remove(info.name, info.chunk_num)
+
+            if time.monotonic() >= next_ship:
+                table.expire()
+                payload = {p: d.pack() for p, d in deltas.items() if d.interests or d.data or d.nacks}
+                try:
+                    out_queue.put_nowait((worker_id, payload, table.timeouts - reported_timeouts))
+                    reported_timeouts = table.timeouts
+                    for d in deltas.values():
+                        d.reset()
+                except queue.Full:
+                    pass  # 集約プロセスが追いつかない間は差分を溜めておく
+                next_ship = time.monotonic() + args.ship_interval_sec
+
+
+# --- 集約プロセス ---
+
+class Aggregator:
+    """ワーカーからの差分を足し合わせ、1秒ごとと1時間ごとに書き出します。"""
+
+    def __init__(self, ts_store, record_writer, trie, bandwidth_mbps=1000):
+        self.ts_store = ts_store
+        self.record_writer = record_writer
+        self.trie = trie
+        self.bandwidth_mbps = bandwidth_mbps
+        self.totals = dict.fromkeys(("interest_sent_count", "interest_sent_bytes",
+                                     "data_received_count", "data_received_bytes",
+                                     "interest_timeout_count"), 0)
+        self._reset_window()
+
+    def _reset_window(self):
+        self.jitters = {}  # key: プレフィックス, value: (ジッター, 遅延の件数)
+        self.window_data = 0
+        self.window_bytes = 0
+        self.window_latency_count = 0
+        self.window_latency_sum = 0.0
+        self.window_sketch = [0] * SKETCH_BUCKETS
+
+    def merge(self, payload, timeouts):
+        self.totals["interest_timeout_count"] += timeouts
+        for prefix, (counts, sketch, jitter) in payload.items():
+            c = dict(zip(DELTA_FIELDS, counts))
+            self.totals["interest_sent_count"] += c["interests"]
+            self.totals["interest_sent_bytes"] += c["interest_bytes"]
+            self.totals["data_received_count"] += c["data"]
+            self.totals["data_received_bytes"] += c["data_bytes"]
+            self.window_data += c["data"]
+            self.window_bytes += c["data_bytes"]
+            self.window_latency_count += c["latency_count"]
+            self.window_latency_sum += c["latency_sum_ms"]
+            for b, n in sketch.items():
+                self.window_sketch[b] += n
+            if c["latency_count"]:
+                self.jitters[prefix] = (jitter, c["latency_count"])
+            self.trie.merge(prefix, **c)
+
+    def write_second(self, now, elapsed):
+        """直近 elapsed 秒間の統計を時系列ストアの "second" ストリームに追記します。"""
+        record = dict(self.totals)
+        record["data_receive_rate_bps"] = self.window_bytes * 8 / elapsed
+        record["data_receive_rate_pps"] = self.window_data / elapsed
+        record["bandwidth_usage_percent"] = min(
+            record["data_receive_rate_bps"] / (self.bandwidth_mbps * 1_000_000) * 100, 100.0)
+        if self.window_latency_count:
+            record["avg_latency_ms"] = self.window_latency_sum / self.window_latency_count
+            record["p50_latency_ms"], record["p99_latency_ms"] = sketch_quantiles(self.window_sketch, (0.5, 0.99))
+        if self.jitters:
+            weight = sum(n for _, n in self.jitters.values())
+            record["jitter_ms"] = sum(j * n for j, n in self.jitters.values()) / weight
+        self.record_writer.call(self.ts_store.append, "second", now, record)
+        self._reset_window()
+        return record
+
+    def write_hour(self, hour_end):
+        """名前の階層ごとの統計を、終わった時間帯の <HH>_prefixes.csv に書き込みます。"""
+        for record in self.trie.records():
+            self.record_writer.append(record, suffix="_prefixes", ts=hour_end)
+        self.trie.reset()
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(args, prefixes):
+    n_workers = min(args.workers, len(prefixes))
+    shards = shard_prefixes(prefixes, n_workers)
+    ctx = mp.get_context("spawn")  # Cefpycoのハンドルを親から引き継がないように
+    out_queue = ctx.Queue(maxsize=args.queue_size)
+    stop_event = ctx.Event()
+    workers = [ctx.Process(target=worker_main, args=(i, shard, out_queue, stop_event, args),
+                           name=f"cefmoni-worker{i}", daemon=True)
+               for i, shard in enumerate(shards) if shard]
+    for w in workers:
+        w.start()
+    logger.info(f"Started {len(workers)} workers for {len(prefixes)} prefixes")
+
+    record_writer = RecordWriter(lambda now=None: get_current_filename_prefix(args.monitoring_dir, now))
+    record_writer.start()
+    ts_store = TimeSeriesStore(args.ts_store_dir)
+    # 1分・1時間ごとの集計と、保持期間を過ぎたデータの削除を行うスレッドを起動
+    compactor = Compactor(args.ts_store_dir,
+                          {"raw": args.data_retention_days,
+                           "1m": args.rollup_1m_retention_days,
+                           "1h": args.rollup_1h_retention_days},
+                          interval_sec=args.rollup_interval_sec)
+    compactor.start()
+    record_writer.call(delete_old_records, args.monitoring_dir, args.data_retention_days)
+    aggregator = Aggregator(ts_store, record_writer,
+                            PrefixTrie(max_depth=args.trie_max_depth, max_nodes=args.trie_max_nodes))
+
+    signal.signal(signal.SIGTERM, _terminate)  # SIGTERM でも書き切ってから終了する
+    last_tick = time.time()
+    last_hour = datetime.datetime.now().hour
+    try:
+        while True:
+            timeout = max(0.0, last_tick + 1.0 - time.time())
+            try:
+                _, payload, timeouts = out_queue.get(timeout=timeout)
+                aggregator.merge(payload, timeouts)
+            except queue.Empty:
+                pass
+            now = time.time()
+            if now - last_tick >= 1.0:
+                aggregator.write_second(now, now - last_tick)
+                last_tick = now
+                current = datetime.datetime.fromtimestamp(now)
+                if current.hour != last_hour:
+                    hour_end = current.replace(minute=0, second=0, microsecond=0).timestamp() - 0.001
+                    aggregator.write_hour(hour_end)
+                    last_hour = current.hour
+                    record_writer.call(delete_old_records, args.monitoring_dir, args.data_retention_days)
+                dead = [w.name for w in workers if not w.is_alive()]
+                if dead:
+                    logger.error(f"Workers exited unexpectedly: {', '.join(dead)}")
+                    break
+    except KeyboardInterrupt:
+        logger.info("Supervisor stopped.")
+    finally:
+        stop_event.set()
+        for w in workers:
+            w.join(timeout=5)
+            if w.is_alive():
+                w.terminate()
+        compactor.stop()
+        record_writer.call(ts_store.close)
+        record_writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded multi-prefix monitor")
+    parser.add_argument("--prefix", action="append", default=[], help="監視するプレフィックス (複数指定可)")
+    parser.add_argument("--prefixes-file", default=None, help="1行に1つプレフィックスを書いたファイル")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    parser.add_argument("--probe-interval", dest="probe_interval_sec", type=float, default=0.0,
+                        help="各プレフィックスにInterestを送る間隔 (秒, 0: 送らない)")
+    parser.add_argument("--ship-interval", dest="ship_interval_sec", type=float, default=0.5,
+                        help="ワーカーが差分を送る間隔 (秒)")
+    parser.add_argument("--receive-timeout-ms", type=int, default=10)
+    parser.add_argument("--interest-lifetime-ms", type=int, default=4000)
+    parser.add_argument("--interest-table-capacity", type=int, default=65536)
+    parser.add_argument("--queue-size", type=int, default=1024, help="集約待ちにできる差分の数")
+    parser.add_argument("--trie-max-depth", type=int, default=4)
+    parser.add_argument("--trie-max-nodes", type=int, default=10000)
+    parser.add_argument("--cefpyco-log-level", type=int, default=1)
+    parser.add_argument("--monitoring-dir", default="./monitoring")
+    parser.add_argument("--ts-store-dir", default="./monitoring_ts")
+    parser.add_argument("--data-retention-days", type=int, default=3,
+                        help="生データ (CSVと毎秒の記録) を保持する日数")
+    parser.add_argument("--rollup-1m-retention-days", type=int, default=28, help="1分ごとの集計を保持する日数")
+    parser.add_argument("--rollup-1h-retention-days", type=int, default=365, help="1時間ごとの集計を保持する日数")
+    parser.add_argument("--rollup-interval", dest="rollup_interval_sec", type=float, default=60,
+                        help="集計と古いデータの削除を行う間隔 (秒)")
+    args = parser.parse_args(argv)
+
+    prefixes = list(args.prefix)
+    if args.prefixes_file:
+        with open(args.prefixes_file) as f:
+            prefixes += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    prefixes = sorted(set(p.rstrip("/") for p in prefixes))
+    if not prefixes:
+        parser.error("no prefixes to monitor")
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - supervisor - %(levelname)s - %(message)s')
+    run(args, prefixes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
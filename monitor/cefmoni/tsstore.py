@@ -0,0 +1,419 @@
+"""
+監視データの追記専用バイナリ時系列ストア。
+
+ストリーム ("second": 毎秒の current_stats, "content": コンテンツごとの統計) ごとに、
+1時間ごとのセグメントファイルへ固定長レコードを追記します。
+
+  <root>/<stream>/<YYYYmmddHH>.seg  ヘッダー + レコード列 (NumPy構造化配列と同じ並び)
+  <root>/<stream>/<YYYYmmddHH>.idx  INDEX_STRIDE レコードごとの (時刻, レコード番号)
+  <root>/prefixes.tsv               プレフィックスID と名前の対応表 (追記のみ)
+
+セグメントのヘッダーにはレコードのdtypeが記録されているため、リーダーは
+スキーマを知らなくても読めます。スキーマに項目を追加した後も古いセグメントはそのまま読め、
+検索結果では追加した項目が0になります。リーダーはセグメントをメモリマップし、
+時刻範囲とプレフィックスで絞り込んだ結果をNumPy配列として返します。
+
+使い方 (コマンドライン):
+  python tsstore.py summary --stream content --field avg_latency_ms --prefix /iot \\
+      --from 2024-01-01T02:00 --to 2024-01-01T05:00
+  python tsstore.py export --stream second --from 2024-01-01T00:00 out.csv
+"""
+import os
+import csv
+import sys
+import json
+import time
+import struct
+import argparse
+import datetime
+import numpy as np
+
+MAGIC = b"CMTS"
+VERSION = 1
+_HEADER_FIXED = struct.Struct("<4sHHI")  # magic, version, reserved, header_len
+INDEX_DTYPE = np.dtype([("ts", "<f8"), ("rec", "<u8")])
+INDEX_STRIDE = 64  # 時刻索引に1件追加するレコード間隔
+# セグメントの長さごとのファイル名の書式 (リーダーは名前の長さから期間を判断する)
+SEGMENT_HOUR = "%Y%m%d%H"
+SEGMENT_DAY = "%Y%m%d"
+SEGMENT_MONTH = "%Y%m"
+
+# --- ストリームのスキーマ ---
+SECOND_DTYPE = np.dtype([
+    ("ts", "<f8"),
+    ("interest_sent_count", "<u8"),
+    ("interest_sent_bytes", "<u8"),
+    ("data_received_count", "<u8"),
+    ("data_received_bytes", "<u8"),
+    ("data_receive_rate_bps", "<f8"),
+    ("data_receive_rate_pps", "<f8"),
+    ("avg_latency_ms", "<f8"),
+    ("p50_latency_ms", "<f8"),
+    ("p99_latency_ms", "<f8"),
+    ("jitter_ms", "<f8"),
+    ("bandwidth_usage_percent", "<f8"),
+    ("interest_timeout_count", "<u8"),
+])
+CONTENT_DTYPE = np.dtype([
+    ("ts", "<f8"),  # 記録時刻 (end_time)
+    ("prefix_id", "<u4"),
+    ("start_time", "<f8"),
+    ("total_interest_sent_count", "<u8"),
+    ("total_interest_sent_bytes", "<u8"),
+    ("total_data_received_count", "<u8"),
+    ("total_data_received_bytes", "<u8"),
+    ("content_delivery_time_ms", "<f8"),
+    ("avg_data_rate_bps", "<f8"),
+    ("avg_latency_ms", "<f8"),
+    ("p50_latency_ms", "<f8"),
+    ("p99_latency_ms", "<f8"),
+    ("jitter_ms", "<f8"),
+])
+STREAM_DTYPES = {"second": SECOND_DTYPE, "content": CONTENT_DTYPE}
+
+
+def _segment_range(name):
+    """セグメント名 (YYYYmmddHH, YYYYmmdd, YYYYmm) が表す期間 [開始, 終了) を返します。"""
+    fmt = {10: SEGMENT_HOUR, 8: SEGMENT_DAY, 6: SEGMENT_MONTH}[len(name)]
+    start = datetime.datetime.strptime(name, fmt)
+    if fmt == SEGMENT_HOUR:
+        end = start + datetime.timedelta(hours=1)
+    elif fmt == SEGMENT_DAY:
+        end = start + datetime.timedelta(days=1)
+    else:
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+def _descr_to_dtype(descr):
+    return np.dtype([tuple(f) for f in descr])
+
+
+def conform(records, dtype):
+    """古いスキーマの records を dtype に合わせます (dtype にだけある項目は0)。"""
+    if records.dtype == dtype:
+        return records
+    out = np.zeros(len(records), dtype=dtype)
+    for name in dtype.names:
+        if name in records.dtype.names:
+            out[name] = records[name]
+    return out
+
+
+def _header_bytes(stream, dtype):
+    meta = json.dumps({"stream": stream, "dtype": dtype.descr}).encode()
+    header_len = _HEADER_FIXED.size + len(meta)
+    header_len += -header_len % 8
+    return _HEADER_FIXED.pack(MAGIC, VERSION, 0, header_len) + meta.ljust(header_len - _HEADER_FIXED.size, b" ")
+
+
+class PrefixTable:
+    """プレフィックス名と数値IDの対応表 (追記専用のテキストファイル)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = {}
+        self.names = []
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    pid, name = line.rstrip("\n").split("\t", 1)
+                    self.ids[name] = int(pid)
+                    self.names.append(name)
+
+    def get_id(self, name):
+        pid = self.ids.get(name)
+        if pid is None:
+            pid = len(self.names)
+            self.ids[name] = pid
+            self.names.append(name)
+            with open(self.path, "a") as f:
+                f.write(f"{pid}\t{name}\n")
+        return pid
+
+    def ids_under(self, prefix):
+        """prefix 自身とその配下の名前のIDを返します。"""
+        base = prefix.rstrip("/")
+        return [pid for name, pid in self.ids.items()
+                if name == base or name.startswith(base + "/")]
+
+
+class _SegmentWriter:
+    def __init__(self, path, stream, dtype):
+        self.dtype = dtype
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            with open(path, "rb") as f:
+                header_len, file_dtype = _read_header(f)
+            if file_dtype != dtype:
+                # スキーマが変わった後に書きかけのセグメントに追記する場合は、新しいスキーマで書き直す
+                # (レコード番号は変わらないので時刻索引はそのまま使える)
+                records = conform(np.array(open_segment(path)), dtype)
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(_header_bytes(stream, dtype))
+                    f.write(records.tobytes())
+                os.replace(tmp, path)
+                with open(path, "rb") as f:
+                    header_len, file_dtype = _read_header(f)
+            n_records = (os.path.getsize(path) - header_len) // dtype.itemsize
+            # 書き込み途中で止まった場合の半端なレコードを切り捨てる
+            os.truncate(path, header_len + n_records * dtype.itemsize)
+        self.f = open(path, "ab")
+        self.idx = open(path[:-4] + ".idx", "ab")
+        if new:
+            self.f.write(_header_bytes(stream, dtype))
+            n_records = 0
+        self.n_records = n_records
+        self._buf = np.zeros(1, dtype=dtype)
+
+    def append(self, values):
+        self._buf[0] = values
+        self.append_array(self._buf)
+
+    def append_array(self, records):
+        first = -self.n_records % INDEX_STRIDE
+        rows = np.arange(first, len(records), INDEX_STRIDE)
+        if len(rows):
+            index = np.zeros(len(rows), dtype=INDEX_DTYPE)
+            index["ts"] = records["ts"][rows]
+            index["rec"] = rows + self.n_records
+            self.idx.write(index.tobytes())
+        self.f.write(records.tobytes())
+        self.n_records += len(records)
+
+    def flush(self):
+        self.f.flush()
+        self.idx.flush()
+
+    def close(self):
+        self.f.close()
+        self.idx.close()
+
+
+class TimeSeriesStore:
+    """
+    ストリームへのレコードの追記を行います。
+
+    レコードは時刻順に追記されることを前提とします (リーダーの範囲検索が
+    時刻索引の二分探索を使うため)。ファイルへの書き出しは flush_interval_sec
+    ごとにまとめて行います。
+
+    dtypes はストリーム名からスキーマへの辞書、segment_formats はストリームごとの
+    セグメントの長さ (SEGMENT_HOUR など。指定の無いストリームは1時間) です。
+    """
+
+    def __init__(self, root, flush_interval_sec=5.0, dtypes=STREAM_DTYPES, segment_formats=None):
+        self.root = root
+        self.flush_interval_sec = flush_interval_sec
+        self.dtypes = dtypes
+        self.segment_formats = segment_formats or {}
+        os.makedirs(root, exist_ok=True)
+        self.prefixes = PrefixTable(os.path.join(root, "prefixes.tsv"))
+        self._segments = {}  # key: stream, value: (segment name, _SegmentWriter)
+        self._last_flush = time.monotonic()
+
+    def append(self, stream, ts, record, prefix=None):
+        """record (辞書) のうちストリームのスキーマにある項目を ts の時刻で追記します。"""
+        dtype = self.dtypes[stream]
+        values = []
+        for name in dtype.names:
+            if name == "ts":
+                values.append(ts)
+            elif name == "prefix_id":
+                values.append(self.prefixes.get_id(prefix or ""))
+            else:
+                values.append(record.get(name) or 0)
+        self._writer(stream, ts).append(tuple(values))
+        self._maybe_flush()
+
+    def append_array(self, stream, records):
+        """スキーマどおりの構造化配列 records (時刻順) をまとめて追記します。"""
+        if len(records) == 0:
+            return
+        records = np.asarray(records, dtype=self.dtypes[stream])
+        fmt = self.segment_formats.get(stream, SEGMENT_HOUR)
+        names = np.array([time.strftime(fmt, time.localtime(t)) for t in records["ts"]])
+        bounds = np.flatnonzero(names[1:] != names[:-1]) + 1
+        for part in np.split(records, bounds):
+            self._writer(stream, part["ts"][0]).append_array(part)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval_sec:
+            self.flush()
+
+    def _writer(self, stream, ts):
+        fmt = self.segment_formats.get(stream, SEGMENT_HOUR)
+        name = time.strftime(fmt, time.localtime(ts))
+        current = self._segments.get(stream)
+        if current is not None and current[0] == name:
+            return current[1]
+        if current is not None:
+            current[1].close()
+        stream_dir = os.path.join(self.root, stream)
+        os.makedirs(stream_dir, exist_ok=True)
+        writer = _SegmentWriter(os.path.join(stream_dir, f"{name}.seg"), stream, self.dtypes[stream])
+        self._segments[stream] = (name, writer)
+        return writer
+
+    def flush(self):
+        for _, writer in self._segments.values():
+            writer.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        for _, writer in self._segments.values():
+            writer.close()
+        self._segments = {}
+
+    def drop_before(self, stream, cutoff_ts):
+        """cutoff_ts より前に終わるセグメントを削除し、削除した数を返します。"""
+        dropped = 0
+        for name in list_segments(self.root, stream):
+            if _segment_range(name)[1] <= cutoff_ts:
+                current = self._segments.get(stream)
+                if current is not None and current[0] == name:
+                    continue
+                base = os.path.join(self.root, stream, name)
+                for ext in (".seg", ".idx"):
+                    if os.path.exists(base + ext):
+                        os.remove(base + ext)
+                dropped += 1
+        return dropped
+
+
+def _read_header(f):
+    magic, version, _, header_len = _HEADER_FIXED.unpack(f.read(_HEADER_FIXED.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a monitoring segment file")
+    meta = json.loads(f.read(header_len - _HEADER_FIXED.size))
+    return header_len, _descr_to_dtype(meta["dtype"])
+
+
+def list_segments(root, stream):
+    """ストリームのセグメント名を時刻順に返します。"""
+    stream_dir = os.path.join(root, stream)
+    if not os.path.isdir(stream_dir):
+        return []
+    return sorted(n[:-4] for n in os.listdir(stream_dir) if n.endswith(".seg"))
+
+
+def open_segment(path):
+    """セグメントをメモリマップした構造化配列として返します (レコードが無ければ空配列)。"""
+    with open(path, "rb") as f:
+        header_len, dtype = _read_header(f)
+    n = (os.path.getsize(path) - header_len) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=header_len, shape=(n,))
+
+
+class TimeSeriesReader:
+    """ストアからの範囲検索とCSVへの書き出しを行います。"""
+
+    def __init__(self, root, dtypes=STREAM_DTYPES):
+        self.root = root
+        self.dtypes = dtypes
+        self.prefixes = PrefixTable(os.path.join(root, "prefixes.tsv"))
+
+    def query(self, stream, t0=None, t1=None, prefix=None):
+        """
+        t0 <= ts < t1 のレコードを構造化配列で返します。
+        prefix を指定すると、そのプレフィックスとその配下の名前のレコードに絞り込みます。
+        """
+        t0 = -np.inf if t0 is None else t0
+        t1 = np.inf if t1 is None else t1
+        ids = None
+        if prefix is not None:
+            ids = np.array(self.prefixes.ids_under(prefix), dtype="<u4")
+        parts = []
+        for name in list_segments(self.root, stream):
+            start, end = _segment_range(name)
+            if end <= t0 or start >= t1:
+                continue
+            base = os.path.join(self.root, stream, name)
+            records = open_segment(base + ".seg")
+            if len(records) == 0:
+                continue
+            lo, hi = self._narrow(base + ".idx", len(records), t0, t1)
+            records = records[lo:hi]
+            ts = records["ts"]
+            mask = (ts >= t0) & (ts < t1)
+            if ids is not None:
+                mask &= np.isin(records["prefix_id"], ids)
+            parts.append(conform(np.asarray(records[mask]), self.dtypes.get(stream, records.dtype)))
+        if not parts:
+            return np.zeros(0, dtype=self.dtypes.get(stream, INDEX_DTYPE))
+        return np.concatenate(parts)
+
+    @staticmethod
+    def _narrow(idx_path, n, t0, t1):
+        """時刻索引から t0..t1 を含むレコード番号の範囲を求めます。"""
+        if not os.path.exists(idx_path):
+            return 0, n
+        index = np.fromfile(idx_path, dtype=INDEX_DTYPE)
+        if len(index) == 0:
+            return 0, n
+        i = np.searchsorted(index["ts"], t0, side="right") - 1
+        j = np.searchsorted(index["ts"], t1, side="left")
+        lo = int(index["rec"][i]) if i >= 0 else 0
+        hi = int(index["rec"][j]) if j < len(index) else n
+        return lo, min(hi, n)
+
+    def export_csv(self, stream, path, t0=None, t1=None, prefix=None):
+        """検索結果をCSVに書き出します (prefix_id はプレフィックス名に置き換えます)。"""
+        records = self.query(stream, t0, t1, prefix)
+        names = list(records.dtype.names)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["timestamp" if n == "ts" else "prefix" if n == "prefix_id" else n
+                             for n in names])
+            for r in records.tolist():
+                row = list(r)
+                row[0] = datetime.datetime.fromtimestamp(row[0]).isoformat()
+                if "prefix_id" in names:
+                    i = names.index("prefix_id")
+                    row[i] = self.prefixes.names[row[i]]
+                writer.writerow(row)
+        return len(records)
+
+
+def _parse_time(s):
+    return datetime.datetime.fromisoformat(s).timestamp() if s else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monitoring time-series store")
+    parser.add_argument("--root", default="./monitoring_ts", help="ストアのルートディレクトリ")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("summary", "export"):
+        p = sub.add_parser(name)
+        p.add_argument("--stream", default="content", choices=sorted(STREAM_DTYPES))
+        p.add_argument("--from", dest="t0", default=None, help="開始時刻 (ISO 8601)")
+        p.add_argument("--to", dest="t1", default=None, help="終了時刻 (ISO 8601)")
+        p.add_argument("--prefix", default=None, help="プレフィックス (配下の名前を含む)")
+        if name == "summary":
+            p.add_argument("--field", default="avg_latency_ms")
+        else:
+            p.add_argument("output")
+    args = parser.parse_args(argv)
+
+    reader = TimeSeriesReader(args.root)
+    t0, t1 = _parse_time(args.t0), _parse_time(args.t1)
+    if args.command == "export":
+        n = reader.export_csv(args.stream, args.output, t0, t1, args.prefix)
+        print(f"Exported {n} records to {args.output}")
+        return 0
+    values = reader.query(args.stream, t0, t1, args.prefix)[args.field].astype(float)
+    if len(values) == 0:
+        print("No records.")
+        return 0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    print(f"{args.field}: count={len(values)} mean={values.mean():.3f} p50={p50:.3f} "
+          f"p95={p95:.3f} p99={p99:.3f} max={values.max():.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
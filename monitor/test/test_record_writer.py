@@ -0,0 +1,65 @@
+# record_writer.py の RecordWriter (時間帯ごとのファイルへの書き込み) のテスト
+
+import os
+import sys
+import csv
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefmoni"))
+
+import record_writer
+from record_writer import RecordWriter, get_current_filename_prefix
+
+HOUR_END = datetime.datetime(2024, 1, 1, 11, 0).timestamp()
+
+def make_writer(tmp_path, monkeypatch):
+    """ファイルを開いた回数を数える RecordWriter を作ります。"""
+    opened = []
+
+    class CountingFile(record_writer._HourlyFile):
+        def __init__(self, path, buffer_size):
+            opened.append(os.path.relpath(path, str(tmp_path)))
+            super().__init__(path, buffer_size)
+
+    monkeypatch.setattr(record_writer, "_HourlyFile", CountingFile)
+    writer = RecordWriter(lambda now=None: get_current_filename_prefix(str(tmp_path), now),
+                          flush_interval_sec=3600)
+    return writer, opened
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+def test_hour_boundary_does_not_reopen(tmp_path, monkeypatch):
+    writer, opened = make_writer(tmp_path, monkeypatch)
+    writer.start()
+    # 時間帯の境目の前後で、毎秒の記録と ts=hour_end の "_prefixes" の記録が交互に来る
+    for i in range(-5, 5):
+        writer.append({"i": i}, ts=HOUR_END + i)
+        writer.append({"i": i}, suffix="_prefixes", ts=HOUR_END)
+    writer.close()
+    assert opened == [os.path.join("2024-01-01", "10.csv"), os.path.join("2024-01-01", "11_prefixes.csv"),
+                      os.path.join("2024-01-01", "11.csv")]
+    assert read_rows(tmp_path / "2024-01-01" / "10.csv") == [["i"]] + [[str(i)] for i in range(-5, 0)]
+    assert read_rows(tmp_path / "2024-01-01" / "11.csv") == [["i"]] + [[str(i)] for i in range(5)]
+    assert read_rows(tmp_path / "2024-01-01" / "11_prefixes.csv") == [["i"]] + [[str(i)] for i in range(-5, 5)]
+
+def test_idle_hours_closed_on_flush(tmp_path, monkeypatch):
+    # スレッドを起動せずに、書き込みスレッドの処理を直接呼ぶ
+    writer, opened = make_writer(tmp_path, monkeypatch)
+    writer._handle(("row", HOUR_END - 1, "", ("i",), (0,)))
+    writer._handle(("row", HOUR_END, "", ("i",), (1,)))
+    writer._flush()
+    assert len(writer._files) == 2
+    # 次の書き出しまでに書き込みの無かった 10 時台のファイルだけ閉じる
+    writer._handle(("row", HOUR_END + 1, "", ("i",), (2,)))
+    writer._flush()
+    assert [f.path for f in writer._files.values()] == [str(tmp_path / "2024-01-01" / "11.csv")]
+    # 遅れて届いた 10 時台の行は、同じファイルに追記する (ヘッダーは書かない)
+    writer._handle(("row", HOUR_END - 1, "", ("i",), (3,)))
+    writer._close_files()
+    assert writer._files == {}
+    assert len(opened) == 3
+    assert read_rows(tmp_path / "2024-01-01" / "10.csv") == [["i"], ["0"], ["3"]]
+    assert read_rows(tmp_path / "2024-01-01" / "11.csv") == [["i"], ["1"], ["2"]]
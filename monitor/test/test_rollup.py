@@ -0,0 +1,129 @@
+# rollup.py の Compactor (ロールアップの冪等性と、保持期間による削除) のテスト
+#
+# Compactor.compact(now) に時刻を渡して、スレッドを起動せずに進めます。
+
+import os
+import sys
+import time
+import datetime
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefmoni"))
+
+import tsstore
+from rollup import ALL_DTYPES, Compactor, summarize
+from tsstore import TimeSeriesReader, TimeSeriesStore
+
+T0 = datetime.datetime(2024, 1, 1, 0, 0).timestamp()
+HOUR = 3600
+DAY = 86400
+KEEP = {"raw": 365, "1m": 365, "1h": 365}
+
+def write_raw(root, hours, step=10.0):
+    """T0 から hours 時間分の "second" と "content" (2 プレフィックス) の生データを書きます。"""
+    store = TimeSeriesStore(str(root), flush_interval_sec=60)
+    for i in range(int(hours * HOUR / step)):
+        ts = T0 + i * step
+        store.append("second", ts, {"avg_latency_ms": i % 50 + 1, "data_received_count": i})
+        for prefix in ("/iot", "/video"):
+            store.append("content", ts, {"avg_latency_ms": i % 7 + 1}, prefix=prefix)
+    store.close()
+
+def compact(root, *times, retention_days=KEEP):
+    compactor = Compactor(str(root), retention_days, grace_sec=30)
+    for now in times:
+        compactor.compact(now)
+    compactor.store.close()
+
+def rolled(root, stream):
+    return TimeSeriesReader(str(root), dtypes=ALL_DTYPES).query(stream)
+
+def snapshot_files(root):
+    files = {}
+    for dirpath, _, names in os.walk(str(root)):
+        for name in names:
+            with open(os.path.join(dirpath, name), "rb") as f:
+                files[os.path.relpath(os.path.join(dirpath, name), str(root))] = f.read()
+    return files
+
+def test_compact_twice(tmp_path):
+    write_raw(tmp_path, 3)
+    compact(tmp_path, T0 + 3 * HOUR + 120)
+    minutes = rolled(tmp_path, "second_1m")
+    hours = rolled(tmp_path, "second_1h")
+    assert minutes["ts"].tolist() == [T0 + 60 * i for i in range(180)]
+    assert set(minutes["count"].tolist()) == {6}
+    assert hours["ts"].tolist() == [T0, T0 + HOUR, T0 + 2 * HOUR]
+    assert hours["count"].tolist() == [360] * 3
+    assert len(rolled(tmp_path, "content_1m")) == 2 * 180
+
+    raw = rolled(tmp_path, "second")
+    stats = summarize(hours, "avg_latency_ms")
+    assert stats["count"] == len(raw)
+    assert stats["mean"] == pytest.approx(raw["avg_latency_ms"].mean())
+    assert (stats["min"], stats["max"]) == (1.0, 50.0)
+
+    # 同じ時刻でもう一度実行しても何も変わらない
+    before = snapshot_files(tmp_path)
+    compact(tmp_path, T0 + 3 * HOUR + 120)
+    assert snapshot_files(tmp_path) == before
+
+def test_compact_incremental(tmp_path):
+    write_raw(tmp_path / "once", 3)
+    write_raw(tmp_path / "steps", 3)
+    compact(tmp_path / "once", T0 + 3 * HOUR + 120)
+    # 途中の時刻 (猶予時間の内側や1時間の途中を含む) で少しずつ進めても、一度に行った結果と同じになる
+    compact(tmp_path / "steps", T0 + 45, T0 + 1000, T0 + HOUR + 20, T0 + 2 * HOUR + 3599, T0 + 3 * HOUR + 120)
+    for stream in ("second_1m", "second_1h", "content_1m", "content_1h"):
+        once, steps = rolled(tmp_path / "once", stream), rolled(tmp_path / "steps", stream)
+        assert once.tobytes() == steps.tobytes(), stream
+
+def test_retention_keeps_unrolled_raw(tmp_path):
+    write_raw(tmp_path, 3)
+    # 保持期間 0 日でも、猶予時間のためにまだロールアップしていない最後の1分を含む2時台の生データは消さない
+    compact(tmp_path, T0 + 3 * HOUR + 10, retention_days={"raw": 0, "1m": 0, "1h": 365})
+    assert tsstore.list_segments(str(tmp_path), "second") == ["2024010102"]
+    minutes = rolled(tmp_path, "second_1m")
+    assert minutes["ts"][-1] == T0 + 3 * HOUR - 120
+    # 残っている生データと1分の集計で、すべての期間がそろっている
+    raw = rolled(tmp_path, "second")
+    assert raw["ts"][0] == T0 + 2 * HOUR
+    assert minutes["count"].sum() + len(raw[raw["ts"] >= minutes["ts"][-1] + 60]) == 3 * HOUR // 10
+
+def test_retention_after_downtime(tmp_path):
+    # 何日も止まっていた後でも、先にロールアップしてから消す
+    write_raw(tmp_path, 3)
+    compact(tmp_path, T0 + 10 * DAY, retention_days={"raw": 3, "1m": 28, "1h": 365})
+    assert tsstore.list_segments(str(tmp_path), "second") == []
+    assert tsstore.list_segments(str(tmp_path), "content") == []
+    assert rolled(tmp_path, "second_1m")["count"].sum() == 3 * HOUR // 10
+    assert rolled(tmp_path, "content_1h")["count"].sum() == 2 * 3 * HOUR // 10
+
+@pytest.fixture
+def half_hour_tz(monkeypatch):
+    """日の区切りが UTC の正時からずれるタイムゾーン (UTC+5:30)"""
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def test_retention_keeps_unrolled_minutes(tmp_path, half_hour_tz):
+    # 1分の集計の日ごとのセグメントは現地時刻の 0 時 (UTC の xx:30) で終わるので、
+    # 1時間の集計が済んでいない最後の 30 分があるうちは保持期間 0 日でも消さない
+    day_end = datetime.datetime(2024, 1, 2, 0, 0).timestamp()
+    store = TimeSeriesStore(str(tmp_path), flush_interval_sec=60)
+    for i in range(25 * 60):
+        store.append("second", day_end - DAY + i * 60, {"avg_latency_ms": 1})
+    store.close()
+    retention = {"raw": 0, "1m": 0, "1h": 365}
+    compact(tmp_path, day_end + 40, day_end + 100, retention_days=retention)
+    assert tsstore.list_segments(str(tmp_path), "second_1m") == ["20240101", "20240102"]
+    compact(tmp_path, day_end + 1800 + 100, retention_days=retention)
+    assert tsstore.list_segments(str(tmp_path), "second_1m") == ["20240102"]
+    hours = rolled(tmp_path, "second_1h")
+    # 最初の 30 分から day_end + 30 分までの分がすべて1時間の集計に入っている
+    assert hours["count"].tolist() == [30] + [60] * 24
@@ -0,0 +1,33 @@
+# supervisor.py のプレフィックスの割り当てのテスト
+
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefmoni"))
+
+from supervisor import shard_prefixes
+
+@pytest.mark.parametrize("n_prefixes, n_workers", [(4, 4), (24, 12), (25, 12), (7, 3), (100, 16)])
+def test_shard_prefixes_balanced(n_prefixes, n_workers):
+    prefixes = [f"/p{i}" for i in range(n_prefixes)]
+    shards = shard_prefixes(prefixes, n_workers)
+    sizes = [len(s) for s in shards]
+    assert len(shards) == n_workers
+    # プレフィックスがワーカー数以上あれば空のワーカーはなく、担当数の差は高々1
+    assert min(sizes) >= 1
+    assert max(sizes) - min(sizes) <= 1
+    assert sorted(p for s in shards for p in s) == sorted(prefixes)
+
+def test_shard_prefixes_known_list():
+    assert shard_prefixes(["/video", "/iot", "/b", "/a"], 4) == [["/a"], ["/b"], ["/iot"], ["/video"]]
+
+def test_shard_prefixes_fewer_prefixes():
+    shards = shard_prefixes(["/a", "/b"], 4)
+    assert shards == [["/a"], ["/b"], [], []]
+
+def test_shard_prefixes_order_independent():
+    prefixes = [f"/p{i}" for i in range(10)]
+    assert shard_prefixes(prefixes, 3) == shard_prefixes(list(reversed(prefixes)), 3)
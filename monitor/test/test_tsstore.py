@@ -0,0 +1,125 @@
+# tsstore.py (セグメントと時刻索引の形式、スキーマの変更、古いセグメントの削除) のテスト
+
+import os
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "cefmoni"))
+
+import tsstore
+from tsstore import INDEX_DTYPE, INDEX_STRIDE, TimeSeriesReader, TimeSeriesStore
+
+T0 = datetime.datetime(2024, 1, 1, 0, 0).timestamp()  # 時刻はセグメント名と同じくローカル時刻で区切る
+PREFIXES = ("/iot", "/iot/a", "/iot/b/c", "/iota", "/video")
+
+# "second" に p50/p99 を足す前のスキーマ
+OLD_SECOND_DTYPE = np.dtype([d for d in tsstore.SECOND_DTYPE.descr if d[0] not in ("p50_latency_ms", "p99_latency_ms")])
+
+def write_content(root, n_per_prefix=200, step=30.0):
+    """PREFIXES のそれぞれに step 秒ごとのレコードを書き、書いた (時刻, プレフィックス, 遅延) のリストを返します。"""
+    store = TimeSeriesStore(str(root), flush_interval_sec=0)
+    written = []
+    for i in range(n_per_prefix):
+        for k, prefix in enumerate(PREFIXES):
+            ts = T0 + i * step + k
+            latency = i + k / 10
+            store.append("content", ts, {"avg_latency_ms": latency, "total_data_received_count": i}, prefix=prefix)
+            written.append((ts, prefix, latency))
+    store.close()
+    return written
+
+def test_segment_layout(tmp_path):
+    written = write_content(tmp_path)
+    names = tsstore.list_segments(str(tmp_path), "content")
+    # 200 * 30 秒 = 100 分なので、1時間ごとのセグメントが2つ
+    assert names == ["2024010100", "2024010101"]
+    total = 0
+    for name in names:
+        base = os.path.join(str(tmp_path), "content", name)
+        records = tsstore.open_segment(base + ".seg")
+        index = np.fromfile(base + ".idx", dtype=INDEX_DTYPE)
+        # INDEX_STRIDE レコードごとに (時刻, レコード番号) が1件
+        assert index["rec"].tolist() == list(range(0, len(records), INDEX_STRIDE))
+        assert index["ts"].tolist() == records["ts"][::INDEX_STRIDE].tolist()
+        start, end = tsstore._segment_range(name)
+        assert start <= records["ts"].min() and records["ts"].max() < end
+        total += len(records)
+    assert total == len(written)
+
+@pytest.mark.parametrize("prefix, t0, t1", [
+    (None, None, None),
+    ("/iot", None, None),
+    ("/iot/", T0 + 1000, T0 + 4000),
+    ("/iot/b", None, T0 + 3600),
+    ("/video", T0 + 3599, T0 + 3601),
+    ("/nothing", None, None),
+])
+def test_query(tmp_path, prefix, t0, t1):
+    written = write_content(tmp_path)
+    records = TimeSeriesReader(str(tmp_path)).query("content", t0, t1, prefix)
+    base = None if prefix is None else prefix.rstrip("/")
+    expected = [(ts, latency) for ts, p, latency in written
+                if (t0 is None or ts >= t0) and (t1 is None or ts < t1)
+                and (base is None or p == base or p.startswith(base + "/"))]
+    assert list(zip(records["ts"].tolist(), records["avg_latency_ms"].tolist())) == expected
+
+def test_reopen_appends(tmp_path):
+    written = write_content(tmp_path, n_per_prefix=10)
+    path = os.path.join(str(tmp_path), "content", "2024010100.seg")
+    # 書き込み途中で止まったときの半端なレコードは、次に開いたときに切り捨てる
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)
+    store = TimeSeriesStore(str(tmp_path), flush_interval_sec=0)
+    store.append("content", T0 + 600, {"avg_latency_ms": 99.0}, prefix="/iot")
+    store.close()
+    records = TimeSeriesReader(str(tmp_path)).query("content")
+    assert len(records) == len(written) + 1
+    assert records["avg_latency_ms"][-1] == 99.0
+    # プレフィックスの ID は開き直しても同じものを使う
+    assert records["prefix_id"][-1] == records["prefix_id"][0]
+
+def test_schema_change(tmp_path):
+    root = str(tmp_path)
+    old = TimeSeriesStore(root, flush_interval_sec=0, dtypes={"second": OLD_SECOND_DTYPE})
+    for i in range(3):
+        old.append("second", T0 + i, {"avg_latency_ms": 1.0 + i})  # 0時台 (このあと追記しない)
+        old.append("second", T0 + 3600 + i, {"avg_latency_ms": 10.0 + i})  # 1時台 (このあと追記する)
+    old.close()
+
+    store = TimeSeriesStore(root, flush_interval_sec=0)
+    store.append("second", T0 + 3600 + 3, {"avg_latency_ms": 13.0, "p50_latency_ms": 5.0, "p99_latency_ms": 9.0})
+    store.close()
+
+    # 追記したセグメントは新しいスキーマで書き直され、触れていないセグメントは古いまま
+    first = tsstore.open_segment(os.path.join(root, "second", "2024010100.seg"))
+    second = tsstore.open_segment(os.path.join(root, "second", "2024010101.seg"))
+    assert first.dtype == OLD_SECOND_DTYPE
+    assert second.dtype == tsstore.SECOND_DTYPE
+    index = np.fromfile(os.path.join(root, "second", "2024010101.idx"), dtype=INDEX_DTYPE)
+    assert index["rec"].tolist() == [0]
+
+    records = TimeSeriesReader(root).query("second")
+    assert records.dtype == tsstore.SECOND_DTYPE
+    assert records["avg_latency_ms"].tolist() == [1.0, 2.0, 3.0, 10.0, 11.0, 12.0, 13.0]
+    # 古いレコードには無かった項目は 0
+    assert records["p50_latency_ms"].tolist() == [0.0] * 6 + [5.0]
+
+def test_drop_before(tmp_path):
+    root = str(tmp_path)
+    store = TimeSeriesStore(root, flush_interval_sec=0)
+    for hour in range(4):
+        store.append("second", T0 + hour * 3600, {"avg_latency_ms": hour})
+    # 終わりが cutoff より前のセグメントだけを消す (2時台は cutoff の時点でまだ終わっていない)
+    assert store.drop_before("second", T0 + 2.5 * 3600) == 2
+    assert tsstore.list_segments(root, "second") == ["2024010102", "2024010103"]
+    assert not os.path.exists(os.path.join(root, "second", "2024010100.idx"))
+    # 書き込み中のセグメントは消さない
+    assert store.drop_before("second", T0 + 10 * 3600) == 1
+    assert tsstore.list_segments(root, "second") == ["2024010103"]
+    store.append("second", T0 + 3 * 3600 + 1, {"avg_latency_ms": 3.5})
+    store.close()
+    assert TimeSeriesReader(root).query("second")["avg_latency_ms"].tolist() == [3.0, 3.5]